@@ -0,0 +1,6 @@
+'''
+Benchmarks of the orchestration layer of corec (planning, parameter store, report, locks, startup)
+
+python -m benchmarks --output results.json
+python -m benchmarks --compare results.json
+'''
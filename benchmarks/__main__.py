@@ -0,0 +1,54 @@
+'''
+Run all benchmarks. Save the results to compare them with the results of another version.
+
+python -m benchmarks --output results_new.json --compare results_old.json
+python -m benchmarks --only planning store --steps 5000 --diamond-depth 10
+'''
+
+from __future__ import print_function
+
+import argparse
+
+from benchmarks import bench_planning, bench_store, bench_report, bench_locks, bench_startup
+from benchmarks.common import print_results, save_results, compare_results
+from benchmarks.generate import add_arguments, pipeline_from_arguments
+
+BENCHMARKS = ['planning', 'store', 'report', 'locks', 'startup']
+
+def run(args):
+	reports = []
+	for benchmark in args.only or BENCHMARKS:
+		if benchmark == 'planning':
+			report = bench_planning.run(pipeline_from_arguments(args), args.repeat)
+		elif benchmark == 'store':
+			report = bench_store.run(1000, 200, args.repeat)
+		elif benchmark == 'report':
+			report = bench_report.run([100, 1000, 5000], args.repeat)
+		elif benchmark == 'locks':
+			report = bench_locks.run(100, 200, args.repeat)
+		elif benchmark == 'startup':
+			report = bench_startup.run(args.startup_steps, args.repeat)
+
+		print_results(report)
+		reports.append(report)
+
+	return reports
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmarks of corec')
+	parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help='Run only these benchmarks')
+	add_arguments(parser)
+	parser.add_argument('--startup-steps', type=int, default=20000, help='Steps of the pipeline.json of the startup benchmark')
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--output', required=False, help='Save the results in this json file')
+	parser.add_argument('--compare', required=False, help='Compare with the results saved in this json file')
+	args = parser.parse_args()
+
+	reports = run(args)
+
+	if args.output:
+		save_results(reports, args.output)
+		print ('Results saved in: {}'.format(args.output))
+
+	if args.compare:
+		compare_results(reports, args.compare)
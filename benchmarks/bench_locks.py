@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+
+'''
+Lock operations: every lock is a holder process with a flock (see MANAGE LOCKS in corec_tools.py)
+
+python -m benchmarks.bench_locks --locks 100 --operations 200
+'''
+
+from __future__ import print_function
+
+import argparse
+
+from benchmarks.common import import_corec_tools, corec_run, measure, print_results
+
+def run(locks, operations, repeat):
+	corec_tools = import_corec_tools()
+	results = []
+
+	with corec_run(corec_tools):
+		set_lock, get_lock = corec_tools.set_lock_value, corec_tools.get_lock_value
+		try:
+			corec_tools.reset_locks()
+
+			def lock_unlock():
+				for i in range(operations):
+					set_lock('L{}'.format(i % locks), True)
+					set_lock('L{}'.format(i % locks), False)
+			def get_locks():
+				for i in range(operations):
+					get_lock('L{}'.format(i % locks))
+
+			results.append(measure('lock + unlock', lock_unlock, repeat, operations))
+			results.append(measure('get_lock', get_locks, repeat, operations))
+		finally:
+			corec_tools.reset_locks()
+
+	return {
+		'benchmark': 'locks',
+		'locks': locks,
+		'operations': operations,
+		'repeat': repeat,
+		'results': results,
+	}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Lock operations')
+	parser.add_argument('--locks', type=int, default=100, help='Number of locks')
+	parser.add_argument('--operations', type=int, default=200, help='Operations in every repetition')
+	parser.add_argument('--repeat', type=int, default=5)
+	args = parser.parse_args()
+
+	print_results(run(args.locks, args.operations, args.repeat))
@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+
+'''
+Planning of a generated pipeline: indexing, get_notset_*, compile_plan, the plan of one target and a whole run in mock mode
+
+python -m benchmarks.bench_planning --steps 5000 --fan-in 3 --diamond-depth 10 --repeat 5
+'''
+
+from __future__ import print_function
+
+import os
+import json
+import argparse
+
+from benchmarks.common import import_corec_tools, corec_run, measure, print_results
+from benchmarks.generate import add_arguments, pipeline_from_arguments
+
+def run(pipeline, repeat):
+	corec_tools = import_corec_tools()
+	results = []
+
+	pipeline_json = json.dumps(pipeline)
+	results.append(measure('json.loads(pipeline.json)', lambda: json.loads(pipeline_json), repeat))
+	results.append(measure('PipelineGraph', lambda: corec_tools.PipelineGraph(pipeline), repeat))
+
+	graph = corec_tools.PipelineGraph(pipeline)
+	results.append(measure('get_notset_parameters', lambda: corec_tools.get_notset_parameters(graph), repeat))
+	results.append(measure('get_notset_outputs', lambda: corec_tools.get_notset_outputs(graph), repeat))
+
+	output_nodes = corec_tools.get_notset_outputs(graph)
+	def compile_plan():
+		step_nodes = []
+		for output_node in output_nodes:
+			step_nodes.extend(corec_tools.get_output_steps(graph, output_node))
+		return corec_tools.compile_plan(graph, step_nodes)
+	results.append(measure('compile_plan (all outputs)', compile_plan, repeat))
+
+	# corec_init --target of a single output
+	target_steps = corec_tools.get_output_steps(graph, output_nodes[-1])
+	results.append(measure('compile_minimal_plan (one output)', lambda: corec_tools.compile_minimal_plan(graph, target_steps), repeat))
+
+	# A whole run in mock mode. Includes journal, progress and report bookkeeping of every step
+	input_values = dict((corec_tools.get_id(node), 'value') for node in corec_tools.get_notset_parameters(graph))
+	with corec_run(corec_tools, pipeline):
+		def remove_pipeline_cache():
+			if os.path.exists(corec_tools.defaults['pipeline_cache_filename']):
+				os.remove(corec_tools.defaults['pipeline_cache_filename'])
+		results.append(measure('load_pipeline (compile)', corec_tools.load_pipeline, repeat, setup=remove_pipeline_cache))
+		results.append(measure('load_pipeline (cached)', corec_tools.load_pipeline, repeat))
+
+		corec_tools.defaults['mock'] = True
+		corec_tools.defaults['cache'] = False
+		def setup():
+			corec_tools.get_parameter_store().set_many(input_values)
+			corec_tools.report_init()
+			corec_tools.journal_reset()
+		results.append(measure('execute_pipeline (mock)', lambda: corec_tools.execute_pipeline(corec_tools.PipelineGraph(pipeline)), repeat, setup=setup))
+
+	return {
+		'benchmark': 'planning',
+		'nodes': len(pipeline['elements']['nodes']),
+		'edges': len(pipeline['elements']['edges']),
+		'steps': len(graph.get_nodes('Step')),
+		'plan_steps': len(compile_plan()),
+		'target_plan_steps': len(corec_tools.compile_minimal_plan(graph, target_steps)),
+		'repeat': repeat,
+		'results': results,
+	}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Planning time of a generated pipeline')
+	add_arguments(parser)
+	parser.add_argument('--repeat', type=int, default=5)
+	args = parser.parse_args()
+
+	print_results(run(pipeline_from_arguments(args), args.repeat))
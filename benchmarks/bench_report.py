@@ -0,0 +1,47 @@
+#! /usr/bin/env python
+
+'''
+Cost of report_add as the report grows
+
+python -m benchmarks.bench_report --sizes 100 1000 5000
+'''
+
+from __future__ import print_function
+
+import argparse
+
+from benchmarks.common import import_corec_tools, corec_run, measure, print_results
+
+def run(sizes, repeat):
+	corec_tools = import_corec_tools()
+	results = []
+
+	with corec_run(corec_tools):
+		with open('artifact.txt', 'w') as f:
+			f.write('line\n' * 1000)
+
+		for size in sizes:
+			def add_strings():
+				for i in range(size):
+					corec_tools.report_add('Step S{} finished {{}}'.format(i))
+			results.append(measure('report_add strings ({})'.format(size), add_strings, repeat, size, setup=corec_tools.report_init))
+			results.append(measure('report_finalize ({})'.format(size), corec_tools.report_finalize, 1, size))
+
+		def add_file():
+			corec_tools.report_add('artifact.txt')
+		results.append(measure('report_add text file', add_file, repeat))
+
+	return {
+		'benchmark': 'report',
+		'sizes': sizes,
+		'repeat': repeat,
+		'results': results,
+	}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Cost of report_add as the report grows')
+	parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000], help='Number of report_add calls')
+	parser.add_argument('--repeat', type=int, default=3)
+	args = parser.parse_args()
+
+	print_results(run(args.sizes, args.repeat))
@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+
+'''
+Startup time of the corec commands against a large pipeline.json
+
+python -m benchmarks.bench_startup --steps 20000 --repeat 10 --output startup.json
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+from benchmarks.common import COREC_DIR, temp_dir, print_results, save_results
+from benchmarks.generate import chain_pipeline
+
+COMMANDS = [
+	['corec_get', 'P0'],
+	['corec_set', 'P0', 'value'],
+	['corec_lock', 'L'],
+	['corec_unlock', 'L'],
+	['corec_get_lock', 'L'],
+]
+
+def time_command(command, repeat):
+	timings = []
+	with open(os.devnull, 'w') as devnull:
+		for _ in range(repeat):
+			start = time.time()
+			subprocess.check_call([sys.executable] + command, stdout=devnull, stderr=devnull)
+			timings.append(time.time() - start)
+
+	timings.sort()
+	return {
+		'name': ' '.join([os.path.basename(command[0])] + command[1:]),
+		'median_ms': 1000 * timings[len(timings)//2],
+		'min_ms': 1000 * timings[0],
+		'operations': 1,
+		'operations_per_second': None,
+	}
+
+def run(steps, repeat):
+	pipeline = chain_pipeline(steps)
+	with temp_dir():
+		with open('pipeline.json', 'w') as f:
+			json.dump(pipeline, f)
+
+		# Baseline: interpreter startup
+		results = [time_command(['-c', 'pass'], repeat)]
+		for command in COMMANDS:
+			results.append(time_command([os.path.join(COREC_DIR, command[0])] + command[1:], repeat))
+
+	return {
+		'benchmark': 'startup',
+		'steps': steps,
+		'pipeline_bytes': len(json.dumps(pipeline)),
+		'repeat': repeat,
+		'results': results,
+	}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Startup time of corec commands')
+	parser.add_argument('--steps', type=int, default=20000, help='Number of steps in the generated pipeline.json')
+	parser.add_argument('--repeat', type=int, default=10, help='Times to run every command')
+	parser.add_argument('--output', required=False, help='Save the results in this json file')
+	args = parser.parse_args()
+
+	report = run(args.steps, args.repeat)
+	print_results(report)
+
+	if args.output:
+		save_results([report], args.output)
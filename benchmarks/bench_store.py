@@ -0,0 +1,53 @@
+#! /usr/bin/env python
+
+'''
+Throughput of the parameter stores
+
+python -m benchmarks.bench_store --parameters 1000 --operations 200
+'''
+
+from __future__ import print_function
+
+import argparse
+
+from benchmarks.common import import_corec_tools, corec_run, measure, print_results
+
+def run(parameters, operations, repeat):
+	corec_tools = import_corec_tools()
+	results = []
+
+	values = dict(('P{}'.format(i), 'value {}'.format(i)) for i in range(parameters))
+	for store_name in ['json', 'sqlite']:
+		with corec_run(corec_tools):
+			corec_tools.defaults['parameter_store'] = store_name
+			store = corec_tools.get_parameter_store()
+			store.set_many(values)
+
+			def set_parameters():
+				for i in range(operations):
+					store.set('P{}'.format(i % parameters), i)
+			def get_parameters():
+				for i in range(operations):
+					store.get('P{}'.format(i % parameters))
+
+			results.append(measure('{} set'.format(store_name), set_parameters, repeat, operations))
+			results.append(measure('{} get'.format(store_name), get_parameters, repeat, operations))
+			results.append(measure('{} set_many ({})'.format(store_name, parameters), lambda: store.set_many(values), repeat, parameters))
+			results.append(measure('{} get_all ({})'.format(store_name, parameters), store.get_all, repeat, parameters))
+
+	return {
+		'benchmark': 'store',
+		'parameters': parameters,
+		'operations': operations,
+		'repeat': repeat,
+		'results': results,
+	}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Throughput of the parameter stores')
+	parser.add_argument('--parameters', type=int, default=1000, help='Parameters in the store')
+	parser.add_argument('--operations', type=int, default=200, help='get / set calls in every repetition')
+	parser.add_argument('--repeat', type=int, default=5)
+	args = parser.parse_args()
+
+	print_results(run(args.parameters, args.operations, args.repeat))
@@ -0,0 +1,125 @@
+'''
+Helpers shared by the benchmarks
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import contextlib
+
+COREC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def import_corec_tools():
+	if not COREC_DIR in sys.path:
+		sys.path.insert(0, COREC_DIR)
+
+	import corec_tools
+	return corec_tools
+
+@contextlib.contextmanager
+def temp_dir():
+	'''
+	Run in a new empty directory that is deleted afterwards
+	'''
+	cwd = os.getcwd()
+	directory = tempfile.mkdtemp(prefix='corec_bench_')
+	try:
+		os.chdir(directory)
+		yield directory
+	finally:
+		os.chdir(cwd)
+		shutil.rmtree(directory)
+
+@contextlib.contextmanager
+def corec_run(corec_tools, pipeline=None):
+	'''
+	A clean corec state (parameters, locks, report) in a temp directory.
+	'''
+	saved_defaults = dict(corec_tools.defaults)
+	with temp_dir() as directory:
+		if pipeline is not None:
+			with open(corec_tools.defaults['pipeline_filename'], 'w') as f:
+				json.dump(pipeline, f)
+		corec_tools.defaults['parameters'] = {}
+		corec_tools.defaults['completed_steps'] = set()
+		corec_tools._parameter_stores.clear()
+		try:
+			yield directory
+		finally:
+			corec_tools._parameter_stores.clear()
+			corec_tools.defaults.clear()
+			corec_tools.defaults.update(saved_defaults)
+
+def measure(name, function, repeat, operations=1, setup=None):
+	'''
+	Run function repeat times. setup (not timed) runs before every repetition.
+	operations: how many operations one call of function does.
+	'''
+	timings = []
+	for _ in range(repeat):
+		if setup:
+			setup()
+		start = time.time()
+		function()
+		timings.append(time.time() - start)
+
+	timings.sort()
+	median = timings[len(timings)//2]
+	return {
+		'name': name,
+		'median_ms': 1000 * median,
+		'min_ms': 1000 * timings[0],
+		'operations': operations,
+		'operations_per_second': operations / median if median else None,
+	}
+
+def print_results(report):
+	print ('{}:'.format(report['benchmark']))
+	for result in report['results']:
+		line = '  {:<45} median: {:10.2f} ms  min: {:10.2f} ms'.format(result['name'], result['median_ms'], result['min_ms'])
+		if result['operations'] > 1 and result['operations_per_second']:
+			line += '  {:12.0f} ops/s'.format(result['operations_per_second'])
+		print (line)
+
+def save_results(reports, filename):
+	import platform
+	import subprocess
+
+	try:
+		with open(os.devnull, 'w') as devnull:
+			commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=COREC_DIR, stderr=devnull).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+
+	with open(filename, 'w') as f:
+		json.dump({
+			'time': time.time(),
+			'commit': commit,
+			'python': sys.version.split()[0],
+			'platform': ' '.join(platform.uname()),
+			'benchmarks': reports,
+		}, f, indent=4)
+
+def compare_results(reports, filename):
+	'''
+	Print the ratio of the median times of these results to the results saved in filename
+	'''
+	with open(filename) as f:
+		previous = json.load(f)
+
+	print ('Compared to {} (commit: {}):'.format(filename, previous.get('commit')))
+	previous_medians = {}
+	for report in previous['benchmarks']:
+		for result in report['results']:
+			previous_medians[(report['benchmark'], result['name'])] = result['median_ms']
+
+	for report in reports:
+		for result in report['results']:
+			key = (report['benchmark'], result['name'])
+			if not key in previous_medians or not previous_medians[key]:
+				continue
+			ratio = result['median_ms'] / previous_medians[key]
+			print ('  {:<15} {:<45} {:8.2f} ms --> {:8.2f} ms  x{:.2f}'.format(key[0], key[1], previous_medians[key], result['median_ms'], ratio))
@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+
+'''
+Synthetic pipeline.json files in the format that corec_tools expects:
+
+{"elements": {"nodes": [{"data": {"id": ..., "kind": "Step"|"Parameter"|"Output", ...}}], "edges": [{"data": {"source": ..., "target": ..., "kind": ...}}]}}
+
+python -m benchmarks.generate --steps 1000 --fan-in 3 --fan-out 2 --diamond-depth 5 --parameters 20 pipeline.json
+'''
+
+from __future__ import print_function
+
+import json
+import random
+import argparse
+
+def step_node(id_, output_ids):
+	bash_commands = ''.join('corec_set {} {}\n'.format(output_id, output_id) for output_id in output_ids)
+	return {'data': {'id': id_, 'kind': 'Step', 'bash_commands': bash_commands}}
+
+def edge(source, target, kind):
+	return {'data': {'id': '{}_{}'.format(source, target), 'source': source, 'target': target, 'kind': kind}}
+
+def generate_pipeline(steps, fan_in=1, fan_out=1, diamond_depth=0, parameters=0, window=None, seed=0):
+	'''
+	steps: Total number of steps.
+	fan_in: Parameters that every step needs from the outputs of earlier steps.
+	fan_out: Parameters that every step sets. In diamonds: branches of every diamond.
+	diamond_depth: The pipeline starts with this many chained diamonds
+		(one step splits into fan_out branches that one step merges).
+	parameters: Input parameters that no step sets. They are distributed over the steps.
+	window: The inputs of a step come from the outputs of the last window steps. None: from all earlier steps.
+		fan_in=1, fan_out=1, window=1 is a chain.
+
+	Parameters that no step needs are Outputs.
+	'''
+	rng = random.Random(seed)
+	step_ids = []
+	step_inputs = {} # step id --> [parameter ids]
+	step_outputs = {} # step id --> [parameter ids]
+
+	def add_step(inputs, outputs_count):
+		id_ = 'S{}'.format(len(step_ids))
+		step_ids.append(id_)
+		step_inputs[id_] = inputs
+		step_outputs[id_] = ['{}_P{}'.format(id_, i) for i in range(outputs_count)]
+		return id_
+
+	# Diamonds
+	previous_outputs = []
+	for _ in range(diamond_depth):
+		if len(step_ids) + fan_out + 2 > steps:
+			break
+		split = add_step(previous_outputs, fan_out)
+		branches = [add_step([output_id], 1) for output_id in step_outputs[split]]
+		merge = add_step([step_outputs[branch][0] for branch in branches], 1)
+		previous_outputs = step_outputs[merge]
+
+	# Random DAG. Only inputs from earlier steps, so there are no cycles
+	diamond_steps = len(step_ids)
+	while len(step_ids) < steps:
+		candidates = step_ids[-window:] if window else step_ids
+		available = [output_id for candidate in candidates for output_id in step_outputs[candidate]]
+		if len(step_ids) == diamond_steps and previous_outputs:
+			inputs = list(previous_outputs)
+		else:
+			inputs = rng.sample(available, min(fan_in, len(available)))
+		add_step(inputs, fan_out)
+
+	# Input parameters
+	input_ids = ['I{}'.format(i) for i in range(parameters)]
+	for i, input_id in enumerate(input_ids):
+		step_inputs[step_ids[i % len(step_ids)]].append(input_id)
+
+	needed = set(parameter_id for inputs in step_inputs.values() for parameter_id in inputs)
+	nodes = []
+	edges = []
+	for input_id in input_ids:
+		nodes.append({'data': {'id': input_id, 'kind': 'Parameter'}})
+
+	for id_ in step_ids:
+		nodes.append(step_node(id_, step_outputs[id_]))
+		for output_id in step_outputs[id_]:
+			nodes.append({'data': {'id': output_id, 'kind': 'Parameter' if output_id in needed else 'Output'}})
+			edges.append(edge(id_, output_id, 'Sets_Outputs'))
+		for input_id in step_inputs[id_]:
+			edges.append(edge(id_, input_id, 'Needs_Parameter'))
+
+	return {'elements': {'nodes': nodes, 'edges': edges}}
+
+def chain_pipeline(steps):
+	'''
+	step 0 --> parameter 0 --> step 1 --> parameter 1 ... --> output
+	'''
+	return generate_pipeline(steps, fan_in=1, fan_out=1, window=1)
+
+def add_arguments(parser, steps=1000):
+	parser.add_argument('--steps', type=int, default=steps, help='Number of steps')
+	parser.add_argument('--fan-in', type=int, default=2, help='Parameters that every step needs from earlier steps')
+	parser.add_argument('--fan-out', type=int, default=2, help='Parameters that every step sets / branches of every diamond')
+	parser.add_argument('--diamond-depth', type=int, default=0, help='Number of chained diamonds at the start of the pipeline')
+	parser.add_argument('--parameters', type=int, default=10, help='Input parameters that no step sets')
+	parser.add_argument('--window', type=int, required=False, help='Inputs come from the outputs of the last WINDOW steps')
+	parser.add_argument('--seed', type=int, default=0)
+
+def pipeline_from_arguments(args):
+	return generate_pipeline(args.steps, fan_in=args.fan_in, fan_out=args.fan_out, diamond_depth=args.diamond_depth,
+		parameters=args.parameters, window=args.window, seed=args.seed)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Generate a synthetic pipeline.json')
+	add_arguments(parser)
+	parser.add_argument('output', help='pipeline json file')
+	args = parser.parse_args()
+
+	pipeline = pipeline_from_arguments(args)
+	with open(args.output, 'w') as f:
+		json.dump(pipeline, f, indent=4)
+
+	print ('Nodes: {} Edges: {}'.format(len(pipeline['elements']['nodes']), len(pipeline['elements']['edges'])))
@@ -1,51 +1,52 @@
 
-import json
+import os
+import sys
 
-def corec_set(parameter, value):
-
-	params_fn = "corec_parameters.json"
+# corec_tools.py lives next to this file
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-	with open(params_fn) as f:
-		params = json.load(f)
+from corec_tools import get_parameter, get_parameters, update_parameters, save_parameter, blob_open, is_blob_reference, get_parameter_store, set_lock, unset_lock
 
-	params[parameter] = value
+def corec_set(parameter, value):
 
-	with open(params_fn, 'w') as f:
-		json.dump(params, f, indent=4)
+	save_parameter(parameter, value, False)
 
 def corec_get(parameter):
 
-	params_fn = "corec_parameters.json"
-
-	with open(params_fn) as f:
-		params = json.load(f)
+	return get_parameter(parameter)
 
-	if parameter in params:
-		return params[parameter]
+def corec_get_mmap(parameter):
+	'''
+	A read only mmap of the json encoding of a value that is stored out of line. None for other values
+	'''
 
+	value = get_parameter_store().get(parameter)
+	if is_blob_reference(value):
+		return blob_open(value)
 	return None
 
-def corec_lock(lock):
-	locks_fn = "corec_locks.json"
+def corec_set_many(values):
+	'''
+	values is a dictionary. One update of the store for all of them
+	'''
 
-	with open(locks_fn) as f:
-		locks = json.load(f)
+	update_parameters(values)
 
-	locks[lock] = True
+def corec_get_many(parameters):
+	'''
+	A dictionary with the values of the parameters. Unset parameters are None
+	'''
 
-	with open(locks_fn, 'w') as f:
-		json.dump(locks, f, indent=4)
+	values = get_parameters(parameters)
+	return dict((parameter, values.get(parameter)) for parameter in parameters)
 
-def corec_unlock(lock):
-        locks_fn = "corec_locks.json"
+def corec_lock(lock):
 
-        with open(locks_fn) as f:
-                locks = json.load(f)
+	set_lock(lock)
 
-        locks[lock] = False
+def corec_unlock(lock):
 
-        with open(locks_fn, 'w') as f:
-                json.dump(locks, f, indent=4)
+	unset_lock(lock)
 
 
 
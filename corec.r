@@ -10,31 +10,38 @@ if (! rjson_exists) {
 
 library(rjson);
 
+# Parameters and locks go through the corec command line tools
+# so that they use the same parameter store as the pipeline
+
 corec_get <- function(parameter) {
-	json_data <- fromJSON(file="corec_parameters.json");
-	return(json_data[[parameter]]);
+	json_str <- system2('corec_get', c('--json', shQuote(parameter)), stdout=TRUE);
+	return(fromJSON(paste(json_str, collapse='\n')));
 }
 
 corec_set <- function(parameter, value) {
-	json_data <- fromJSON(file="corec_parameters.json");
-	json_data[parameter] <- value;
+	system2('corec_set', c('--json', shQuote(parameter), shQuote(toJSON(value))), stdout=FALSE);
+}
 
-	json_str <- toJSON(json_data);
-	write(json_str, 'corec_parameters.json');
+# parameters is a vector of names. Returns a list. Unset parameters are NULL
+corec_get_many <- function(parameters) {
+	json_str <- system2('corec_get', c('--json', shQuote(parameters)), stdout=TRUE);
+	values <- fromJSON(paste(json_str, collapse='\n'));
+	if (length(parameters) == 1) {
+		# corec_get --json of a single parameter prints only its value
+		values <- setNames(list(values), parameters);
+	}
+	return(values);
 }
 
-corec_lock <- function(lock) {
-	json_data <- fromJSON(file="corec_locks.json");
-	json_data[lock] <- TRUE;
+# values is a named list. All of them are set with one update
+corec_set_many <- function(values) {
+	system2('corec_set', '-', input=toJSON(values), stdout=FALSE);
+}
 
-	json_str <- toJSON(json_data);
-	write(json_str, 'corec_parameters.json');
+corec_lock <- function(lock) {
+	system2('corec_lock', shQuote(lock), stdout=FALSE);
 }
 
 corec_unlock <- function(lock) {
-	json_data <- fromJSON(file="corec_locks.json");
-	json_data[lock] <- FALSE;
-
-	json_str <- toJSON(json_data);
-	write(json_str, 'corec_parameters.json');
+	system2('corec_unlock', shQuote(lock), stdout=FALSE);
 }
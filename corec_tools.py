@@ -1,21 +1,24 @@
 from __future__ import print_function
 
+# Only light modules are imported here. corec_get, corec_set and the lock commands start
+# a new interpreter every time they are called. Heavy modules are imported where they are used.
 import os
-import cgi
 import sys
 import json
 import time
-import uuid
 import errno 
 import logging
-import tarfile
 import datetime
-import platform 
-import subprocess
+import threading
 
-from shutil import copyfile
+try:
+	import fcntl
+except ImportError:
+	# Not available in Windows. Only threads of the same process are synchronized
+	fcntl = None
 
-logging.basicConfig(level=logging.DEBUG)
+def setup_logging():
+	logging.basicConfig(level=logging.DEBUG)
 
 # CHECK VERSION
 if sys.version_info[0] == 2:
@@ -25,24 +28,86 @@ if sys.version_info[0] == 2:
 		
 defaults = {
 	'parameters_filename': 'corec_parameters.json',
+	'parameters_sqlite_filename': 'corec_parameters.sqlite',
+	'parameter_store': None, # json or sqlite. None: sqlite if the sqlite file exists, otherwise json
+	'blob_dir': 'corec_blobs', # Parameter values larger than blob_threshold_bytes (json encoded) are stored here
+	'blob_threshold_bytes': 64 * 1024, # None: store all values in the parameter store
 	'locks_filename': 'corec_locks.json',
+	'locks_dir': 'corec_locks', # The files that the lock holders flock
+	'lock_holder_interval': 1.0, # Seconds between the checks of a lock holder for the process group that owns the lock
+	'lock_timeout': None, # Seconds to wait for the release of locks. None: wait forever
 	'exit_on_non_zero_return_code' : True,
 	'pipeline_filename': 'pipeline.json',
+	'pipeline_cache_filename': 'corec_pipeline.cache', # pipeline.json compiled and pickled. See load_pipeline
+	'pipeline_cache': True,
 	'progress_filename': 'corec_progress.txt',
+	'journal_filename': 'corec_journal.log',
+	'metrics_filename': 'corec_metrics.json', # Timings and resource usage of steps and tools
+	'trace_filename': 'corec_trace.json', # The same in Chrome trace event format (chrome://tracing, Perfetto)
+	'tool_metrics_filename': 'corec_metrics_tools.jsonl', # Metrics of tool installations, appended by corec_requires
+	'history_filename': 'corec_history.sqlite', # Durations of the steps in all runs
+	'history_runs': 5, # Expected duration of a step: the median of its last history_runs successful runs
+	'status_filename': 'corec_status.txt', # Steps finished and ETA of the running plan
+	'daemon_socket': 'corec_daemon.sock',
+	'daemon_flush_interval': 1.0, # Seconds between writes of the daemon parameters to the parameter store
 	'mock' : False,
+	'scratch_dir': 'corec_scratch', # Script files of steps and tools. Deleted at the end of corec_init
+	'keep_scripts': False, # Keep the script files (and write them also when the shell workers run the steps)
+	'shell_workers': False, # Run steps in long lived bash processes instead of a new bash for every step
+	'logs_dir': 'corec_logs', # stdout and stderr of every step and tool installation
+	'log_tail_lines': 20, # Last lines of stdout and stderr that are kept in the step result
+	'log_max_line_bytes': 64 * 1024, # Longer lines (e.g. output without newlines) are truncated in the kept lines
+	'console_lines_per_second': 10, # How many lines of step output are shown in the console
+	'jobs' : 1, # How many steps can run in parallel
+	'max_cores' : None, # Cores available to steps that run in parallel. None: no limit
+	'max_memory_mb' : None, # Memory (MB) available to steps that run in parallel. None: no limit
+	'cache' : True, # Restore the outputs of steps that have already run with the same commands and inputs
+	'cache_dir' : 'corec_cache',
+	'cache_max_bytes' : 64 * 1024 * 1024,
+	'cache_hash_files' : False, # Also hash the content of the files that input parameters point to
 	'report_embed': [
 		(['png', 'jpg', 'jpeg'], lambda x : '<img src="{}">'.format(x)),
 		[['pdf'], lambda x: '<embed src="{}" width="100%" height="500" type="application/pdf">'.format(x)],
 		[['html'], lambda x: x],
 	],
-	'report_text': lambda x : '<p><pre>{}</pre></p>'.format(cgi.escape(x).encode('ascii', 'xmlcharrefreplace')), # http://stackoverflow.com/questions/1061697/whats-the-easiest-way-to-escape-html-in-python DEPRECATION NOTE
+	'report_text': lambda x : '<p><pre>{}</pre></p>'.format(escape_html(x)),
 	'report_default': lambda x : '<p>{}</p>'.format(x),
+	'report_max_embed_bytes': 1024 * 1024, # Text files up to this size are embedded whole
+	'report_head_lines': 100, # Larger text files: embed only this many first lines..
+	'report_tail_lines': 100, # .. and this many last lines
+	'report_codec': 'gz', # Compression of the report archive: gz, xz, zst or none
+	'report_hard_links': True, # Hard link reported files when they cannot be reflinked
+	'report_compression_threads': None, # None: all cores
+	'report_compression_block_size': 4 * 1024 * 1024,
+
+	'tools_dir': os.environ.get('COREC_TOOLS_DIR', 'corec_installed_tools'), # Fingerprints and locks of installed tools. Share it between pipelines of the same host
+	'tool_fingerprints': True, # Skip the installation of tools whose installation commands and platform have not changed
+
+	'timeout': None, # Seconds that the whole run can take (corec_init --timeout, or "timeout" of the root pipeline). None: no limit
+	'step_timeout': None, # Seconds that a step can run if it does not declare its own "timeout". None: no limit
+	'kill_grace_seconds': 5.0, # A killed step gets SIGTERM. Its process group gets SIGKILL after this many seconds
+	'fail_fast': False, # When a step fails, cancel the running steps that can no longer contribute to a target of the plan
+
+	'coordinator': None, # The CORECCoordinator of corec_init --coordinator
+	'coordinator_token': os.environ.get('COREC_TOKEN'), # Shared secret of the coordinator and its workers (--token)
+	'worker_step': os.environ.get('COREC_WORKER_STEP') == '1', # This is a step that runs on a corec_worker. It cannot use locks
+	'heartbeat_interval': 5.0, # Seconds between the heartbeats of a corec_worker
+	'worker_timeout': 30.0, # A worker without heartbeats for this many seconds is dead. Its steps are reassigned
 
 	# Do not change any of these
 	'parameters': {},  
 	'current_progress': '',
+	'completed_steps': set(), # Steps that have finished in a run that we resume
+	'deadline': None, # time.time() when the run times out
+	'daemon': None, # The CORECDaemon running in this process
+	'plan_eta': None, # PlanETA of the running plan
+	'shell_pool': None, # ShellWorkerPool of this process
 }
 
+# A step that runs on a corec_worker has its own parameter files (see run_worker_task)
+for key in ['parameters_filename', 'parameters_sqlite_filename', 'daemon_socket']:
+	defaults[key] = os.environ.get('COREC_' + key.upper(), defaults[key])
+
 # Version dependent functions
 def corec_raw_input():
 	if sys.version_info < (3,4):
@@ -62,6 +127,21 @@ def corec_iteritems(d):
 class CORECException(Exception):
 	pass
 
+class CommandsFailed(SystemExit):
+	'''
+	Commands of a step or tool returned a non zero code (and defaults['exit_on_non_zero_return_code'] is set).
+	Exits like sys.exit(1). result is the result of execute_commands
+	'''
+	def __init__(self, result):
+		SystemExit.__init__(self, 1)
+		self.result = result
+
+class StepCancelled(CORECException):
+	'''
+	The step was killed because it can no longer contribute to the plan (see defaults['fail_fast'])
+	'''
+	pass
+
 def now():
 	return time.strftime("%a, %d %b %Y %H:%M:%S", time.gmtime())
 
@@ -70,8 +150,19 @@ def time_difference(start, finish):
 	return str(finish-start)
 
 def get_uuid():
+	import uuid
 	return str(uuid.uuid4()).split('-')[-1]
 
+def escape_html(text):
+	'''
+	http://stackoverflow.com/questions/1061697/whats-the-easiest-way-to-escape-html-in-python
+	'''
+	try:
+		from html import escape
+	except ImportError:
+		from cgi import escape # Python 2
+	return escape(text, quote=False).encode('ascii', 'xmlcharrefreplace').decode('ascii')
+
 def mkdir_p(path):
 	'''
 	http://stackoverflow.com/questions/600268/mkdir-p-functionality-in-python
@@ -84,9 +175,220 @@ def mkdir_p(path):
 		else:
 			raise
 
-def make_tarfile(output_filename, source_dir):
-    with tarfile.open(output_filename, "w:gz") as tar:
-        tar.add(source_dir, arcname=os.path.basename(source_dir))
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
+class FileLock(object):
+	'''
+	Exclusive lock on <filename>.lock shared between threads and processes.
+	Reentrant within the same thread.
+	'''
+
+	def __init__(self, filename):
+		self.filename = filename + '.lock'
+		self.thread_lock = threading.RLock()
+		self.local = threading.local()
+
+	def acquire(self):
+		self.thread_lock.acquire()
+		depth = getattr(self.local, 'depth', 0)
+		if not depth:
+			self.local.f = open(self.filename, 'a')
+			if fcntl:
+				fcntl.flock(self.local.f, fcntl.LOCK_EX)
+		self.local.depth = depth + 1
+
+	def release(self):
+		self.local.depth -= 1
+		if not self.local.depth:
+			if fcntl:
+				fcntl.flock(self.local.f, fcntl.LOCK_UN)
+			self.local.f.close()
+		self.thread_lock.release()
+
+	def __enter__(self):
+		self.acquire()
+		return self
+
+	def __exit__(self, *args):
+		self.release()
+
+def file_lock(filename):
+	with _file_locks_lock:
+		if not filename in _file_locks:
+			_file_locks[filename] = FileLock(filename)
+		return _file_locks[filename]
+
+def write_file_atomic(filename, content):
+	'''
+	Readers never see a half written file
+	'''
+	tmp_filename = '{}.{}.{}.tmp'.format(filename, os.getpid(), threading.current_thread().ident)
+	with open(tmp_filename, 'w') as f:
+		f.write(content)
+	os.rename(tmp_filename, filename)
+
+def gzip_block(block):
+	compressor = zlib_compressobj()
+	return compressor.compress(block) + compressor.flush()
+
+def zlib_compressobj():
+	import zlib
+	return zlib.compressobj(6, zlib.DEFLATED, 31) # 31: gzip header
+
+def xz_block(block):
+	import lzma
+	return lzma.compress(block)
+
+def zstd_block(block):
+	import zstandard
+	return zstandard.ZstdCompressor(level=3).compress(block)
+
+def get_archive_codec(codec):
+	'''
+	Returns the file extension and the function that compresses a block.
+	Compressed blocks are complete gzip members, xz streams or zstd frames, so their concatenation is a valid file.
+	'''
+	if codec == 'zst':
+		try:
+			import zstandard
+		except ImportError:
+			logging.warning('zstd compression needs the zstandard python package. Using gz')
+			codec = 'gz'
+
+	if codec == 'xz':
+		try:
+			import lzma
+		except ImportError:
+			logging.warning('xz compression needs python 3. Using gz')
+			codec = 'gz'
+
+	codecs = {
+		'gz': ('.tar.gz', gzip_block),
+		'xz': ('.tar.xz', xz_block),
+		'zst': ('.tar.zst', zstd_block),
+		'none': ('.tar', None),
+	}
+
+	if not codec in codecs:
+		raise CORECException('Unknown report codec: {}. Available: {}'.format(codec, ', '.join(sorted(codecs))))
+
+	return codecs[codec]
+
+class ParallelCompressor(object):
+	'''
+	Write only file object. Data is cut in blocks that are compressed by a pool of threads
+	(zlib, lzma and zstandard release the GIL) and written in order.
+	'''
+
+	def __init__(self, f, compress_block, threads, block_size):
+		import collections
+		from multiprocessing.pool import ThreadPool
+
+		self.f = f
+		self.compress_block = compress_block
+		self.threads = threads
+		self.block_size = block_size
+		self.pool = ThreadPool(threads)
+		self.pending = collections.deque()
+		self.buffer = []
+		self.buffer_size = 0
+
+	def write(self, data):
+		self.buffer.append(data)
+		self.buffer_size += len(data)
+		if self.buffer_size >= self.block_size:
+			self.submit()
+
+	def submit(self):
+		block = b''.join(self.buffer)
+		self.buffer = []
+		self.buffer_size = 0
+		for start in range(0, len(block), self.block_size):
+			self.pending.append(self.pool.apply_async(self.compress_block, (block[start:start+self.block_size],)))
+
+		# Do not keep more than a few blocks per thread in memory
+		while len(self.pending) > 2 * self.threads:
+			self.f.write(self.pending.popleft().get())
+
+	def close(self):
+		if self.buffer_size:
+			self.submit()
+		while self.pending:
+			self.f.write(self.pending.popleft().get())
+		self.pool.close()
+		self.pool.join()
+
+def make_tarfile(output_filename, source_dir, codec='gz', threads=None):
+	'''
+	output_filename is without extension. Returns the name of the archive
+	'''
+	import tarfile
+	import multiprocessing
+
+	extension, compress_block = get_archive_codec(codec)
+	output_filename += extension
+	threads = threads or multiprocessing.cpu_count()
+
+	with open(output_filename + '.tmp', 'wb') as f:
+		compressor = ParallelCompressor(f, compress_block, threads, defaults['report_compression_block_size']) if compress_block else f
+		with tarfile.open(fileobj=compressor, mode='w|') as tar:
+			tar.add(source_dir, arcname=os.path.basename(source_dir))
+		if compress_block:
+			compressor.close()
+
+	os.rename(output_filename + '.tmp', output_filename)
+	return output_filename
+
+def file_digest(filename):
+	import hashlib
+	h = hashlib.sha256()
+	hash_file(filename, h)
+	return h.hexdigest()
+
+def hash_file(filename, h):
+	with open(filename, 'rb') as f:
+		for chunk in iter(lambda: f.read(1024 * 1024), b''):
+			h.update(chunk)
+
+def reflink(source, dest):
+	'''
+	Copy on write clone (btrfs, xfs). Returns False if the filesystem does not support it.
+	'''
+	if not fcntl:
+		return False
+
+	FICLONE = 0x40049409
+	try:
+		with open(source, 'rb') as source_f:
+			with open(dest, 'wb') as dest_f:
+				fcntl.ioctl(dest_f.fileno(), FICLONE, source_f.fileno())
+		return True
+	except (IOError, OSError):
+		if os.path.exists(dest):
+			os.remove(dest)
+		return False
+
+def link_or_copy(source, dest):
+	'''
+	Reflink (copy on write) if the filesystem supports it, otherwise hard link if source and dest
+	are on the same filesystem (defaults['report_hard_links']), otherwise copy.
+	A hard linked file changes if the source is later modified in place.
+	Returns how the file was placed.
+	'''
+	if reflink(source, dest):
+		return 'reflink'
+
+	if defaults['report_hard_links']:
+		try:
+			os.link(source, dest)
+			return 'hard link'
+		except (OSError, AttributeError):
+			pass
+
+	from shutil import copyfile
+	copyfile(source, dest)
+	return 'copy'
 
 def is_parameter(node):
 	return node['data']['kind'] == 'Parameter'
@@ -106,62 +408,541 @@ def get_source(edge):
 def get_kind(element):
 	return element["data"]["kind"]
 
-def get_node(pipeline, id_):
-	for node in pipeline["elements"]["nodes"]:
-		node_id = get_id(node)
-		if node_id == id_:
-			return node
-		else:
+class PipelineGraph(object):
+	'''
+	Index over the cytoscape elements of a pipeline.
+	Built once (see load_pipeline) so that node and edge lookups do not scan pipeline["elements"].
+	Item access is forwarded to the raw pipeline dictionary.
+	'''
+
+	def __init__(self, pipeline):
+		self.pipeline = pipeline
+		self.nodes = pipeline["elements"]["nodes"]
+		self.edges = pipeline["elements"]["edges"]
+
+		# id --> (position, node). The position keeps the "first node wins" order of the linear scan
+		self.ids = {}
+		# 'a|c' --> (position, node) for all nodes with 3-part ids 'a|b|c'
+		self.short_ids = {}
+		# kind --> [nodes]
+		self.kinds = {}
+
+		for position, node in enumerate(self.nodes):
+			node_id = get_id(node)
+			if not node_id in self.ids:
+				self.ids[node_id] = (position, node)
+
 			node_id_s = node_id.split('|')
-			id_s = id_.split('|')
-			if len(node_id_s) == 3 and len(id_s) == 2:
-				if id_s[0] == node_id_s[0] and id_s[1] == node_id_s[2]:
-					return node
+			if len(node_id_s) == 3:
+				short_id = '{}|{}'.format(node_id_s[0], node_id_s[2])
+				if not short_id in self.short_ids:
+					self.short_ids[short_id] = (position, node)
+
+			self.kinds.setdefault(node["data"].get("kind"), []).append(node)
+
+		# node id --> [edges] and node id --> edge kind --> [edges]
+		self.outgoing = {}
+		self.ingoing = {}
+		self.outgoing_kinds = {}
+		self.ingoing_kinds = {}
+
+		for edge in self.edges:
+			source = get_source(edge)
+			target = get_target(edge)
+			kind = edge["data"].get("kind")
+
+			self.outgoing.setdefault(source, []).append(edge)
+			self.ingoing.setdefault(target, []).append(edge)
+			self.outgoing_kinds.setdefault(source, {}).setdefault(kind, []).append(edge)
+			self.ingoing_kinds.setdefault(target, {}).setdefault(kind, []).append(edge)
+
+		# Filled by compile_pipeline
+		self.notset_parameter_positions = None
+		self.notset_output_positions = None
+		self.step_dependencies = None # step id --> result of get_step_dependencies
+
+	def __getitem__(self, key):
+		return self.pipeline[key]
+
+	def __contains__(self, key):
+		return key in self.pipeline
+
+	def get_node(self, id_):
+		'''
+		Same matching as the linear scan: exact id, or a 2-part id 'a|c' matching a 3-part node id 'a|b|c'
+		'''
+		candidates = [self.ids.get(id_)]
+		if len(id_.split('|')) == 2:
+			candidates.append(self.short_ids.get(id_))
+
+		candidates = [candidate for candidate in candidates if candidate]
+		if not candidates:
+			return None
+
+		return min(candidates, key=lambda x: x[0])[1]
+
+	def get_nodes(self, kind):
+		return self.kinds.get(kind, [])
+
+	def get_outgoing_edges(self, node_id, kind=None):
+		if kind is None:
+			return self.outgoing.get(node_id, [])
+		return self.outgoing_kinds.get(node_id, {}).get(kind, [])
 
-def get_outgoing_edges(pipeline, node):
-	for edge in pipeline["elements"]["edges"]:
-		if get_source(edge) == get_id(node):
-			yield edge
+	def get_ingoing_edges(self, node_id, kind=None):
+		if kind is None:
+			return self.ingoing.get(node_id, [])
+		return self.ingoing_kinds.get(node_id, {}).get(kind, [])
 
-def get_ingoing_edges(pipeline, node):
-	for edge in pipeline["elements"]["edges"]:
-		if get_target(edge) == get_id(node):
-			yield edge
+def pipeline_graph(pipeline):
+	'''
+	Return the PipelineGraph of a pipeline. Raw dictionaries are indexed on the fly
+	'''
+	if isinstance(pipeline, PipelineGraph):
+		return pipeline
+
+	return PipelineGraph(pipeline)
+
+def get_node(pipeline, id_):
+	return pipeline_graph(pipeline).get_node(id_)
+
+def get_outgoing_edges(pipeline, node, kind=None):
+	for edge in pipeline_graph(pipeline).get_outgoing_edges(get_id(node), kind):
+		yield edge
+
+def get_ingoing_edges(pipeline, node, kind=None):
+	for edge in pipeline_graph(pipeline).get_ingoing_edges(get_id(node), kind):
+		yield edge
+
+def compile_pipeline(pipeline):
+	'''
+	Precompute the analyses that do not depend on the values of the parameters
+	'''
+	pipeline = pipeline_graph(pipeline)
+	positions = dict((id(node), position) for position, node in enumerate(pipeline.nodes))
+
+	pipeline.notset_parameter_positions = [positions[id(node)] for node in get_notset_parameters(pipeline)]
+	pipeline.notset_output_positions = [positions[id(node)] for node in get_notset_outputs(pipeline)]
+	pipeline.step_dependencies = dict((get_id(node), get_step_dependencies(pipeline, node)) for node in pipeline.get_nodes('Step'))
+
+	return pipeline
+
+class gc_paused(object):
+	'''
+	Building large graphs of dicts and lists triggers the cyclic garbage collector over and over.
+	Nothing to collect there, so pause it.
+	'''
+	def __enter__(self):
+		import gc
+		self.enabled = gc.isenabled()
+		gc.disable()
+
+	def __exit__(self, *args):
+		import gc
+		if self.enabled:
+			gc.enable()
+
+PIPELINE_CACHE_VERSION = 2 # Increase when PipelineGraph or compile_pipeline change
+
+def read_pipeline_cache(cache_filename):
+	'''
+	The cache entry if it is for this version of python and corec, None otherwise
+	'''
+	import pickle
+
+	try:
+		with open(cache_filename, 'rb') as f:
+			with gc_paused():
+				entry = pickle.load(f)
+	except Exception: # Missing, truncated or from an incompatible python
+		return None
+
+	if not isinstance(entry, dict) or entry.get('version') != (PIPELINE_CACHE_VERSION, sys.version_info[:2]):
+		return None
+
+	return entry
+
+def write_pipeline_cache(cache_filename, entry):
+	import pickle
+
+	tmp_filename = '{}.{}.{}.tmp'.format(cache_filename, os.getpid(), threading.current_thread().ident)
+	try:
+		with open(tmp_filename, 'wb') as f:
+			pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+		os.rename(tmp_filename, cache_filename)
+	except (IOError, OSError) as e:
+		logging.warning('Could not write the pipeline cache {}: {}'.format(cache_filename, e))
 
 def load_pipeline():
+	'''
+	The compiled PipelineGraph of pipeline.json.
+	It is read from the pipeline cache if pipeline.json has the same mtime and size as when the cache was written,
+	or the same sha256 (e.g. after a touch or a checkout). Otherwise pipeline.json is compiled and the cache is rewritten.
+	'''
+	import hashlib
 
-	if not os.path.isfile(defaults["pipeline_filename"]):
+	pipeline_filename = defaults["pipeline_filename"]
+	if not os.path.isfile(pipeline_filename):
 		return False
 
-	with open(defaults["pipeline_filename"]) as f:
-		pipeline = json.load(f)
+	stat = os.stat(pipeline_filename)
+	cache_filename = defaults['pipeline_cache_filename']
+	entry = read_pipeline_cache(cache_filename) if defaults['pipeline_cache'] else None
+
+	if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+		return entry['pipeline']
+
+	with open(pipeline_filename, 'rb') as f:
+		content = f.read()
+	digest = hashlib.sha256(content).hexdigest()
+
+	if entry and entry['sha256'] == digest:
+		pipeline = entry['pipeline']
+	else:
+		with gc_paused():
+			pipeline = compile_pipeline(PipelineGraph(json.loads(content.decode('utf-8'))))
+
+	if defaults['pipeline_cache']:
+		write_pipeline_cache(cache_filename, {
+			'version': (PIPELINE_CACHE_VERSION, sys.version_info[:2]),
+			'mtime': stat.st_mtime,
+			'size': stat.st_size,
+			'sha256': digest,
+			'pipeline': pipeline,
+		})
 
 	return pipeline
 
 
-def load_parameters():
-	parameters_filename = defaults['parameters_filename']
+# PARAMETER STORE
+
+class JSONParameterStore(object):
+	'''
+	All parameters in a json file. Every update rewrites the file under a file lock.
+	'''
+
+	name = 'json'
+
+	def __init__(self, filename):
+		self.filename = filename
+
+	def get_all(self):
+		if not os.path.isfile(self.filename):
+			with file_lock(self.filename):
+				if not os.path.isfile(self.filename):
+					write_file_atomic(self.filename, '{}')
+
+		with open(self.filename) as f:
+			return json.load(f)
+
+	def get(self, parameter, default=None):
+		return self.get_all().get(parameter, default)
+
+	def get_many(self, parameter_names):
+		'''
+		The parameters that are set, with one read
+		'''
+		parameters = self.get_all()
+		return dict((parameter, parameters[parameter]) for parameter in parameter_names if parameter in parameters)
+
+	def save(self, parameters):
+		write_file_atomic(self.filename, json.dumps(parameters, indent=4) + '\n')
+
+	def set_many(self, values):
+		with file_lock(self.filename):
+			parameters = self.get_all()
+			parameters.update(values)
+			self.save(parameters)
+
+	def set(self, parameter, value):
+		self.set_many({parameter: value})
+
+	def merge(self, parameter, new_parameter):
+		with file_lock(self.filename):
+			parameters = self.get_all()
+			if not parameter in parameters:
+				raise CORECException('Error in merge: Parameter {} does not exist'.format(parameter))
+			parameters[new_parameter] = parameters[parameter]
+			self.save(parameters)
+
+	def export_json(self, filename):
+		parameters = self.get_all()
+		if os.path.abspath(filename) != os.path.abspath(self.filename):
+			write_file_atomic(filename, json.dumps(parameters, indent=4) + '\n')
+
+class SQLiteParameterStore(object):
+	'''
+	One row per parameter in an SQLite database in WAL mode.
+	Single parameter updates are atomic and do not block readers.
+	Values are stored json encoded.
+	corec_parameters.json is only a copy, exported at the end of every corec_init. It is never read back:
+	if it changes after its export, the store refuses to work rather than ignore the changes (see check_exports)
+	'''
+
+	name = 'sqlite'
+
+	def __init__(self, filename):
+		self.filename = filename
+		self.local = threading.local() # sqlite3 connections cannot be shared between threads
+
+	def connection(self):
+		connection = getattr(self.local, 'connection', None)
+		if connection is None:
+			import sqlite3
+			connection = sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+			connection.execute('PRAGMA journal_mode=WAL')
+			connection.execute('PRAGMA synchronous=NORMAL')
+			connection.execute('CREATE TABLE IF NOT EXISTS parameters (name TEXT PRIMARY KEY, value TEXT)')
+			connection.execute('CREATE TABLE IF NOT EXISTS exports (filename TEXT PRIMARY KEY, mtime REAL, size INTEGER)')
+			self.check_exports(connection)
+			self.local.connection = connection
+		return connection
+
+	def check_exports(self, connection):
+		'''
+		Raise if corec_parameters.json has been changed after its last export
+		'''
+		filename = os.path.abspath(defaults['parameters_filename'])
+		try:
+			stat = os.stat(filename)
+		except OSError:
+			return
+
+		row = connection.execute('SELECT mtime, size FROM exports WHERE filename=?', (filename,)).fetchone()
+		if row is None:
+			# Exported before exports were recorded
+			self.record_export(connection, filename)
+		elif (row[0], row[1]) != (stat.st_mtime, stat.st_size):
+			raise CORECException('{0} has changed after it was exported from {1}. Parameters are read from {1}, not from {0}. '
+				'Set the changed parameters with corec_set and delete {0}. corec_init exports it again'.format(defaults['parameters_filename'], self.filename))
+
+	def record_export(self, connection, filename):
+		stat = os.stat(filename)
+		connection.execute('INSERT OR REPLACE INTO exports (filename, mtime, size) VALUES (?, ?, ?)', (filename, stat.st_mtime, stat.st_size))
+
+	def get_all(self):
+		rows = self.connection().execute('SELECT name, value FROM parameters')
+		return dict((name, json.loads(value)) for name, value in rows)
+
+	def get(self, parameter, default=None):
+		row = self.connection().execute('SELECT value FROM parameters WHERE name=?', (parameter,)).fetchone()
+		if row is None:
+			return default
+		return json.loads(row[0])
+
+	def get_many(self, parameter_names):
+		parameter_names = list(parameter_names)
+		ret = {}
+		connection = self.connection()
+		for index in range(0, len(parameter_names), 500): # sqlite limits the number of variables in a query
+			names = parameter_names[index:index+500]
+			rows = connection.execute('SELECT name, value FROM parameters WHERE name IN ({})'.format(', '.join('?' * len(names))), names)
+			ret.update((name, json.loads(value)) for name, value in rows)
+		return ret
+
+	def set_many(self, values):
+		connection = self.connection()
+		connection.execute('BEGIN IMMEDIATE')
+		try:
+			connection.executemany('INSERT OR REPLACE INTO parameters (name, value) VALUES (?, ?)', 
+				[(parameter, json.dumps(value)) for parameter, value in corec_iteritems(values)])
+		except:
+			connection.execute('ROLLBACK')
+			raise
+		connection.execute('COMMIT')
+
+	def set(self, parameter, value):
+		self.set_many({parameter: value})
+
+	def merge(self, parameter, new_parameter):
+		connection = self.connection()
+		connection.execute('BEGIN IMMEDIATE')
+		try:
+			row = connection.execute('SELECT value FROM parameters WHERE name=?', (parameter,)).fetchone()
+			if row is None:
+				raise CORECException('Error in merge: Parameter {} does not exist'.format(parameter))
+			connection.execute('INSERT OR REPLACE INTO parameters (name, value) VALUES (?, ?)', (new_parameter, row[0]))
+		except:
+			connection.execute('ROLLBACK')
+			raise
+		connection.execute('COMMIT')
+
+	def export_json(self, filename):
+		write_file_atomic(filename, json.dumps(self.get_all(), indent=4) + '\n')
+		if os.path.abspath(filename) == os.path.abspath(defaults['parameters_filename']):
+			self.record_export(self.connection(), os.path.abspath(filename))
+
+_parameter_stores = {}
+
+def get_parameter_store():
+	'''
+	The store that holds the parameters of the pipeline in the current directory
+	'''
+	daemon = get_daemon()
+	if daemon:
+		return daemon
+
+	name = defaults['parameter_store']
+	if name is None:
+		name = 'sqlite' if os.path.isfile(defaults['parameters_sqlite_filename']) else 'json'
+
+	if name == 'json':
+		key = (name, os.path.abspath(defaults['parameters_filename']))
+		store_class = JSONParameterStore
+	elif name == 'sqlite':
+		key = (name, os.path.abspath(defaults['parameters_sqlite_filename']))
+		store_class = SQLiteParameterStore
+	else:
+		raise CORECException('Unknown parameter store: {}'.format(name))
+
+	if not key in _parameter_stores:
+		_parameter_stores[key] = store_class(key[1])
+
+	return _parameter_stores[key]
+
+def use_parameter_store(name):
+	'''
+	Switch the pipeline in the current directory to this parameter store. Existing parameters are moved.
+	'''
+	previous_store = get_parameter_store()
+	if previous_store.name == name:
+		return
+
+	parameters = previous_store.get_all()
+	defaults['parameter_store'] = name
+	get_parameter_store().set_many(parameters)
+	if name == 'sqlite':
+		# corec_parameters.json becomes the export of the new store
+		get_parameter_store().export_json(defaults['parameters_filename'])
+
+	if previous_store.name == 'sqlite':
+		# Going back to json. The json file is already updated
+		for suffix in ['', '-wal', '-shm']:
+			if os.path.isfile(previous_store.filename + suffix):
+				os.remove(previous_store.filename + suffix)
+		_parameter_stores.clear()
+
+	defaults['parameter_store'] = None
+	logging.info('Parameters are stored in: {}'.format(get_parameter_store().name))
+
+def export_parameters(filename=None):
+	'''
+	Write all parameters in a json file. By default in corec_parameters.json
+	'''
+	if filename is None:
+		filename = defaults['parameters_filename']
+	get_parameter_store().export_json(filename)
+
+# PARAMETER BLOBS
+# Large values are stored out of line, one file per value named by the sha256 of its json encoding.
+# The store keeps only a reference: {"__corec_blob__": 1, "corec_blob": <sha256>, "size": <bytes>}
+
+def blob_filename(digest):
+	return os.path.join(defaults['blob_dir'], digest[:2], digest + '.json')
+
+def is_blob_reference(value):
+	return isinstance(value, dict) and len(value) == 3 and value.get('__corec_blob__') == 1 and 'corec_blob' in value and 'size' in value
+
+def blob_store(values):
+	'''
+	values with the large values replaced by blob references
+	'''
+	threshold = defaults['blob_threshold_bytes']
+	if threshold is None:
+		return values
+
+	ret = {}
+	for parameter, value in corec_iteritems(values):
+		if value is None or isinstance(value, (bool, int, float)) or is_blob_reference(value):
+			ret[parameter] = value
+			continue
+		if type(value).__name__ in ['unicode', 'str'] and len(value) < threshold // 6:
+			ret[parameter] = value # Too small even if every character is escaped
+			continue
+
+		encoded = json.dumps(value)
+		if len(encoded) < threshold:
+			ret[parameter] = value
+			continue
+
+		import hashlib
+		digest = hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+		filename = blob_filename(digest)
+		if not os.path.isfile(filename):
+			mkdir_p(os.path.dirname(filename))
+			write_file_atomic(filename, encoded) # Same content for the same name. No lock needed
+		ret[parameter] = {'__corec_blob__': 1, 'corec_blob': digest, 'size': len(encoded)}
+
+	return ret
+
+def blob_open(reference):
+	'''
+	A read only mmap of the json encoded value
+	'''
+	import mmap
+	with open(blob_filename(reference['corec_blob']), 'rb') as f:
+		return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def blob_load(value):
+	'''
+	The value of a blob reference. Other values are returned as they are
+	'''
+	if not is_blob_reference(value):
+		return value
+
+	blob = blob_open(value)
+	try:
+		return json.loads(blob[:].decode('utf-8'))
+	finally:
+		blob.close()
+
+def blob_exists(value):
+	return not is_blob_reference(value) or os.path.isfile(blob_filename(value['corec_blob']))
+
+def collect_blobs(keep=()):
+	'''
+	Delete the blobs that no parameter refers to. keep: more values with references to keep
+	'''
+	if not os.path.isdir(defaults['blob_dir']):
+		return
+
+	referenced = set()
+	for value in list(get_parameter_store().get_all().values()) + list(keep):
+		if is_blob_reference(value):
+			referenced.add(value['corec_blob'] + '.json')
 
-	if not os.path.isfile(parameters_filename):
-		with open(parameters_filename, 'w') as f:
-			json.dump({}, f)
+	deleted = 0
+	for directory, _, filenames in os.walk(defaults['blob_dir']):
+		for filename in filenames:
+			if filename.endswith('.json') and not filename in referenced:
+				os.remove(os.path.join(directory, filename))
+				deleted += 1
+
+	if deleted:
+		logging.info('Deleted {} unused parameter blobs from {}'.format(deleted, defaults['blob_dir']))
+
+# END OF PARAMETER STORE
+
+def load_parameters():
+	'''
+	Large values stay blob references in defaults['parameters']. get_parameter resolves them
+	'''
+	defaults['parameters'] = get_parameter_store().get_all()
 
-	with open(parameters_filename) as f:
-		parameters = json.load(f)
+def get_parameter(parameter, default=None):
+	return blob_load(get_parameter_store().get(parameter, default))
 
-	defaults['parameters'] = parameters
+def get_parameters(parameters):
+	'''
+	The values of the parameters that are set, with a single read of the store
+	'''
+	return dict((parameter, blob_load(value)) for parameter, value in corec_iteritems(get_parameter_store().get_many(parameters)))
 
 def save_parameter(parameter, value, merge):
-	load_parameters()
 	if merge:
-		if not parameter in defaults['parameters']:
-			raise CORECException('Error in merge: Parameter {} does not exist'.format(parameter))
-		
-		defaults['parameters'][value] = defaults['parameters'][parameter]
-
+		get_parameter_store().merge(parameter, value)
 	else:
-		defaults['parameters'][parameter] = value
-	save_parameters_file()
+		get_parameter_store().set_many(blob_store({parameter: value}))
 
 
 def set_up_environment():
@@ -172,6 +953,7 @@ def set_up_environment():
 
 def command_line(f):
 	def wrapper(*args, **kwargs):
+		setup_logging()
 		set_up_environment()
 		load_parameters()
 		kwargs['pipeline'] = load_pipeline()
@@ -183,60 +965,75 @@ def command_line(f):
 	return wrapper
 
 
+def light_command_line(f):
+	'''
+	For the commands that only read or write parameters and locks.
+	The pipeline and the parameters are not loaded.
+	'''
+	def wrapper(*args, **kwargs):
+		setup_logging()
+
+		return f(*args, **kwargs)
+
+	return wrapper
+
+
 def parameter_gets_set(pipeline, parameter):
 	'''
 	Check if a parameter is set by a step
 	'''
 
-	for edge in pipeline["elements"]["edges"]:
-		
-		if get_target(edge) == get_id(parameter) and get_kind(edge) == "Sets_Outputs":
-			return True
-
-	return False
+	return bool(pipeline_graph(pipeline).get_ingoing_edges(get_id(parameter), "Sets_Outputs"))
 
 def output_gets_set(pipeline, output):
 	'''
 	Check if an outputs is required by any other step as a parameter
 	so that this is an intermediate output.
 	'''
-	for edge in pipeline["elements"]["edges"]:
-		if get_target(edge) == get_id(output) and get_kind(edge) == "Needs_Parameter":
-			return True
-
-	return False
+	return bool(pipeline_graph(pipeline).get_ingoing_edges(get_id(output), "Needs_Parameter"))
 
 def get_notset_parameters(pipeline):
 
+	pipeline = pipeline_graph(pipeline)
+	if pipeline.notset_parameter_positions is not None:
+		return [pipeline.nodes[position] for position in pipeline.notset_parameter_positions]
+
 	ret = []
-	for node in pipeline["elements"]["nodes"]:
-		if is_parameter(node):
-			#This is a parameter.
-			#Is this the output of any step?
-			if not parameter_gets_set(pipeline, node):
-				ret.append(node)
+	for node in pipeline.get_nodes('Parameter'):
+		#This is a parameter.
+		#Is this the output of any step?
+		if not parameter_gets_set(pipeline, node):
+			ret.append(node)
 
 	return ret
 
 def get_notset_outputs(pipeline):
 
+	pipeline = pipeline_graph(pipeline)
+	if pipeline.notset_output_positions is not None:
+		return [pipeline.nodes[position] for position in pipeline.notset_output_positions]
+
 	ret = []
-	for node in pipeline["elements"]["nodes"]:
-		if is_output(node):
-			#This an output
-			# Maybe it is required by another step.
-			if not output_gets_set(pipeline, node):
-				ret.append(node)
+	for node in pipeline.get_nodes('Output'):
+		#This an output
+		# Maybe it is required by another step.
+		if not output_gets_set(pipeline, node):
+			ret.append(node)
 
 	return ret
 
-def save_parameters_file():
-	with open(defaults['parameters_filename'], 'w') as f:
-		f.write(json.dumps(defaults['parameters'], indent=4) + '\n')
-
+def update_parameters(values):
+	'''
+	Set many parameters with a single update of the store
+	'''
+	values = blob_store(values)
+	get_parameter_store().set_many(values)
+	defaults['parameters'].update(values)
 
 def input_parameters(parameters):
 
+	load_parameters()
+	new_values = {}
 	for parameter in parameters:
 		p_id = get_id(parameter)
 		logging.info('Found unsatisfied input parameter: {}'.format(p_id))
@@ -247,129 +1044,2022 @@ def input_parameters(parameters):
 		else:
 			request_str = 'Insert the value of parameter: {} : '.format(p_id)
 			p_value = corec_raw_input()(request_str)
-			defaults['parameters'][p_id] = p_value
+			new_values[p_id] = p_value
 
-	save_parameters_file()
+	update_parameters(new_values)
 
 
 def random_filename(prefix, name):
 
 	return "{}_{}_{}.sh".format(prefix, name.replace('|', '_'), get_uuid())
 
-def run_bash_command(command):
+def script_filename(prefix, name):
+	'''
+	A new file name for the script of a step or tool in the scratch directory
+	'''
+	mkdir_p(defaults['scratch_dir'])
+	return os.path.join(defaults['scratch_dir'], random_filename(prefix, name))
 
-	# Get progress
-	progress = read_progress()
+def clean_scratch_dir():
+	if defaults['keep_scripts'] or not os.path.isdir(defaults['scratch_dir']):
+		return
 
-	process = subprocess.Popen(command.split(), stdout=subprocess.PIPE)
+	import shutil
+	shutil.rmtree(defaults['scratch_dir'], ignore_errors=True)
 
-	if sys.version_info < (3,0):
-		for line in iter(process.stdout.readline, ""):
-			logging.info('{} --> {} -> {}'.format(progress, command, line.replace('\n', '')))
-	else:
-		for line in iter(process.stdout.readline, b""):
-			line_unicode = line.decode('utf-8')
-			logging.info('{} --> {} -> {}'.format(progress, command, line_unicode.replace('\n', '')))
+class ConsoleTail(object):
+	'''
+	Shows the output lines of a command in the console at a limited rate.
+	Lines in between are skipped (they are all in the log files).
+	'''
 
+	def __init__(self, progress, command):
+		self.progress = progress
+		self.command = command
+		self.interval = 1.0 / defaults['console_lines_per_second']
+		self.last_shown = 0
+		self.skipped = 0
+		self.lock = threading.Lock()
+
+	def line(self, stream_name, line, lines=1):
+		'''
+		line is the last of lines new lines
+		'''
+		with self.lock:
+			now_ = time.time()
+			if now_ - self.last_shown < self.interval:
+				self.skipped += lines
+				return
+			self.last_shown = now_
+			skipped, self.skipped = self.skipped + lines - 1, 0
+
+		if skipped:
+			line = '{} ({} lines skipped)'.format(line, skipped)
+		logging.info('{}{} --> {} {}-> {}'.format(eta_string(), self.progress, self.command, '' if stream_name == 'stdout' else 'stderr ', line))
+
+class StreamCapture(object):
+	'''
+	Reads a stream of a child process in large chunks in its own thread.
+	Everything goes to a log file. The last lines and the number of bytes are kept.
+	'''
 
-	output, error = process.communicate()
-	return_code = process.returncode
+	def __init__(self, name, stream, log_filename, console):
+		import collections
+
+		self.name = name
+		self.stream = stream
+		self.log_filename = log_filename
+		self.console = console
+		self.bytes = 0
+		self.tail = collections.deque(maxlen=defaults['log_tail_lines'])
+		self.partial = b''
+		self.thread = threading.Thread(target=self.read)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def read(self):
+		fd = self.stream.fileno()
+		tail_lines = self.tail.maxlen
+		max_line = defaults['log_max_line_bytes']
+		with open(self.log_filename, 'wb') as log:
+			for chunk in iter(lambda: os.read(fd, 1024 * 1024), b''):
+				log.write(chunk)
+				self.bytes += len(chunk)
+				# Only the new chunk is split. Lines are kept up to max_line bytes (the log file has them whole)
+				lines = chunk.split(b'\n')
+				lines[0] = self.partial + lines[0][:max_line]
+				self.partial = lines.pop()[:max_line]
+				if lines:
+					self.tail.extend(line[:max_line] for line in lines[-tail_lines:])
+					self.console.line(self.name, decode_output(lines[-1][:max_line]), len(lines))
+		self.stream.close()
+
+	def join(self):
+		self.thread.join()
+		lines = list(self.tail)
+		if self.partial:
+			lines = (lines + [self.partial])[-self.tail.maxlen:]
+		return [decode_output(line) for line in lines]
+
+def decode_output(line):
+	return line.decode('utf-8', 'replace').rstrip('\r')
+
+def log_filename(script_filename, stream_name):
+	mkdir_p(defaults['logs_dir'])
+	return os.path.join(defaults['logs_dir'], '{}.{}.log'.format(os.path.splitext(os.path.basename(script_filename))[0], stream_name))
+
+def wait_for_process(process):
+	'''
+	Wait for a subprocess.Popen. Returns the return code and the resource usage of the process
+	(and of the children it waited for) as a dictionary, or None where os.wait4 is not available.
+	'''
+	if not hasattr(os, 'wait4'):
+		return process.wait(), None
+
+	while True:
+		try:
+			_, status, rusage = os.wait4(process.pid, 0)
+			break
+		except OSError as e:
+			if e.errno != errno.EINTR:
+				raise
+
+	if os.WIFSIGNALED(status):
+		return_code = -os.WTERMSIG(status)
+	else:
+		return_code = os.WEXITSTATUS(status)
+	process.returncode = return_code # So that Popen does not wait for it again
+
+	return return_code, {
+		'utime': rusage.ru_utime, # CPU seconds in user mode
+		'stime': rusage.ru_stime, # CPU seconds in kernel mode
+		'maxrss_kb': rusage.ru_maxrss if sys.platform != 'darwin' else rusage.ru_maxrss // 1024,
+		'inblock': rusage.ru_inblock, # Block input operations
+		'oublock': rusage.ru_oublock, # Block output operations
+		'nvcsw': rusage.ru_nvcsw, # Voluntary context switches
+		'nivcsw': rusage.ru_nivcsw, # Involuntary context switches
+	}
+
+# PROCESS GROUPS
+# Every step runs in its own process group, so that a timeout or a cancellation kills everything that the step started
+
+running_processes = {} # key (step id, or task id on a corec_worker) --> ProcessWatch of the running step
+cancelled_processes = set() # keys of steps that have been cancelled
+killed_process_groups = {} # process group id --> time.time() when it gets SIGKILL
+running_processes_lock = threading.Lock()
+
+def new_session():
+	'''
+	Popen arguments that start the process in a new session (and process group)
+	'''
+	if sys.version_info >= (3, 2):
+		return {'start_new_session': True}
+	if hasattr(os, 'setsid'):
+		return {'preexec_fn': os.setsid} # Python 2 has nothing safer for threaded programs
+	return {}
 
-	return return_code, output, error
+def signal_process_group(process_group, sig):
+	'''
+	False if the group has exited
+	'''
+	try:
+		os.killpg(process_group, sig)
+	except OSError as e:
+		if e.errno != errno.ESRCH:
+			raise
+		return False
+	return True
 
-def execute_commands(prefix, node_with_commands, commands):
+def kill_process_group(process, grace=None):
+	'''
+	SIGTERM to the process group of process (it is the leader, see new_session).
+	SIGKILL to whatever is left of the group after grace seconds
+	'''
+	import signal
 
-	if defaults['mock']:
-		# We pretend to execute them
+	if not hasattr(os, 'killpg'):
+		process.kill()
 		return
 
-	id_ = get_id(node_with_commands)
-	fn = random_filename(prefix, id_)
-	logging.info('Saving bash commands to {}'.format(fn))
+	signal_process_group(process.pid, signal.SIGTERM)
+	grace = defaults['kill_grace_seconds'] if grace is None else grace
+	with running_processes_lock:
+		if not killed_process_groups:
+			import atexit
+			atexit.register(finish_killing_process_groups)
+		killed_process_groups[process.pid] = time.time() + grace
+
+	def kill():
+		with running_processes_lock:
+			if killed_process_groups.pop(process.pid, None) is None:
+				return # finish_killing_process_groups has done it
+		signal_process_group(process.pid, signal.SIGKILL)
+
+	timer = threading.Timer(grace, kill)
+	timer.daemon = True
+	timer.start()
+
+def finish_killing_process_groups():
+	'''
+	The SIGKILL timers of kill_process_group do not survive the exit of this process.
+	Wait for the killed groups to exit and SIGKILL them at the end of their grace period
+	'''
+	import signal
 
-	with open(fn, 'w') as f:
-		f.write('set -e\n\n') # Stop on first error
-		f.write(commands)
+	with running_processes_lock:
+		groups = dict(killed_process_groups)
+		killed_process_groups.clear()
 
-	command = 'bash {}'.format(fn)
-	logging.info('Running: {}'.format(command))
-	return_code, output, error = run_bash_command(command)
-	logging.info('Return Code of command {} --> {}'.format(command, return_code))
-	if return_code:
-		logging.warning('RETURN CODE {} is not zero..'.format(return_code))
-		if defaults['exit_on_non_zero_return_code']:
-			logging.info('Exiting.. (Fail)')
-			sys.exit(1)
+	for process_group, deadline in corec_iteritems(groups):
+		while time.time() < deadline and signal_process_group(process_group, 0):
+			time.sleep(0.05)
+		signal_process_group(process_group, signal.SIGKILL)
 
-# MANAGE LOCKS
+def handle_exit_signals():
+	'''
+	Steps run in their own sessions, so the signals for this process (Ctrl-C, timeout, batch schedulers)
+	do not reach them. Kill them and exit
+	'''
+	import signal
 
-def reset_locks():
-	#Reset locks
-	with open(defaults['locks_filename'], 'w') as f:
-		json.dump({}, f, indent=4)
+	def handler(signum, frame):
+		logging.warning('Received signal {}. Killing the running steps'.format(signum))
+		kill_running_processes()
+		finish_killing_process_groups()
+		raise SystemExit(128 + signum)
 
-def open_locks():
-	locks_filename = defaults['locks_filename']
+	for name in ['SIGTERM', 'SIGINT', 'SIGHUP']:
+		if hasattr(signal, name):
+			signal.signal(getattr(signal, name), handler)
 
-	if os.path.isfile(locks_filename):
-		with open(locks_filename) as f:
-			locks = json.load(f)
-	else:
-		locks = {}
+class ProcessWatch(object):
+	'''
+	Kills the process group of a running step when its timeout expires or when it is cancelled (see cancel_process).
+	killed is None, 'timeout' or 'cancelled'
+	'''
 
-	return locks_filename, locks
+	def __init__(self, process, timeout, key, name):
+		self.process = process
+		self.timeout = timeout
+		self.key = key
+		self.name = name
+		self.killed = None
+		self.timer = None
+
+	def kill(self, reason):
+		if self.killed is not None:
+			return
+		self.killed = reason
+		logging.warning('Killing {} ({}). Process group: {}'.format(self.name, reason, self.process.pid))
+		kill_process_group(self.process)
+
+	def __enter__(self):
+		if self.timeout is not None:
+			self.timer = threading.Timer(max(self.timeout, 0), self.kill, args=('timeout',))
+			self.timer.daemon = True
+			self.timer.start()
+
+		if self.key is not None:
+			with running_processes_lock:
+				running_processes[self.key] = self
+				cancelled = self.key in cancelled_processes
+			if cancelled:
+				self.kill('cancelled')
+
+		return self
+
+	def __exit__(self, *args):
+		if self.timer is not None:
+			self.timer.cancel()
+		if self.key is not None:
+			with running_processes_lock:
+				if running_processes.get(self.key) is self:
+					del running_processes[self.key]
+
+def cancel_process(key):
+	'''
+	Kill the running step with this key. A step that has not started yet is killed as soon as it starts
+	'''
+	with running_processes_lock:
+		cancelled_processes.add(key)
+		watch = running_processes.get(key)
+	if watch is not None:
+		watch.kill('cancelled')
 
+def reset_cancelled_processes(keys):
+	with running_processes_lock:
+		cancelled_processes.difference_update(keys)
 
-def set_lock_value(lock_name, value):
+def kill_running_processes():
+	'''
+	No step should outlive corec_init
+	'''
+	with running_processes_lock:
+		watches = list(running_processes.values())
+	for watch in watches:
+		watch.kill('cancelled')
 
-	locks_filename, locks = open_locks()
+# END OF PROCESS GROUPS
 
-	locks[lock_name] = value
+def run_bash_command(command, log_name, env=None, timeout=None, key=None):
+	'''
+	command is a list of arguments. env: environment of the command (default: this environment)
+	stdout and stderr are written in <logs_dir>/<log_name>.stdout.log and .stderr.log
+	timeout: seconds, None for no limit. key: name for cancel_process
+	Returns a dictionary with the return code, the size and the last lines of stdout and stderr
+	'''
+	import subprocess
 
-	with open(locks_filename, 'w') as f:
-		json.dump(locks, f, indent=4)
+	# Get progress
+	progress = read_progress()
+	console = ConsoleTail(progress, ' '.join(command))
 
-	# How many true values exist?
-	return list(locks.values()).count(True)
+	process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, **new_session())
 
-def set_lock(lock_name):
-	return set_lock_value(lock_name, True)
+	with ProcessWatch(process, timeout, key, ' '.join(command)) as watch:
+		captures = {}
+		for stream_name, stream in [('stdout', process.stdout), ('stderr', process.stderr)]:
+			captures[stream_name] = StreamCapture(stream_name, stream, log_filename(log_name, stream_name), console)
 
-def unset_lock(lock_name):
-	return set_lock_value(lock_name, False)
+		result = {}
+		result['return_code'], result['rusage'] = wait_for_process(process)
 
+		if result['return_code'] and watch.killed is None:
+			# Background processes of a failed step, they may hold the pipes open
+			kill_process_group(process)
 
-def get_lock_value(lock_name):
-	locks_filename, locks = open_locks()
+		for stream_name, capture in corec_iteritems(captures):
+			result[stream_name + '_tail'] = capture.join()
+			result[stream_name + '_bytes'] = capture.bytes
+			result[stream_name + '_log'] = capture.log_filename
+
+	result['killed'] = watch.killed
+
+	return result
+
+class ShellWorker(object):
+	'''
+	A long lived bash that reads steps from its stdin.
+	Every step runs in its own subshell with set -e and its output goes directly to the log files of the step.
+	The worker prints the exit code of the subshell with a marker on its stdout.
+	'''
+
+	def __init__(self):
+		import subprocess
+
+		# A step that fails or is killed takes its worker with it. See ShellWorkerPool.replace
+		self.process = subprocess.Popen(['bash', '-s'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, **new_session())
+
+	def run(self, commands, stdout_log, stderr_log):
+		'''
+		Returns the exit code of the commands. None if the worker died (e.g. a step killed its parent shell)
+		'''
+		marker = 'COREC_DONE_{}'.format(get_uuid())
+		# eval: a syntax error in the commands fails the step, not the worker
+		script = '( set -e\neval {}\n) > {} 2> {} < /dev/null\necho "{} $?"\n'.format(
+			shell_quote(commands), shell_quote(stdout_log), shell_quote(stderr_log), marker)
+
+		try:
+			self.process.stdin.write(script.encode('utf-8'))
+			self.process.stdin.flush()
+		except (IOError, OSError):
+			return None
+
+		for line in iter(self.process.stdout.readline, b''):
+			line = line.decode('utf-8', 'replace').split()
+			if len(line) == 2 and line[0] == marker:
+				return int(line[1])
+
+		return None
+
+	def stop(self):
+		try:
+			self.process.stdin.close()
+		except (IOError, OSError):
+			pass
+		self.process.wait()
+
+class ShellWorkerPool(object):
+	'''
+	Idle shell workers. A step takes one (or starts a new one) and gives it back when it finishes,
+	so there are never more workers than steps that ran at the same time.
+	'''
+
+	def __init__(self):
+		self.idle = []
+		self.workers = []
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		with self.lock:
+			if self.idle:
+				return self.idle.pop()
+
+		worker = ShellWorker()
+		with self.lock:
+			self.workers.append(worker)
+		return worker
+
+	def release(self, worker, alive):
+		with self.lock:
+			if alive:
+				self.idle.append(worker)
+				return
+			self.workers.remove(worker)
+		worker.stop()
+
+	def replace(self, worker, kill=True):
+		'''
+		Kill the process group of a worker whose step failed, with the background processes of the step
+		that may still hold its files, and put a fresh worker in its place.
+		kill: False if the group has already been killed (see ProcessWatch)
+		'''
+		if kill:
+			kill_process_group(worker.process)
+		self.release(worker, False)
 
-	if lock_name in locks:
-		return locks[lock_name]
+		fresh = ShellWorker()
+		with self.lock:
+			self.workers.append(fresh)
+			self.idle.append(fresh)
 
+	def run(self, commands, log_name, timeout=None, key=None):
+		'''
+		Same result as run_bash_command. There is no resource usage of a single step,
+		and the output is not shown in the console while the step runs.
+		'''
+		stdout_log = log_filename(log_name, 'stdout')
+		stderr_log = log_filename(log_name, 'stderr')
+
+		worker = self.acquire()
+		with ProcessWatch(worker.process, timeout, key, 'shell worker {}'.format(worker.process.pid)) as watch:
+			return_code = worker.run(commands, stdout_log, stderr_log)
+		if return_code == 0:
+			self.release(worker, True)
+		else:
+			self.replace(worker, kill=watch.killed is None)
+		if return_code is None:
+			if watch.killed is None:
+				logging.warning('Shell worker {} exited while running {}'.format(worker.process.pid, log_name))
+			return_code = 1
+
+		result = {'return_code': return_code, 'rusage': None, 'killed': watch.killed}
+		for stream_name, filename in [('stdout', stdout_log), ('stderr', stderr_log)]:
+			result[stream_name + '_log'] = filename
+			result[stream_name + '_bytes'] = os.path.getsize(filename) if os.path.isfile(filename) else 0
+			result[stream_name + '_tail'] = log_tail(filename)
+
+		return result
+
+	def stop(self):
+		with self.lock:
+			workers, self.workers, self.idle = self.workers, [], []
+		for worker in workers:
+			worker.stop()
+
+def log_tail(filename):
+	'''
+	The last lines of a log file
+	'''
+	if not os.path.isfile(filename):
+		return []
+
+	with open(filename, 'rb') as f:
+		tail = read_tail(f, defaults['log_tail_lines'], 1024 * 1024)
+	return [decode_output(line) for line in tail.splitlines()]
+
+def get_shell_pool():
+	if defaults['shell_pool'] is None:
+		defaults['shell_pool'] = ShellWorkerPool()
+	return defaults['shell_pool']
+
+def stop_shell_workers():
+	shell_pool = defaults['shell_pool']
+	if shell_pool is None:
+		return
+	defaults['shell_pool'] = None
+	shell_pool.stop()
+
+def execute_commands(prefix, node_with_commands, commands, inputs=None):
+	'''
+	Returns the result of run_bash_command. None in mock mode.
+	inputs: ids of the parameters that a step needs. A corec worker gets only these blobs
+	'''
+
+	if defaults['mock']:
+		# We pretend to execute them
+		return None
+
+	id_ = get_id(node_with_commands)
+	timeout = get_timeout(node_with_commands)
+	key = id_ if prefix == 'step' else None
+	fn = script_filename(prefix, id_)
+
+	if defaults['keep_scripts'] or not (defaults['shell_workers'] or defaults['coordinator']):
+		logging.info('Saving bash commands to {}'.format(fn))
+		with open(fn, 'w') as f:
+			f.write('set -e\n\n') # Stop on first error
+			f.write(commands)
+
+	if defaults['coordinator'] is not None and prefix == 'step':
+		# Tools are installed here. Workers should see them on a shared filesystem
+		command = ['corec worker', fn]
+		logging.info('Running {} on a corec worker'.format(id_))
+		result = run_remote_step(id_, commands, timeout, inputs)
+	elif defaults['shell_workers']:
+		command = ['shell worker', fn]
+		logging.info('Running {} in a shell worker'.format(id_))
+		result = get_shell_pool().run(commands, fn, timeout, key)
+	else:
+		command = ['bash', fn]
+		logging.info('Running: {}'.format(' '.join(command)))
+		try:
+			result = run_bash_command(command, fn, timeout=timeout, key=key)
+		finally:
+			if not defaults['keep_scripts']:
+				os.remove(fn)
+
+	if result.get('killed') == 'cancelled':
+		raise StepCancelled('{} was cancelled'.format(id_))
+	if result.get('killed') == 'timeout':
+		logging.warning('{} timed out after {}'.format(id_, format_seconds(timeout)))
+
+	return_code = result['return_code']
+	logging.info('Return Code of command {} --> {}'.format(' '.join(command), return_code))
+	logging.info('Output of {}: stdout: {} bytes in {} , stderr: {} bytes in {}'.format(
+		id_, result['stdout_bytes'], result['stdout_log'], result['stderr_bytes'], result['stderr_log']))
+	if return_code:
+		logging.warning('RETURN CODE {} is not zero..'.format(return_code))
+		for line in result['stderr_tail']:
+			logging.warning('{} stderr -> {}'.format(id_, line))
+		if defaults['exit_on_non_zero_return_code']:
+			logging.info('Exiting.. (Fail)')
+			raise CommandsFailed(result)
+
+	return result
+
+def get_timeout(node):
+	'''
+	Seconds that the commands of a step or tool can run: its "timeout", or defaults['step_timeout'].
+	Never more than what is left until the deadline of the run. None: no limit
+	'''
+	timeout = node["data"].get('timeout', defaults['step_timeout'])
+	if timeout is not None:
+		timeout = float(timeout)
+
+	if defaults['deadline'] is not None:
+		remaining = defaults['deadline'] - time.time()
+		if remaining <= 0:
+			raise CORECException('The run has exceeded its timeout of {}. Not starting: {}'.format(format_seconds(defaults['timeout']), get_id(node)))
+		if timeout is None or remaining < timeout:
+			timeout = remaining
+
+	return timeout
+
+def get_return_code(result):
+	'''
+	The return code of the result of execute_commands. 0 in mock mode
+	'''
+	if result is None:
+		return 0
+	return result['return_code']
+
+# MANAGE LOCKS
+# A lock is an exclusive flock on <locks_dir>/<lock name>.lock, held by a small process that corec_lock starts (hold_lock).
+# The holder lives while the process group that called corec_lock lives (the step and its background jobs), or until corec_unlock.
+# The kernel releases the flock when the holder exits for any reason, so a step that crashes or is killed does not leave its locks behind.
+# corec_locks.json only records the holders, so that corec_unlock can end them. Waiters block on the flock itself.
+
+def lock_filename(lock_name):
+	import re
+	if re.match(r'^[A-Za-z0-9_-][A-Za-z0-9_.-]*$', lock_name):
+		name = lock_name
+	else:
+		import hashlib
+		name = hashlib.sha1(lock_name.encode('utf-8')).hexdigest()
+	return os.path.abspath(os.path.join(defaults['locks_dir'], name + '.lock'))
+
+def check_locks_supported():
+	if defaults['worker_step']:
+		raise CORECException('Locks are not supported in steps that run on a corec_worker: corec_init does not see them')
+	if not fcntl:
+		raise CORECException('Locks need fcntl.flock, which is not available on this platform')
+
+def try_flock(f, operation):
+	'''
+	False if the flock is held by another process
+	'''
+	try:
+		fcntl.flock(f, operation | fcntl.LOCK_NB)
+	except (IOError, OSError) as e:
+		if e.errno in (errno.EAGAIN, errno.EACCES):
+			return False
+		raise
+	return True
+
+def lock_is_held(lock_name):
+	check_locks_supported()
+	filename = lock_filename(lock_name)
+	if not os.path.isfile(filename):
+		return False
+	with open(filename) as f:
+		if not try_flock(f, fcntl.LOCK_SH):
+			return True
+		fcntl.flock(f, fcntl.LOCK_UN)
 	return False
 
-def get_all_locks():
+def hold_lock(filename, owner_group):
+	'''
+	The holder process of a lock (see start_lock_holder). Prints held or busy.
+	Keeps the flock while the process group owner_group is alive
+	'''
+	mkdir_p(os.path.dirname(filename))
+	f = open(filename, 'a')
+	while not try_flock(f, fcntl.LOCK_EX):
+		# A waiter or lock_is_held can have a shared flock for a moment. Busy only if another holder has it
+		if not try_flock(f, fcntl.LOCK_SH):
+			sys.stdout.write('busy\n')
+			return
+		fcntl.flock(f, fcntl.LOCK_UN)
+		time.sleep(0.001)
+
+	sys.stdout.write('held\n')
+	sys.stdout.flush()
+	null = os.open(os.devnull, os.O_RDWR)
+	os.dup2(null, sys.stdout.fileno())
+
+	while True:
+		try:
+			os.killpg(owner_group, 0)
+		except OSError as e:
+			if e.errno == errno.ESRCH:
+				return # The owner is gone. Exiting releases the flock
+		time.sleep(defaults['lock_holder_interval'])
+
+def start_lock_holder(lock_name):
+	'''
+	Start the holder of a lock for the process group of the parent of this process (the shell that runs corec_lock).
+	Returns the pid of the holder, or None if the lock is already held
+	'''
+	import subprocess
+
+	owner_group = os.getpgid(os.getppid() if os.getppid() > 1 else 0)
+	code = 'import sys; sys.path.insert(0, sys.argv[1]); import corec_tools; corec_tools.hold_lock(sys.argv[2], int(sys.argv[3]))'
+	command = [sys.executable, '-c', code, os.path.dirname(os.path.abspath(__file__)), lock_filename(lock_name), str(owner_group)]
+	with open(os.devnull, 'r+b') as null:
+		holder = subprocess.Popen(command, stdin=null, stdout=subprocess.PIPE, stderr=null, close_fds=True, **new_session())
+	status = holder.stdout.readline().strip()
+	holder.stdout.close()
+
+	if status == b'held':
+		return holder.pid
+	holder.wait()
+	if status == b'busy':
+		return None
+	raise CORECException('Could not start the holder of lock: {}'.format(lock_name))
+
+def end_lock_holder(lock_name, holder):
+	'''
+	Terminate the holder and wait for the release of the lock
+	'''
+	import signal
+
+	if not lock_is_held(lock_name):
+		return # The holder has exited. Its pid may belong to another process by now
+	try:
+		os.kill(holder, signal.SIGTERM)
+	except OSError as e:
+		if e.errno != errno.ESRCH:
+			raise
+	if wait_for_release(lock_name, defaults['kill_grace_seconds']):
+		return
+	try:
+		os.kill(holder, signal.SIGKILL)
+	except OSError as e:
+		if e.errno != errno.ESRCH:
+			raise
+	wait_for_release(lock_name, None)
+
+def wait_for_release(lock_name, timeout):
+	'''
+	Block until the lock is not held, up to timeout seconds (None: forever). Returns True if it was released
+	'''
+	released = threading.Event()
+
+	def wait():
+		with open(lock_filename(lock_name), 'a') as f:
+			fcntl.flock(f, fcntl.LOCK_SH) # Sleeps in the kernel until the holder releases it
+			fcntl.flock(f, fcntl.LOCK_UN)
+		released.set()
+
+	if timeout is None:
+		wait()
+		return True
+
+	# A flock cannot time out. A thread waits for it
+	thread = threading.Thread(target=wait)
+	thread.daemon = True
+	thread.start()
+	return released.wait(max(timeout, 0))
+
+def open_locks():
+	'''
+	lock name --> {"holder": pid of the holder process}
+	'''
 	locks_filename = defaults['locks_filename']
 
 	if os.path.isfile(locks_filename):
 		with open(locks_filename) as f:
 			locks = json.load(f)
 	else:
+		locks = {}
+
+	return locks_filename, locks
+
+def reset_locks():
+	'''
+	Release every lock
+	'''
+	check_locks_supported()
+	with file_lock(defaults['locks_filename']):
+		locks_filename, locks = open_locks()
+		for lock_name, entry in corec_iteritems(locks):
+			end_lock_holder(lock_name, entry['holder'])
+		write_file_atomic(locks_filename, json.dumps({}, indent=4))
+
+def set_lock_value(lock_name, value):
+	'''
+	value True: take the lock (nothing happens if it is held). False: release it.
+	Returns the number of held locks
+	'''
+	check_locks_supported()
+	with file_lock(defaults['locks_filename']):
+		locks_filename, locks = open_locks()
+		if value:
+			holder = start_lock_holder(lock_name)
+			if holder is not None:
+				locks[lock_name] = {'holder': holder}
+		elif lock_name in locks:
+			end_lock_holder(lock_name, locks.pop(lock_name)['holder'])
+
+		# Forget the holders that have exited
+		locks = dict((name, entry) for name, entry in corec_iteritems(locks) if lock_is_held(name))
+		write_file_atomic(locks_filename, json.dumps(locks, indent=4))
+
+	return len(locks)
+
+def set_lock(lock_name):
+	return set_lock_value(lock_name, True)
+
+def unset_lock(lock_name):
+	return set_lock_value(lock_name, False)
+
+
+def get_lock_value(lock_name):
+	return lock_is_held(lock_name)
+
+def get_all_locks():
+	locks_filename, locks = open_locks()
+	return [lock_name for lock_name in locks if lock_is_held(lock_name)]
+
+def held_locks(lock_names=None):
+	if lock_names is None:
+		return get_all_locks()
+	return [lock_name for lock_name in lock_names if lock_is_held(lock_name)]
+
+def wait_for_locks(lock_names=None, timeout=None):
+	'''
+	Block until these locks (default: all locks) are released or the timeout (seconds) expires.
+	Returns the locks that are still held
+	'''
+	deadline = None if timeout is None else time.time() + timeout
+	while True:
+		held = held_locks(lock_names)
+		if not held:
+			return held
+
+		remaining = None
+		if deadline is not None:
+			remaining = deadline - time.time()
+			if remaining <= 0:
+				return held
+		wait_for_release(held[0], remaining)
+
+
+# END OF MANAGE LOCKS
+
+##################################################
+
+# COREC DAEMON
+
+def json_lines_handler(handle):
+	'''
+	A socketserver request handler. One json request per line, one json response per line.
+	handle gets the request and returns the value of the response
+	'''
+	try:
+		import socketserver
+	except ImportError:
+		import SocketServer as socketserver # Python 2
+
+	class RequestHandler(socketserver.StreamRequestHandler):
+		def handle(self):
+			for line in iter(self.rfile.readline, b''):
+				try:
+					response = {'ok': True, 'value': handle(json.loads(line.decode('utf-8')))}
+				except Exception as e:
+					response = {'ok': False, 'error': str(e)}
+				self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+				self.wfile.flush()
+
+	return RequestHandler
+
+class CORECDaemon(object):
+	'''
+	Keeps parameters in memory and serves them over a unix domain socket. Locks are not kept here (see MANAGE LOCKS).
+	Changed parameters are written to the parameter store in the background and before every journal entry.
+	Implements the same interface as the parameter stores.
+	'''
+
+	name = 'daemon'
+
+	# export_json is not an operation: clients should not make the daemon write to a path they choose
+	operations = ['ping', 'get_all', 'get', 'get_many', 'set_many', 'set', 'merge']
+
+	def __init__(self, socket_filename, store):
+		self.socket_filename = socket_filename
+		self.store = store
+		self.parameters = store.get_all()
+		self.dirty_parameters = set()
+		self.condition = threading.Condition()
+		self.flush_lock = threading.Lock()
+		self.stopped = threading.Event()
+		self.server = None
+
+	def handle(self, request):
+		if not request['op'] in self.operations:
+			raise CORECException('Unknown daemon operation: {}'.format(request['op']))
+		return getattr(self, request['op'])(*request.get('args', []))
+
+	def ping(self):
+		return True
+
+	# Parameters
+
+	def get_all(self):
+		with self.condition:
+			return dict(self.parameters)
+
+	def get(self, parameter, default=None):
+		with self.condition:
+			return self.parameters.get(parameter, default)
+
+	def get_many(self, parameter_names):
+		with self.condition:
+			return dict((parameter, self.parameters[parameter]) for parameter in parameter_names if parameter in self.parameters)
+
+	def set_many(self, values):
+		with self.condition:
+			self.parameters.update(values)
+			self.dirty_parameters.update(values)
+
+	def set(self, parameter, value):
+		self.set_many({parameter: value})
+
+	def merge(self, parameter, new_parameter):
+		with self.condition:
+			if not parameter in self.parameters:
+				raise CORECException('Error in merge: Parameter {} does not exist'.format(parameter))
+			self.set_many({new_parameter: self.parameters[parameter]})
+
+	def export_json(self, filename):
+		self.flush()
+		self.store.export_json(filename)
+
+	def flush(self):
+		'''
+		Write changed parameters to the store
+		'''
+		with self.flush_lock:
+			with self.condition:
+				values = dict((parameter, self.parameters[parameter]) for parameter in self.dirty_parameters)
+				self.dirty_parameters = set()
+
+			if values:
+				self.store.set_many(values)
+
+	def flush_periodically(self):
+		while not self.stopped.wait(defaults['daemon_flush_interval']):
+			self.flush()
+
+	def start(self):
+		try:
+			import socketserver
+		except ImportError:
+			import SocketServer as socketserver # Python 2
+
+		RequestHandler = json_lines_handler(self.handle)
+
+		class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+			daemon_threads = True
+
+		if os.path.exists(self.socket_filename):
+			if DaemonClient(self.socket_filename).is_alive():
+				raise CORECException('Another corec daemon is listening on: {}'.format(self.socket_filename))
+			os.remove(self.socket_filename) # Left from a crashed run
+
+		self.server = Server(self.socket_filename, RequestHandler)
+		for target in [self.server.serve_forever, self.flush_periodically]:
+			thread = threading.Thread(target=target)
+			thread.daemon = True
+			thread.start()
+
+		logging.info('corec daemon is listening on: {}'.format(self.socket_filename))
+
+	def stop(self):
+		self.stopped.set()
+		if self.server:
+			self.server.shutdown()
+			self.server.server_close()
+			if os.path.exists(self.socket_filename):
+				os.remove(self.socket_filename)
+		self.flush()
+		logging.info('corec daemon stopped')
+
+class JSONLinesClient(object):
+	'''
+	Client of a json_lines_handler server. address: a unix socket filename or a (host, port) tuple.
+	token: sent with every request, if not None. One connection per thread.
+	'''
+
+	def __init__(self, address, token=None):
+		self.address = address
+		self.token = token
+		self.local = threading.local()
+
+	def connection(self):
+		f = getattr(self.local, 'f', None)
+		if f is None:
+			import socket
+			if isinstance(self.address, tuple):
+				s = socket.create_connection(self.address)
+			else:
+				s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+				s.connect(self.address)
+			f = s.makefile('rwb')
+			s.close() # The file object keeps the connection open
+			self.local.f = f
+		return f
+
+	def request(self, op, *args):
+		request = {'op': op, 'args': args}
+		if self.token is not None:
+			request['token'] = self.token
+
+		f = self.connection()
+		try:
+			f.write((json.dumps(request) + '\n').encode('utf-8'))
+			f.flush()
+			line = f.readline()
+		except (IOError, OSError):
+			self.local.f = None
+			raise
+		if not line:
+			self.local.f = None
+			raise CORECException('{} closed the connection'.format(self.address))
+		response = json.loads(line.decode('utf-8'))
+		if not response['ok']:
+			raise CORECException(response['error'])
+		return response['value']
+
+class DaemonClient(JSONLinesClient):
+	'''
+	Talks to a CORECDaemon of another process. Implements the same interface as the parameter stores.
+	'''
+
+	name = 'daemon'
+
+	def __init__(self, socket_filename):
+		JSONLinesClient.__init__(self, socket_filename)
+		self.socket_filename = socket_filename
+
+	def is_alive(self):
+		try:
+			return self.request('ping')
+		except (IOError, OSError, CORECException, ValueError): # socket.error is an IOError
+			return False
+
+	def get_all(self):
+		return self.request('get_all')
+
+	def get(self, parameter, default=None):
+		return self.request('get', parameter, default)
+
+	def get_many(self, parameter_names):
+		return self.request('get_many', list(parameter_names))
+
+	def set_many(self, values):
+		return self.request('set_many', values)
+
+	def set(self, parameter, value):
+		return self.request('set', parameter, value)
+
+	def merge(self, parameter, new_parameter):
+		return self.request('merge', parameter, new_parameter)
+
+	def export_json(self, filename):
+		# Written by this process, not by the daemon
+		write_file_atomic(filename, json.dumps(self.get_all(), indent=4) + '\n')
+
+_daemon_clients = {}
+
+def get_daemon():
+	'''
+	The daemon of this process, a client of the daemon of another process, or None if no daemon is running
+	'''
+	if defaults['daemon'] is not None:
+		return defaults['daemon']
+
+	socket_filename = defaults['daemon_socket']
+	if not os.path.exists(socket_filename):
+		return None
+
+	key = os.path.abspath(socket_filename)
+	if not key in _daemon_clients:
+		client = DaemonClient(socket_filename)
+		_daemon_clients[key] = client if client.is_alive() else None # Fall back to files if the socket is stale
+
+	return _daemon_clients[key]
+
+def start_daemon():
+	daemon = CORECDaemon(defaults['daemon_socket'], get_parameter_store())
+	daemon.start()
+	defaults['daemon'] = daemon
+
+def stop_daemon():
+	daemon = defaults['daemon']
+	if daemon is None:
+		return
+	defaults['daemon'] = None
+	daemon.stop()
+
+# END OF COREC DAEMON
+
+##################################################
+
+# COREC COORDINATOR
+# corec_init --coordinator HOST:PORT hands the steps to corec_worker processes that connect over TCP.
+# The scheduler of corec_init does not change: execute_commands of a step waits until a worker has run it.
+
+def parse_address(address):
+	'''
+	'host:port' --> ('host', port)
+	'''
+	host, _, port = address.rpartition(':')
+	if not host or not port.isdigit():
+		raise CORECException('Expected HOST:PORT, got: {}'.format(address))
+	return host, int(port)
+
+class CORECCoordinator(object):
+	'''
+	Keeps a queue of steps and hands them to the workers that ask for work.
+	A worker that misses its heartbeats for worker_timeout seconds is dead and its steps go back to the queue.
+	Every request must carry the token.
+	'''
+
+	operations = ['ping', 'register', 'heartbeat', 'get_task', 'task_done']
+
+	def __init__(self, address, token):
+		import collections
+
+		self.address = address
+		self.token = token
+		self.condition = threading.Condition()
+		self.queue = collections.deque() # ids of tasks that wait for a worker
+		self.tasks = {} # task id --> task
+		self.workers = {} # worker id --> worker
+		self.stopped = threading.Event()
+		self.server = None
+
+	def handle(self, request):
+		import hmac
+		token = request.get('token')
+		if not type(token).__name__ in ['unicode', 'str'] or not hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8')):
+			raise CORECException('Invalid coordinator token')
+		if not request['op'] in self.operations:
+			raise CORECException('Unknown coordinator operation: {}'.format(request['op']))
+		return getattr(self, request['op'])(*request.get('args', []))
+
+	def ping(self):
+		return True
+
+	# Worker operations
+
+	def register(self, name, jobs):
+		worker_id = '{}_{}'.format(name, get_uuid())
+		with self.condition:
+			self.workers[worker_id] = {'name': name, 'jobs': jobs, 'last_seen': time.time(), 'tasks': set(), 'cancel': set()}
+		logging.info('Worker {} registered with {} jobs'.format(worker_id, jobs))
+		return {'worker_id': worker_id, 'heartbeat_interval': defaults['heartbeat_interval']}
+
+	def heartbeat(self, worker_id):
+		'''
+		False if the worker has been declared dead. It should register again.
+		Otherwise True, or the ids of its tasks that it should kill
+		'''
+		with self.condition:
+			worker = self.workers.get(worker_id)
+			if worker is None:
+				return False
+			worker['last_seen'] = time.time()
+			if worker['cancel']:
+				cancel, worker['cancel'] = sorted(worker['cancel']), set()
+				return cancel
+			return True
+
+	def get_task(self, worker_id, timeout):
+		'''
+		Waits up to timeout seconds for a step. Returns the task, None if there was no step, or {"stop": true}
+		'''
+		deadline = time.time() + min(timeout, 60)
+		with self.condition:
+			while True:
+				if self.stopped.is_set():
+					return {'stop': True}
+
+				worker = self.workers.get(worker_id)
+				if worker is None:
+					raise CORECException('Unknown worker: {}'.format(worker_id))
+				worker['last_seen'] = time.time()
+
+				if self.queue:
+					task = self.tasks[self.queue.popleft()]
+					timeout = task['timeout']
+					if defaults['deadline'] is not None:
+						remaining = defaults['deadline'] - time.time()
+						if remaining <= 0:
+							# Too late to start it. run raises
+							task['expired'] = True
+							task['done'].set()
+							continue
+						if timeout is None or remaining < timeout:
+							timeout = remaining
+
+					task['worker'] = worker_id
+					worker['tasks'].add(task['id'])
+					logging.info('Step {} runs on worker {}'.format(task['step'], worker_id))
+					response = dict((key, task[key]) for key in ['id', 'step', 'commands', 'parameters'])
+					response['timeout'] = timeout
+					return response
+
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					return None
+				self.condition.wait(remaining)
+
+	def task_done(self, worker_id, task_id, result):
+		'''
+		False if the task has been reassigned in the meantime. The result is ignored
+		'''
+		with self.condition:
+			worker = self.workers.get(worker_id)
+			if worker is not None:
+				worker['tasks'].discard(task_id)
+				worker['last_seen'] = time.time()
+
+			task = self.tasks.get(task_id)
+			if task is None or task['worker'] != worker_id or task['result'] is not None:
+				return False
+
+			task['result'] = result
+			task['done'].set()
+			return True
+
+	def check_workers(self):
+		while not self.stopped.wait(defaults['heartbeat_interval']):
+			with self.condition:
+				for worker_id, worker in list(self.workers.items()):
+					if time.time() - worker['last_seen'] < defaults['worker_timeout']:
+						continue
+					for task_id in worker['tasks']:
+						task = self.tasks[task_id]
+						logging.warning('Worker {} is dead. Reassigning step {}'.format(worker_id, task['step']))
+						task['worker'] = None
+						self.queue.appendleft(task_id)
+					del self.workers[worker_id]
+				self.condition.notify_all()
+
+	# corec_init operations
+
+	def run(self, step_id, commands, parameters, timeout=None):
+		'''
+		Blocks until a worker has run the step. Returns the result that the worker sent, or None if the step was cancelled
+		'''
+		task = {'id': get_uuid(), 'step': step_id, 'commands': commands, 'parameters': parameters, 'timeout': timeout,
+			'worker': None, 'result': None, 'done': threading.Event()}
+
+		with self.condition:
+			self.tasks[task['id']] = task
+			self.queue.append(task['id'])
+			self.condition.notify_all()
+
+		while not task['done'].wait(self.wait_seconds()):
+			with self.condition:
+				if self.deadline_passed(task):
+					# No worker took it in time, or its worker is gone
+					self.cancel_task(task)
+					task['expired'] = True
+				elif task['worker'] is None:
+					logging.info('Step {} waits for a worker. Workers: {}'.format(step_id, len(self.workers)))
+
+		with self.condition:
+			del self.tasks[task['id']]
+		if task.get('expired'):
+			raise CORECException('The run has exceeded its timeout of {}. Step {} did not finish on a worker'.format(format_seconds(defaults['timeout']), step_id))
+		return task['result']
+
+	def wait_seconds(self):
+		if defaults['deadline'] is None:
+			return 60
+		return min(60, max(1.0, defaults['deadline'] - time.time()))
+
+	def deadline_passed(self, task):
+		'''
+		A step that runs on a worker gets the grace period of its kill and a heartbeat to report it
+		'''
+		deadline = defaults['deadline']
+		if deadline is None:
+			return False
+		if task['worker'] is not None:
+			deadline += defaults['kill_grace_seconds'] + 2 * defaults['heartbeat_interval']
+		return time.time() > deadline
+
+	def cancel_task(self, task):
+		'''
+		Remove the task from the queue, or tell its worker to kill it with the next heartbeat. Call with the condition held
+		'''
+		if task['worker'] is None:
+			if task['id'] in self.queue:
+				self.queue.remove(task['id'])
+		else:
+			worker = self.workers.get(task['worker'])
+			if worker is not None:
+				worker['tasks'].discard(task['id'])
+				worker['cancel'].add(task['id'])
+			task['worker'] = None # A late result is ignored
+		task['done'].set()
+
+	def cancel(self, step_id):
+		'''
+		Cancel the tasks of the step
+		'''
+		with self.condition:
+			for task in self.tasks.values():
+				if task['step'] == step_id and not task['done'].is_set():
+					self.cancel_task(task)
+
+	def start(self):
+		try:
+			import socketserver
+		except ImportError:
+			import SocketServer as socketserver # Python 2
+
+		class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+			daemon_threads = True
+			allow_reuse_address = True
+
+		self.server = Server(self.address, json_lines_handler(self.handle))
+		for target in [self.server.serve_forever, self.check_workers]:
+			thread = threading.Thread(target=target)
+			thread.daemon = True
+			thread.start()
+
+		logging.info('corec coordinator is listening on: {}:{}'.format(*self.server.server_address[:2]))
+
+	def stop(self):
+		self.stopped.set()
+		with self.condition:
+			self.condition.notify_all() # Workers that wait for a step get stop
+		if self.server:
+			time.sleep(min(1.0, defaults['heartbeat_interval'])) # Let them get it
+			self.server.shutdown()
+			self.server.server_close()
+		logging.info('corec coordinator stopped')
+
+def get_coordinator_token():
+	token = defaults['coordinator_token']
+	if not token:
+		raise CORECException('The coordinator and its workers need a shared token: --token or the COREC_TOKEN environment variable')
+	return token
+
+def start_coordinator(address):
+	coordinator = CORECCoordinator(parse_address(address), get_coordinator_token())
+	coordinator.start()
+	defaults['coordinator'] = coordinator
+
+def stop_coordinator():
+	coordinator = defaults['coordinator']
+	if coordinator is None:
+		return
+	defaults['coordinator'] = None
+	coordinator.stop()
+
+def task_parameters(inputs=None):
+	'''
+	The parameters that a worker gets for a step: its inputs with their blobs loaded, and the other parameters that are not blobs.
+	Other blobs stay here. inputs None: all the blobs
+	'''
+	parameters = {}
+	for parameter, value in corec_iteritems(get_parameter_store().get_all()):
+		if inputs is None or parameter in inputs:
+			parameters[parameter] = blob_load(value)
+		elif not is_blob_reference(value):
+			parameters[parameter] = value
+	return parameters
+
+def run_remote_step(id_, commands, timeout=None, inputs=None):
+	'''
+	Run a step on a worker. inputs: ids of the parameters that the step needs (see task_parameters).
+	The parameters that the step set are saved here. Returns the result of the worker
+	'''
+	parameters = task_parameters(inputs)
+	result = defaults['coordinator'].run(id_, commands, parameters, timeout)
+	if result is None:
+		raise StepCancelled('{} was cancelled'.format(id_))
+
+	if result['outputs']:
+		logging.info('Step {} set: {}'.format(id_, ', '.join(sorted(result['outputs']))))
+		update_parameters(result['outputs'])
+
+	return result
+
+def run_worker_task(task):
+	'''
+	Run a step that the coordinator sent. Its script and its own parameter file, with the parameters that the coordinator sent,
+	are in a new directory in the scratch directory. The step runs in the current directory (the --workdir of the worker),
+	like a step of corec_init: the files that it writes with relative paths should end up on the shared filesystem.
+	Returns the result of run_bash_command and the parameters that the step set (outputs)
+	'''
+	import shutil
+	import tempfile
+
+	mkdir_p(defaults['scratch_dir'])
+	directory = tempfile.mkdtemp(prefix='corec_task_', dir=defaults['scratch_dir'])
+	try:
+		env = dict(os.environ)
+		env.pop('COREC_TOKEN', None) # Steps do not talk to the coordinator
+		for key in ['parameters_filename', 'parameters_sqlite_filename', 'daemon_socket']:
+			env['COREC_' + key.upper()] = os.path.abspath(os.path.join(directory, os.path.basename(defaults[key])))
+		env['COREC_WORKER_STEP'] = '1' # The locks of corec_init are not visible here
+		# The corec commands of the step are next to corec_tools.py
+		env['PATH'] = os.path.dirname(os.path.abspath(__file__)) + os.pathsep + env.get('PATH', '')
+
+		parameters_filename = env['COREC_PARAMETERS_FILENAME']
+		write_file_atomic(parameters_filename, json.dumps(task['parameters']))
+
+		fn = os.path.join(directory, random_filename('step', task['step']))
+		with open(fn, 'w') as f:
+			f.write('set -e\n\n') # Stop on first error
+			f.write(task['commands'])
+
+		result = run_bash_command(['bash', fn], fn, env=env, timeout=task.get('timeout'), key=task['id'])
+
+		with open(parameters_filename) as f:
+			parameters = json.load(f)
+	finally:
+		shutil.rmtree(directory, ignore_errors=True)
+
+	missing = object()
+	result['outputs'] = dict((parameter, blob_load(value)) for parameter, value in corec_iteritems(parameters) 
+		if task['parameters'].get(parameter, missing) != value)
+
+	import platform
+	for stream_name in ['stdout', 'stderr']:
+		result[stream_name + '_log'] = '{}:{}'.format(platform.node(), os.path.abspath(result[stream_name + '_log']))
+
+	return result
+
+class CORECWorker(object):
+	'''
+	Asks the coordinator for steps and runs up to jobs of them at the same time. Sends heartbeats while they run.
+	'''
+
+	def __init__(self, address, jobs, name, token):
+		self.client = JSONLinesClient(address, token)
+		self.jobs = jobs
+		self.name = name
+		self.worker_id = None
+		self.stopped = threading.Event()
+
+	def register(self):
+		registration = self.request('register', self.name, self.jobs)
+		self.worker_id = registration['worker_id']
+		defaults['heartbeat_interval'] = registration['heartbeat_interval']
+		logging.info('Registered as worker: {}'.format(self.worker_id))
+
+	def request(self, op, *args):
+		'''
+		Retry while the coordinator is not reachable, up to worker_timeout seconds
+		'''
+		deadline = time.time() + defaults['worker_timeout']
+		while True:
+			try:
+				return self.client.request(op, *args)
+			except (IOError, OSError) as e: # socket.error is an IOError
+				if time.time() > deadline or self.stopped.is_set():
+					raise CORECException('Lost the coordinator: {}'.format(e))
+				time.sleep(1)
+
+	def send_heartbeats(self):
+		while not self.stopped.wait(defaults['heartbeat_interval']):
+			try:
+				response = self.request('heartbeat', self.worker_id)
+				if not response:
+					logging.warning('The coordinator declared worker {} dead. Registering again'.format(self.worker_id))
+					self.register()
+				elif isinstance(response, list):
+					for task_id in response:
+						cancel_process(task_id)
+			except CORECException as e:
+				logging.error(str(e))
+				self.stopped.set()
+
+	def run_tasks(self):
+		while not self.stopped.is_set():
+			try:
+				task = self.request('get_task', self.worker_id, 10)
+				if task is None:
+					continue
+				if task.get('stop'):
+					logging.info('The coordinator has finished')
+					self.stopped.set()
+					kill_running_processes() # Nobody waits for their results
+					break
+
+				logging.info('Running step: {}'.format(task['step']))
+				result = run_worker_task(task)
+				logging.info('Step {} finished with return code: {}'.format(task['step'], result['return_code']))
+				if not self.request('task_done', self.worker_id, task['id'], result):
+					logging.warning('Step {} has been reassigned. Result ignored'.format(task['step']))
+			except CORECException as e:
+				if 'Unknown worker' in str(e):
+					continue # The heartbeat thread registers again
+				logging.error(str(e))
+				self.stopped.set()
+
+	def run(self):
+		self.register()
+		threads = [threading.Thread(target=self.send_heartbeats)]
+		threads += [threading.Thread(target=self.run_tasks) for _ in range(self.jobs)]
+		for thread in threads:
+			thread.daemon = True
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+# END OF COREC COORDINATOR
+
+##################################################
+
+# STEP CACHE
+
+def get_step_inputs(pipeline, node):
+	return [get_target(edge) for edge in get_outgoing_edges(pipeline, node, 'Needs_Parameter')]
+
+def get_step_outputs(pipeline, node):
+	return [get_target(edge) for edge in get_outgoing_edges(pipeline, node, 'Sets_Outputs')]
+
+def step_cache_key(pipeline, node):
+	'''
+	Hash of the id and the commands of the step and the values of its input parameters.
+	Two steps with the same commands and inputs do not share an entry.
+	Assumes that defaults['parameters'] is loaded.
+	'''
+	import hashlib
+	h = hashlib.sha256()
+	h.update(json.dumps(['step', get_id(node)]).encode('utf-8'))
+	h.update(node["data"]["bash_commands"].encode('utf-8'))
+
+	for parameter_id in sorted(set(get_step_inputs(pipeline, node))):
+		value = defaults['parameters'].get(parameter_id)
+		h.update(json.dumps([parameter_id, value], sort_keys=True).encode('utf-8'))
+
+		if defaults['cache_hash_files'] and type(value).__name__ in ['unicode', 'str'] and os.path.isfile(value):
+			hash_file(value, h)
+
+	return h.hexdigest()
+
+def step_cache_filename(cache_key):
+	return os.path.join(defaults['cache_dir'], cache_key + '.json')
+
+def restore_step_cache(pipeline, node, cache_key):
+	'''
+	Set the outputs of the step from the cache. Returns True on a cache hit
+	'''
+	cache_filename = step_cache_filename(cache_key)
+	try:
+		with open(cache_filename) as f:
+			entry = json.load(f)
+	except (IOError, OSError, ValueError):
+		return False
+
+	for value in entry['outputs'].values():
+		if not blob_exists(value):
+			logging.info('Cached output blob of step {} does not exist. Ignoring cache'.format(get_id(node)))
+			return False
+
+	# Outputs that point to files are valid only if the files are still there
+	for filename in entry['files']:
+		if not os.path.exists(filename):
+			logging.info('Cached output file {} of step {} does not exist. Ignoring cache'.format(filename, get_id(node)))
+			return False
+
+	update_parameters(entry['outputs'])
+
+	try:
+		os.utime(cache_filename, None) # Recently used. Evicted last
+	except OSError:
+		pass
+
+	return True
+
+def store_step_cache(pipeline, node, cache_key):
+	load_parameters()
+
+	outputs = {}
+	for parameter_id in get_step_outputs(pipeline, node):
+		if not parameter_id in defaults['parameters']:
+			logging.info('Step {} did not set output {}. Not caching'.format(get_id(node), parameter_id))
+			return
+		outputs[parameter_id] = defaults['parameters'][parameter_id]
+
+	files = [value for value in outputs.values() if type(value).__name__ in ['unicode', 'str'] and os.path.exists(value)]
+
+	entry = {
+		'step': get_id(node),
+		'created': now(),
+		'outputs': outputs,
+		'files': files,
+	}
+
+	mkdir_p(defaults['cache_dir'])
+	write_file_atomic(step_cache_filename(cache_key), json.dumps(entry, indent=4))
+
+def step_cache_values():
+	'''
+	The output values of all cache entries
+	'''
+	values = []
+	cache_dir = defaults['cache_dir']
+	if not os.path.isdir(cache_dir):
+		return values
+
+	for filename in os.listdir(cache_dir):
+		if not filename.endswith('.json'):
+			continue
+		try:
+			with open(os.path.join(cache_dir, filename)) as f:
+				values.extend(json.load(f)['outputs'].values())
+		except (IOError, OSError, ValueError, KeyError):
+			continue
+
+	return values
+
+def evict_step_cache():
+	'''
+	Remove the least recently used entries until the cache fits in defaults['cache_max_bytes']
+	'''
+	cache_dir = defaults['cache_dir']
+	if not os.path.isdir(cache_dir):
+		return
+
+	with file_lock(cache_dir):
+		entries = []
+		total_size = 0
+		for filename in os.listdir(cache_dir):
+			if not filename.endswith('.json'):
+				continue
+			filename = os.path.join(cache_dir, filename)
+			try:
+				stat = os.stat(filename)
+			except OSError:
+				continue
+			entries.append((stat.st_mtime, stat.st_size, filename))
+			total_size += stat.st_size
+
+		entries.sort()
+		while entries and total_size > defaults['cache_max_bytes']:
+			mtime, size, filename = entries.pop(0)
+			logging.info('Evicting cache entry: {}'.format(filename))
+			try:
+				os.remove(filename)
+			except OSError:
+				pass
+			total_size -= size
+
+def has_unset_outputs(pipeline, node):
+	'''
+	Assumes that defaults['parameters'] is loaded
+	'''
+	return any(not parameter_id in defaults['parameters'] for parameter_id in get_step_outputs(pipeline, node))
+
+def step_is_cacheable(pipeline, node):
+	'''
+	A step that sets no outputs runs for its side effects. A cache hit would skip them
+	'''
+	return defaults['cache'] and not defaults['mock'] and node["data"].get('cache', True) and bool(get_step_outputs(pipeline, node))
+
+# END OF STEP CACHE
+
+##################################################
+
+# RUN JOURNAL
+
+def journal_reset():
+	write_file_atomic(defaults['journal_filename'], '')
+
+def journal_write(event, kind, id_=None, **kwargs):
+	'''
+	Append one entry and fsync so that the entry survives a crash
+	event: start, finish, resume
+	kind: run, step, tool
+	'''
+	if defaults['daemon'] is not None:
+		# The journal should never be ahead of the stored parameters
+		defaults['daemon'].flush()
+
+	entry = {'time': time.time(), 'event': event, 'kind': kind, 'id': id_}
+	entry.update(kwargs)
+	line = json.dumps(entry) + '\n'
+
+	journal_filename = defaults['journal_filename']
+	with file_lock(journal_filename):
+		fd = os.open(journal_filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+		try:
+			os.write(fd, line.encode('utf-8'))
+			os.fsync(fd)
+		finally:
+			os.close(fd)
+
+def journal_replay():
+	'''
+	Returns a dictionary: kind --> set of ids that finished successfully
+	'''
+	completed = {'step': set(), 'tool': set()}
+
+	with open(defaults['journal_filename']) as f:
+		for line in f:
+			try:
+				entry = json.loads(line)
+			except ValueError:
+				# The last line of a crashed run might be incomplete
+				logging.warning('Ignoring corrupted journal entry: {}'.format(line.strip()))
+				continue
+
+			if entry['event'] == 'finish' and entry['kind'] in completed and not entry.get('return_code'):
+				completed[entry['kind']].add(entry['id'])
+
+	return completed
+
+# END OF RUN JOURNAL
+
+##################################################
+
+# RUN METRICS
+
+run_metrics = {
+	'records': [], # One for every executed step or tool
+	'dependencies': {}, # step id --> [ids of the steps that it waits for]
+}
+run_metrics_lock = threading.Lock()
+
+def metrics_record(kind, id_, start, end, result=None, **kwargs):
+	'''
+	kind: step, tool. start, end: time.time() timestamps.
+	result: the result of execute_commands, None if nothing was executed
+	'''
+	record = {
+		'kind': kind,
+		'id': id_,
+		'start': start,
+		'end': end,
+		'duration': end - start,
+		'thread': threading.current_thread().name,
+		'rusage': result.get('rusage') if result else None,
+	}
+	record.update(kwargs)
+
+	if kind == 'tool':
+		# Tools are installed by corec_requires in the processes of steps. corec_init collects them in metrics_write
+		record['thread'] = 'corec_requires {}'.format(os.getpid())
+		with file_lock(defaults['tool_metrics_filename']):
+			with open(defaults['tool_metrics_filename'], 'a') as f:
+				f.write(json.dumps(record) + '\n')
+		return
+
+	with run_metrics_lock:
+		run_metrics['records'].append(record)
+
+def metrics_reset():
+	if os.path.isfile(defaults['tool_metrics_filename']):
+		os.remove(defaults['tool_metrics_filename'])
+
+def read_tool_metrics():
+	'''
+	The records that metrics_record appended for tools
+	'''
+	if not os.path.isfile(defaults['tool_metrics_filename']):
 		return []
 
-	ret = [lock_name for lock_name, lock_value in corec_iteritems(locks) if lock_value]
-	return ret
+	records = []
+	with file_lock(defaults['tool_metrics_filename']):
+		with open(defaults['tool_metrics_filename']) as f:
+			for line in f:
+				try:
+					records.append(json.loads(line))
+				except ValueError:
+					logging.warning('Ignoring corrupted tool metrics entry: {}'.format(line.strip()))
+	return records
+
+def metrics_add_plan(plan):
+	with run_metrics_lock:
+		run_metrics['dependencies'].update(plan.dependencies)
+
+def measured_peak(records):
+	'''
+	Peak usage of the steps that ran at the same time, from their rusage.
+	Cores: the sum of their CPU time / wall time. Memory (MB): the sum of their max resident set sizes
+	(an upper bound, the maxima might not coincide)
+	'''
+	events = []
+	for record in records:
+		rusage = record.get('rusage')
+		if record['kind'] != 'step' or not rusage or record['duration'] <= 0:
+			continue
+		cores = (rusage['utime'] + rusage['stime']) / record['duration']
+		memory_mb = rusage['maxrss_kb'] / 1024.0
+		events.append((record['start'], 1, cores, memory_mb))
+		events.append((record['end'], 0, -cores, -memory_mb)) # Ends sort before starts at the same time
+
+	events.sort()
+	cores, memory_mb, peak_cores, peak_memory_mb = 0, 0, 0, 0
+	for _, _, event_cores, event_memory_mb in events:
+		cores += event_cores
+		memory_mb += event_memory_mb
+		peak_cores = max(peak_cores, cores)
+		peak_memory_mb = max(peak_memory_mb, memory_mb)
+
+	return peak_cores, peak_memory_mb
+
+def critical_path(records, dependencies):
+	'''
+	The chain of dependent steps with the largest total duration.
+	Returns the list of step ids and the total duration in seconds.
+	'''
+	step_records = [record for record in records if record['kind'] == 'step']
+	duration = dict((record['id'], record['duration']) for record in step_records)
+
+	# A step starts after all the steps it depends on have finished, so start time is a topological order
+	longest = {} # step id --> (duration of the longest chain that ends in this step, previous step)
+	for record in sorted(step_records, key=lambda x: x['start']):
+		id_ = record['id']
+		finished = [dependent_step_id for dependent_step_id in dependencies.get(id_, []) if dependent_step_id in longest]
+		previous = max(finished, key=lambda x: longest[x][0]) if finished else None
+		longest[id_] = (duration[id_] + (longest[previous][0] if previous else 0.0), previous)
+
+	if not longest:
+		return [], 0.0
+
+	id_ = max(longest, key=lambda x: longest[x][0])
+	total = longest[id_][0]
+	path = []
+	while id_:
+		path.append(id_)
+		id_ = longest[id_][1]
+
+	return path[::-1], total
+
+def chrome_trace(records):
+	'''
+	Complete ("X") events, one row for every thread that executed steps
+	https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+	'''
+	threads = {}
+	events = []
+	for record in sorted(records, key=lambda x: x['start']):
+		tid = threads.setdefault(record['thread'], len(threads) + 1)
+		args = dict(record['rusage'] or {})
+		args.update((k, v) for k, v in corec_iteritems(record) if k not in ['kind', 'id', 'start', 'end', 'duration', 'thread', 'rusage'])
+		events.append({
+			'name': record['id'],
+			'cat': record['kind'],
+			'ph': 'X',
+			'ts': int(record['start'] * 1e6),
+			'dur': int(record['duration'] * 1e6),
+			'pid': os.getpid(),
+			'tid': tid,
+			'args': args,
+		})
+
+	for thread_name, tid in corec_iteritems(threads):
+		events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': thread_name}})
+
+	return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def metrics_write():
+	'''
+	Write the metrics of this run in metrics_filename and trace_filename
+	'''
+	with run_metrics_lock:
+		records = list(run_metrics['records'])
+		dependencies = dict(run_metrics['dependencies'])
+	records.extend(read_tool_metrics())
+
+	path, path_duration = critical_path(records, dependencies)
+	metrics = {
+		'records': records,
+		'dependencies': dependencies,
+		'critical_path': path,
+		'critical_path_duration': path_duration,
+	}
+
+	write_file_atomic(defaults['metrics_filename'], json.dumps(metrics, indent=4))
+	write_file_atomic(defaults['trace_filename'], json.dumps(chrome_trace(records)))
+	logging.info('Metrics of {} steps and tools saved in {} and {}'.format(len(records), defaults['metrics_filename'], defaults['trace_filename']))
+	if path:
+		logging.info('Critical path ({:.3f} seconds): {}'.format(path_duration, ' -> '.join(path)))
+
+# END OF RUN METRICS
+
+##################################################
+
+# RUN HISTORY
+
+class RunHistory(object):
+	'''
+	Durations of the steps of all runs in an SQLite database.
+	A step is identified by its id and the hash of its bash commands: editing the commands of a step starts a new history.
+	'''
+
+	def __init__(self, filename):
+		self.filename = filename
+		self.local = threading.local() # sqlite3 connections cannot be shared between threads
+
+	def connection(self):
+		connection = getattr(self.local, 'connection', None)
+		if connection is None:
+			import sqlite3
+			connection = sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+			connection.execute('PRAGMA journal_mode=WAL')
+			connection.execute('CREATE TABLE IF NOT EXISTS step_runs (step TEXT, commands_hash TEXT, start REAL, duration REAL, return_code INTEGER)')
+			connection.execute('CREATE INDEX IF NOT EXISTS step_runs_key ON step_runs (step, commands_hash, start)')
+			self.local.connection = connection
+		return connection
+
+	def record(self, key, start, duration, return_code):
+		self.connection().execute('INSERT INTO step_runs (step, commands_hash, start, duration, return_code) VALUES (?, ?, ?, ?, ?)',
+			(key[0], key[1], start, duration, return_code))
+
+	def expected_duration(self, key, runs):
+		'''
+		The median duration of the last runs successful runs. None if the step has never run successfully
+		'''
+		rows = self.connection().execute('SELECT duration FROM step_runs WHERE step=? AND commands_hash=? AND return_code=0 ORDER BY start DESC LIMIT ?',
+			(key[0], key[1], runs)).fetchall()
+		if not rows:
+			return None
+		durations = sorted(row[0] for row in rows)
+		return durations[len(durations)//2]
+
+_run_histories = {}
+
+def get_run_history():
+	key = os.path.abspath(defaults['history_filename'])
+	if not key in _run_histories:
+		_run_histories[key] = RunHistory(key)
+	return _run_histories[key]
+
+def step_history_key(node):
+	import hashlib
+	return get_id(node), hashlib.sha256(node["data"]["bash_commands"].encode('utf-8')).hexdigest()[:16]
 
+def history_record(node, start, end, return_code):
+	get_run_history().record(step_history_key(node), start, end - start, return_code)
+
+def expected_durations(plan):
+	'''
+	step id --> expected duration in seconds, or None if unknown
+	'''
+	history = get_run_history()
+	return dict((get_id(node), history.expected_duration(step_history_key(node), defaults['history_runs'])) for node in plan)
+
+def simulate_plan(plan, durations, jobs):
+	'''
+	Start times of the steps if they run in jobs parallel slots and take their expected durations (unknown: 0).
+	Same order as execute_plan_parallel: when there is a choice, the earliest step in the plan.
+	Returns step id --> start time, and the total wall time.
+	'''
+	import heapq
+
+	plan_ids = plan.ids()
+	plan_index = dict((step_id, index) for index, step_id in enumerate(plan_ids))
+	waiting_for = dict((step_id, len(plan.dependencies[step_id])) for step_id in plan_ids)
+	dependents = {}
+	for step_id in plan_ids:
+		for dependent_step_id in plan.dependencies[step_id]:
+			dependents.setdefault(dependent_step_id, []).append(step_id)
+
+	ready = [plan_index[step_id] for step_id, count in corec_iteritems(waiting_for) if not count]
+	heapq.heapify(ready)
+	running = [] # (end time, step id)
+	starts = {}
+	now = 0.0
+	while ready or running:
+		while ready and len(running) < jobs:
+			step_id = plan_ids[heapq.heappop(ready)]
+			starts[step_id] = now
+			heapq.heappush(running, (now + (durations.get(step_id) or 0.0), step_id))
+
+		now, step_id = heapq.heappop(running)
+		for dependent_step_id in dependents.get(step_id, []):
+			waiting_for[dependent_step_id] -= 1
+			if not waiting_for[dependent_step_id]:
+				heapq.heappush(ready, plan_index[dependent_step_id])
+
+	return starts, now
+
+def format_seconds(seconds):
+	if seconds < 60:
+		return '{:.1f}s'.format(seconds)
+	return str(datetime.timedelta(seconds=int(round(seconds))))
+
+def log_plan_estimate(plan, durations):
+	'''
+	Expected wall time and critical path of the plan, from the history of the steps
+	'''
+	jobs = max(1, defaults['jobs'])
+	starts, wall_time = simulate_plan(plan, durations, jobs)
+	records = [{'kind': 'step', 'id': step_id, 'start': start, 'duration': durations[step_id] or 0.0} for step_id, start in corec_iteritems(starts)]
+	path, path_duration = critical_path(records, plan.dependencies)
+
+	unknown = [step_id for step_id in plan.ids() if durations[step_id] is None]
+	estimate_log = 'Expected wall time with {} jobs: {}. Critical path ({}): {}'.format(
+		jobs, format_seconds(wall_time), format_seconds(path_duration), ' -> '.join(path) or '-')
+	if unknown:
+		estimate_log += '. Steps without history (counted as 0): {}'.format(len(unknown))
+	logging.info(estimate_log)
+
+class PlanETA(object):
+	'''
+	Estimated remaining time of a running plan.
+	The remaining expected work is scaled by the parallelism that the simulation of the whole plan predicts.
+	Written in status_filename and shown in the console.
+	'''
 
-# END OF MANAGE LOCKS
+	def __init__(self, plan, durations, jobs):
+		self.durations = durations
+		self.total = len(plan)
+		self.finished = 0
+		self.remaining_work = sum(duration or 0.0 for duration in durations.values())
+		self.known = any(duration is not None for duration in durations.values()) # Any step with history
+		_, wall_time = simulate_plan(plan, durations, jobs)
+		self.speedup = (self.remaining_work / wall_time) if wall_time else 1.0
+		self.start = time.time()
+		self.lock = threading.Lock()
+		self.write_status()
+
+	def step_finished(self, step_id):
+		with self.lock:
+			self.finished += 1
+			self.remaining_work -= self.durations.get(step_id) or 0.0
+		self.write_status()
+
+	def eta(self):
+		return max(0.0, self.remaining_work) / self.speedup
+
+	def eta_string(self):
+		if not self.known:
+			return 'unknown'
+		return format_seconds(self.eta())
+
+	def __str__(self):
+		return '[{}/{} steps, ETA {}]'.format(self.finished, self.total, self.eta_string())
+
+	def write_status(self):
+		status = '{} finished: {} / {} steps. Elapsed: {}. ETA: {}'.format(
+			datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), self.finished, self.total,
+			format_seconds(time.time() - self.start), self.eta_string())
+		if self.known:
+			status += ' (at {})'.format((datetime.datetime.now() + datetime.timedelta(seconds=self.eta())).strftime('%H:%M:%S'))
+		write_file_atomic(defaults['status_filename'], status + '\n')
+
+def plan_step_finished(step_id):
+	plan_eta = defaults['plan_eta']
+	if plan_eta is not None:
+		plan_eta.step_finished(step_id)
+		logging.info('Progress: {}'.format(plan_eta))
+
+def eta_string():
+	plan_eta = defaults['plan_eta']
+	return '{} '.format(plan_eta) if plan_eta is not None else ''
+
+# END OF RUN HISTORY
 
 ##################################################
 
 # COREC REPORT
 
+def report_dir():
+	return get_parameter('corec_report_dir')
+
 def report_html_fn():
-	load_parameters()
+	return os.path.join(report_dir(), 'index.html')
 
-	return os.path.join(defaults['parameters']['corec_report_dir'], 'index.html')
+def report_journal_fn():
+	'''
+	Fragments of the report in the order that they were added. Kept next to the report directory.
+	'''
+	return report_dir() + '.journal'
 
 def report_init():
 
@@ -380,41 +3070,171 @@ def report_init():
 	logging.info('Created report directory: {}'.format(corec_report_directory))
 	save_parameter('corec_report_dir', corec_report_directory, False)
 
-	init_content = '''<!DOCTYPE html>
-<html>
-<body>
-{content}
-</body>
-</html>
-'''
+	write_file_atomic(report_journal_fn(), '')
+	report_write_html(['<p>The report is being generated..</p>'])
 
-	with open(report_html_fn(), 'w') as f:
-		f.write(init_content)
+def report_write_html(fragments):
+	with open(report_html_fn() + '.tmp', 'w') as f:
+		f.write('<!DOCTYPE html>\n<html>\n<body>\n')
+		for fragment in fragments:
+			f.write(fragment)
+			f.write('\n')
+		f.write('</body>\n</html>\n')
+	os.rename(report_html_fn() + '.tmp', report_html_fn())
 
-def report_finalize():
+def report_fragments():
+	'''
+	Streams the fragments from the report journal
+	'''
+	with open(report_journal_fn()) as f:
+		for line in f:
+			try:
+				yield json.loads(line)['html']
+			except ValueError:
+				logging.warning('Ignoring corrupted report entry: {}'.format(line.strip()))
+
+def report_append(html_to_add):
+	'''
+	Append a fragment in the report journal. The order of the journal is the order of the report.
+	Writers of all processes append under the same lock.
+	'''
+	entry = {'time': time.time(), 'pid': os.getpid(), 'html': html_to_add}
+	line = (json.dumps(entry) + '\n').encode('utf-8')
 
-	html_filename = report_html_fn()
-	with open(html_filename) as f:
-		html_filename_content = f.read()
+	with file_lock(report_dir()): # Keep the lock file out of the report directory
+		fd = os.open(report_journal_fn(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+		try:
+			os.write(fd, line)
+		finally:
+			os.close(fd)
 
-	html_filename_new_content = html_filename_content.format(content='')
+def report_finalize():
 
-	with open(html_filename, 'w') as f:
-		f.write(html_filename_new_content)
+	# Build the html once from the journal
+	html_filename = report_html_fn()
+	report_write_html(report_fragments())
 
 	# Make a tarfile
-	make_tarfile("corec_report.tar.gz", defaults['parameters']['corec_report_dir'])
+	archive_start = datetime.datetime.now()
+	archive_filename = make_tarfile("corec_report", report_dir(), defaults['report_codec'], defaults['report_compression_threads'])
+	archive_finish = datetime.datetime.now()
 	logging.info('HTML Report is available at: {}'.format(html_filename))
-	logging.info('Compressed report with supporting files is available at: corec_report.tar.gz')
+	logging.info('Compressed report with supporting files is available at: {} (Time taken: {})'.format(archive_filename, time_difference(archive_start, archive_finish)))
+
+
+def report_digests_fn():
+	'''
+	sha256 of the content --> name of the files in the report directory. Kept next to the report directory.
+	'''
+	return report_dir() + '.digests'
+
+def read_report_digests():
+	digests = {}
+	if not os.path.isfile(report_digests_fn()):
+		return digests
+
+	with open(report_digests_fn()) as f:
+		for line in f:
+			try:
+				entry = json.loads(line)
+			except ValueError:
+				continue # The last line of a crashed run
+			digests[entry['digest']] = entry['name']
+	return digests
+
+def report_artifact(filename):
+	'''
+	Place a file in the report directory. Returns its name in the report directory.
+	Files with identical content are stored once, whatever their names.
+	A file with the same name and different content gets the beginning of its sha256 in its name.
+	'''
+	corec_report_directory = report_dir()
+
+	with file_lock(corec_report_directory):
+		digest = file_digest(filename)
+		name = read_report_digests().get(digest)
+		if name and os.path.exists(os.path.join(corec_report_directory, name)):
+			logging.info('Report already contains the content of {} as: {}'.format(filename, name))
+			return name
+
+		name = os.path.basename(filename)
+		dest = os.path.join(corec_report_directory, name)
+		if os.path.exists(dest):
+			#Another file has this name. Change the destination
+			name_f, name_e = os.path.splitext(name)
+			name = '{}_{}{}'.format(name_f, digest[:12], name_e)
+			dest = os.path.join(corec_report_directory, name)
+
+		if not os.path.exists(dest):
+			how = link_or_copy(filename, dest)
+			logging.info('Placed {} in report directory as {} ({})'.format(filename, name, how))
+
+		with open(report_digests_fn(), 'a') as f:
+			f.write(json.dumps({'digest': digest, 'name': name}) + '\n')
+
+	return name
+
+def read_head(f, lines, max_bytes, chunk_size=64 * 1024):
+	'''
+	The first lines of an open binary file, reading at most max_bytes
+	'''
+	head = b''
+	while head.count(b'\n') < lines and len(head) < max_bytes:
+		chunk = f.read(min(chunk_size, max_bytes - len(head)))
+		if not chunk:
+			break
+		head += chunk
 
+	return b''.join(head.splitlines(True)[:lines])
+
+def read_tail(f, lines, max_bytes, chunk_size=64 * 1024):
+	'''
+	The last lines of an open binary file, reading backwards at most max_bytes
+	'''
+	f.seek(0, os.SEEK_END)
+	position = f.tell()
+	tail = b''
+	# One more newline than lines: the one before the first line we keep
+	while tail.count(b'\n') <= lines and len(tail) < max_bytes and position > 0:
+		size = min(chunk_size, position, max_bytes - len(tail))
+		position -= size
+		f.seek(position)
+		tail = f.read(size) + tail
+
+	tail_lines = tail.splitlines(True)
+	if position > 0 and len(tail_lines) > 1:
+		tail_lines = tail_lines[1:] # The first line is probably partial
+	return b''.join(tail_lines[-lines:])
+
+def text_preview(filename):
+	'''
+	The text of a file to embed in the report.
+	Files larger than report_max_embed_bytes are embedded as their first report_head_lines and
+	last report_tail_lines. Memory does not depend on the size of the file.
+	'''
+	max_bytes = defaults['report_max_embed_bytes']
+	size = os.path.getsize(filename)
+
+	with open(filename, 'rb') as f:
+		if size <= max_bytes:
+			return f.read().decode('utf-8', 'replace')
+
+		head = read_head(f, defaults['report_head_lines'], max_bytes // 2)
+		tail = read_tail(f, defaults['report_tail_lines'], max_bytes // 2)
+
+	omitted = size - len(head) - len(tail)
+	return '{}\n... {} bytes omitted, see the full file ...\n\n{}'.format(
+		head.decode('utf-8', 'replace').rstrip('\n'),
+		omitted,
+		tail.decode('utf-8', 'replace'),
+	)
 
 def report_add(content):
 	'''
 	content is always string
 	'''
 
-	load_parameters()
-	corec_report_directory = defaults['parameters']['corec_report_dir']
+	corec_report_directory = report_dir()
 
 	assert type(content).__name__ in ['unicode', 'str']
 
@@ -425,18 +3245,7 @@ def report_add(content):
 		There is a file with this name
 		Get the extension
 		'''
-		dest = os.path.join(corec_report_directory, content)
-
-		#Copy to report directory
-		if os.path.isfile(dest):
-			#The file already exists. Change the destination
-			new_dest_f, new_dest_e = os.path.splitext(dest)
-			new_dest = new_dest_f + "_" + get_uuid() + new_dest_e
-			copyfile(content, new_dest)
-			content = os.path.split(new_dest)[1]
-		else:
-			copyfile(content, dest)
-
+		content = report_artifact(content)
 
 		extension = os.path.splitext(content)[1].lower().replace('.', '')
 		filename = os.path.split(content)[1]
@@ -448,9 +3257,8 @@ def report_add(content):
 				html_to_add = html_function(content)
 
 		if not html_to_add:
-			#Trying to embed the whole file as txt file
-			with open(content) as f:
-				text = f.read()
+			#Trying to embed the file as txt file. Large files are previewed
+			text = text_preview(os.path.join(corec_report_directory, content))
 
 			html_to_add = '<p>File: <a href="{}">{}</a>:</p>'.format(content, content)
 			html_to_add += defaults['report_text'](text)
@@ -461,21 +3269,20 @@ def report_add(content):
 		html_to_add = defaults['report_default'](content)
 		logging.info('Added in report string: {}'.format(content))
 
-	html_filename = report_html_fn()
-	with open(html_filename) as f:
-		html_filename_content = f.read()
-
-	html_filename_new_content = html_filename_content.format(content=html_to_add + '\n{content}')
-
-	with open(html_filename, 'w') as f:
-		f.write(html_filename_new_content)
+	report_append(html_to_add)
 
 
 # END OF COREC REPORT 
 
 ##################################################
 
+# Steps that run in parallel keep their progress in their own thread
+progress_local = threading.local()
+
 def read_progress():
+	if getattr(progress_local, 'progress', None) is not None:
+		return progress_local.progress
+
 	progress_filename = defaults['progress_filename']
 	if not os.path.isfile(progress_filename):
 		with open(progress_filename, 'w') as f:
@@ -509,6 +3316,13 @@ def has_progress(progress_string):
 
 			local_progress_string = " --> {}{}".format(progress_string, get_id(kwargs['node']))
 			current_progress = read_progress()
+			if getattr(progress_local, 'progress', None) is not None:
+				progress_local.progress = current_progress + local_progress_string
+				try:
+					return f(*args, **kwargs)
+				finally:
+					progress_local.progress = current_progress
+
 			append_progress(local_progress_string)
 			ret = f(*args, **kwargs)
 			save_progress(current_progress)
@@ -516,64 +3330,470 @@ def has_progress(progress_string):
 		return wrapper
 	return decorator
 
-def execute_step_non_recursive(node):
+def execute_step_non_recursive(node, inputs=None):
 	step_name=get_id(node)
 	commands = node["data"]["bash_commands"]
 	step_start = datetime.datetime.now()
-	execute_commands('step', node, commands)
+	result = execute_commands('step', node, commands, inputs)
 	step_finish = datetime.datetime.now()
 	step_log = 'Step {} finished. Time taken: {}'.format(step_name, time_difference(step_start, step_finish))
 	logging.info(step_log)
 	report_add(step_log)
+	return result
 
 
-@has_progress('STEP : ')
-def execute_step(pipeline, **kwargs):
+def get_step_dependencies(pipeline, node):
 	'''
 	Edges that set a parameter are like:      'source': 'STEP', 'target': 'PARAMETER', 'kind': 'Sets_Outputs'
 	Edges that requires a parameter are like: 'source': 'STEP', 'target': 'PARAMETER', 'kind': 'Needs_Parameter'   
+
+	Returns a list of (dependent step id, [parameter ids]) of the steps that need to be executed BEFORE this STEP
 	'''
-	node = kwargs['node']
 	id_ = get_id(node)
 
-	# Dictionary of steps that need to be executed BEFORE this STEP
+	pipeline = pipeline_graph(pipeline)
+	if pipeline.step_dependencies is not None and id_ in pipeline.step_dependencies:
+		return pipeline.step_dependencies[id_]
+
+	dependent_step_ids = []
 	dependent_steps = {}
 
 	#Perhaps this step has input parameters that are satisfied by other steps
-	for outgoing_edge in get_outgoing_edges(pipeline, node):
-		# These are all edges leaving this step
-		if get_kind(outgoing_edge) == 'Needs_Parameter':
-			# This edge connects this step with a needed parameter
-			parameter_node_id = get_target(outgoing_edge)
-			parameter_node = get_node(pipeline, parameter_node_id)
-			# Parameter node is the needed parameter
-			# Check if this parameter is set by any other tool
-			for ingoing_edge in get_ingoing_edges(pipeline, parameter_node):
-				# Take all edges that POINT to this parameter
-				if get_kind(ingoing_edge) == 'Sets_Outputs':
-					# This is an edge that SETS this parameter
-					dependent_step_id = get_source(ingoing_edge)
-					if dependent_step_id != id_:
-						# This is a STEP that SETS this parameter and is not this step..
-						dependent_step = get_node(pipeline, dependent_step_id)
-						#execute_step(pipeline, node=dependent_step)
-
-						# Store the dependent step. Execute it later
-						if not dependent_step_id in dependent_steps:
-							dependent_steps[dependent_step_id] = {'node': dependent_step, 'parameters': [] }
-
-						if not parameter_node_id in dependent_steps[dependent_step_id]['parameters']:
-							dependent_steps[dependent_step_id]['parameters'].append(parameter_node_id)
-
-
-	# Execute all dependent steps
-	for dependent_step_id in dependent_steps:
-		logging.info('Step: {} needs parameters: {} which are set by the step: {}'.format(id_, dependent_steps[dependent_step_id]['parameters'], dependent_step_id))
-		execute_step(pipeline, node=dependent_steps[dependent_step_id]['node'])
-
-	# Execute this step
+	for outgoing_edge in get_outgoing_edges(pipeline, node, 'Needs_Parameter'):
+		# This edge connects this step with a needed parameter
+		parameter_node_id = get_target(outgoing_edge)
+		parameter_node = get_node(pipeline, parameter_node_id)
+		# Parameter node is the needed parameter
+		# Check if this parameter is set by any other tool
+		for ingoing_edge in get_ingoing_edges(pipeline, parameter_node, 'Sets_Outputs'):
+			# This is an edge that SETS this parameter
+			dependent_step_id = get_source(ingoing_edge)
+			if dependent_step_id != id_:
+				# This is a STEP that SETS this parameter and is not this step..
+				if not dependent_step_id in dependent_steps:
+					dependent_step_ids.append(dependent_step_id)
+					dependent_steps[dependent_step_id] = []
+
+				if not parameter_node_id in dependent_steps[dependent_step_id]:
+					dependent_steps[dependent_step_id].append(parameter_node_id)
+
+	return [(dependent_step_id, dependent_steps[dependent_step_id]) for dependent_step_id in dependent_step_ids]
+
+class ExecutionPlan(object):
+	'''
+	Steps in topological order. Every step appears once.
+	'''
+
+	def __init__(self):
+		self.steps = []
+		# step id --> [ids of the steps that have to finish before this step]
+		self.dependencies = {}
+		# ids of the steps that the plan was compiled for. All other steps run because these need them
+		self.targets = []
+
+	def __len__(self):
+		return len(self.steps)
+
+	def __iter__(self):
+		return iter(self.steps)
+
+	def ids(self):
+		return [get_id(step) for step in self.steps]
+
+	def without(self, step_ids):
+		'''
+		A new plan without these steps. Steps that depend on them do not wait for them
+		'''
+		plan = ExecutionPlan()
+		for step in self.steps:
+			id_ = get_id(step)
+			if id_ in step_ids:
+				continue
+			plan.steps.append(step)
+			plan.dependencies[id_] = [dependent_step_id for dependent_step_id in self.dependencies[id_] if not dependent_step_id in step_ids]
+		plan.targets = [target for target in self.targets if target in plan.dependencies]
+
+		return plan
+
+	def upstream(self, step_id):
+		'''
+		The step and all the steps that it waits for, directly or not
+		'''
+		ret = set([step_id])
+		stack = [step_id]
+		while stack:
+			for dependent_step_id in self.dependencies[stack.pop()]:
+				if not dependent_step_id in ret:
+					ret.add(dependent_step_id)
+					stack.append(dependent_step_id)
+		return ret
+
+	def contributing(self, failed_step_ids):
+		'''
+		The steps that can still contribute to a target, now that these steps have failed
+		'''
+		ret = set()
+		for target in self.targets:
+			upstream = self.upstream(target)
+			if not upstream & failed_step_ids:
+				ret |= upstream
+		return ret
+
+def compile_plan(pipeline, step_nodes):
+	'''
+	Compile the plan that executes step_nodes together with all the steps they depend on.
+	Depth first search without recursion (pipelines can be deep). Raises CORECException on cycles.
+	'''
+	VISITING, VISITED = 1, 2
+
+	pipeline = pipeline_graph(pipeline)
+	plan = ExecutionPlan()
+	state = {}
+
+	for root in step_nodes:
+		root_id = get_id(root)
+		if not root_id in plan.targets:
+			plan.targets.append(root_id)
+		if state.get(root_id) == VISITED:
+			continue
+
+		state[root_id] = VISITING
+		stack = [(root, iter(get_step_dependencies(pipeline, root)))]
+
+		while stack:
+			node, dependencies = stack[-1]
+			id_ = get_id(node)
+
+			for dependent_step_id, parameters in dependencies:
+				plan.dependencies.setdefault(id_, [])
+				if not dependent_step_id in plan.dependencies[id_]:
+					plan.dependencies[id_].append(dependent_step_id)
+
+				dependent_state = state.get(dependent_step_id)
+				if dependent_state == VISITED:
+					continue
+				if dependent_state == VISITING:
+					cycle = [get_id(stack_node) for stack_node, _ in stack]
+					cycle = cycle[cycle.index(dependent_step_id):] + [dependent_step_id]
+					raise CORECException('Found cycle in pipeline: {}'.format(' --> '.join(cycle)))
+
+				logging.info('Step: {} needs parameters: {} which are set by the step: {}'.format(id_, parameters, dependent_step_id))
+				dependent_step = get_node(pipeline, dependent_step_id)
+				state[dependent_step_id] = VISITING
+				stack.append((dependent_step, iter(get_step_dependencies(pipeline, dependent_step))))
+				break
+			else:
+				# All dependencies of this step are in the plan
+				stack.pop()
+				state[id_] = VISITED
+				plan.dependencies.setdefault(id_, [])
+				plan.steps.append(node)
+
+	return plan
+
+def compile_minimal_plan(pipeline, step_nodes):
+	'''
+	Like compile_plan, but without the upstream steps whose needed outputs are already set.
+	Assumes that defaults['parameters'] is loaded
+	'''
+	plan = compile_plan(pipeline, step_nodes)
+
+	needed = set(plan.targets)
+	stack = list(plan.targets)
+	while stack:
+		node = get_node(pipeline, stack.pop())
+		for dependent_step_id, parameters in get_step_dependencies(pipeline, node):
+			if dependent_step_id in needed:
+				continue
+			if any(not parameter_id in defaults['parameters'] for parameter_id in parameters):
+				needed.add(dependent_step_id)
+				stack.append(dependent_step_id)
+
+	skipped = set(plan.ids()) - needed
+	if skipped:
+		logging.info('Skipping {} upstream steps whose outputs are already set'.format(len(skipped)))
+	return plan.without(skipped)
+
+def get_plan_inputs(pipeline, plan):
+	'''
+	The parameters that no step sets and that the steps of the plan need
+	'''
+	notset_parameter_ids = set(get_id(node) for node in get_notset_parameters(pipeline))
+	ret = []
+	for node in plan:
+		for parameter_id in get_step_inputs(pipeline, node):
+			if parameter_id in notset_parameter_ids:
+				notset_parameter_ids.discard(parameter_id)
+				ret.append(get_node(pipeline, parameter_id))
+	return ret
+
+def log_plan(plan):
+	logging.info('Execution plan size: {} steps'.format(len(plan)))
+	if defaults['mock']:
+		durations = expected_durations(plan)
+		for step_index, step_id in enumerate(plan.ids()):
+			expected = format_seconds(durations[step_id]) if durations[step_id] is not None else 'unknown'
+			logging.info('Execution plan {}/{}: {} (after: {}) expected: {}'.format(step_index+1, len(plan), step_id, ', '.join(plan.dependencies[step_id]) or '-', expected))
+		log_plan_estimate(plan, durations)
+
+@has_progress('STEP : ')
+def execute_plan_step(pipeline, **kwargs):
+	node = kwargs['node']
+	id_ = get_id(node)
+
+	journal_write('start', 'step', id_)
+	start = time.time()
+
+	cache_key = None
+	if step_is_cacheable(pipeline, node):
+		load_parameters()
+		cache_key = step_cache_key(pipeline, node)
+		if restore_step_cache(pipeline, node, cache_key):
+			step_log = 'Step {} restored from cache'.format(id_)
+			logging.info(step_log)
+			report_add(step_log)
+			journal_write('finish', 'step', id_, cached=True)
+			metrics_record('step', id_, start, time.time(), cached=True)
+			plan_step_finished(id_)
+			return
+
 	logging.info('Executing step: {}'.format(id_))
-	execute_step_non_recursive(node)
+	result = None
+	error = None
+	try:
+		result = execute_step_non_recursive(node, get_step_inputs(pipeline, node))
+	except CommandsFailed as e:
+		result = e.result
+		raise
+	except BaseException as e:
+		error = e
+		raise
+	finally:
+		# Failed steps are recorded too
+		end = time.time()
+		if error is None:
+			return_code = get_return_code(result)
+			if cache_key and not return_code:
+				store_step_cache(pipeline, node, cache_key)
+
+			journal_write('finish', 'step', id_, return_code=return_code)
+			metrics_record('step', id_, start, end, result, return_code=return_code)
+			if result is not None:
+				history_record(node, start, end, return_code)
+			plan_step_finished(id_)
+		else:
+			# Cancelled, timed out before it started, .. No journal entry: a resumed run executes it again
+			metrics_record('step', id_, start, end, error=repr(error))
+
+def get_step_resources(node):
+	'''
+	Resources declared in the data of a step: "cores" (default 1) and "memory_mb" (default 0)
+	'''
+	return int(node["data"].get('cores', 1)), int(node["data"].get('memory_mb', 0))
+
+class ResourceBudget(object):
+	'''
+	Cores and memory of the machine that are available to steps.
+	A step is admitted only if its declared resources fit in what is left.
+	A step that needs more than the whole budget runs alone.
+	'''
+
+	def __init__(self, max_cores, max_memory_mb):
+		self.max_cores = max_cores
+		self.max_memory_mb = max_memory_mb
+		self.cores = 0
+		self.memory_mb = 0
+		self.peak_cores = 0
+		self.peak_memory_mb = 0
+		self.running = 0
+
+	def fits(self, node):
+		if not self.running:
+			return True
+
+		cores, memory_mb = get_step_resources(node)
+		if self.max_cores is not None and self.cores + cores > self.max_cores:
+			return False
+		if self.max_memory_mb is not None and self.memory_mb + memory_mb > self.max_memory_mb:
+			return False
+		return True
+
+	def acquire(self, node):
+		cores, memory_mb = get_step_resources(node)
+		if (self.max_cores is not None and cores > self.max_cores) or (self.max_memory_mb is not None and memory_mb > self.max_memory_mb):
+			logging.warning('Step {} needs {} cores and {} MB which is more than the budget. Running it alone'.format(get_id(node), cores, memory_mb))
+
+		self.running += 1
+		self.cores += cores
+		self.memory_mb += memory_mb
+		self.peak_cores = max(self.peak_cores, self.cores)
+		self.peak_memory_mb = max(self.peak_memory_mb, self.memory_mb)
+
+	def release(self, node):
+		cores, memory_mb = get_step_resources(node)
+		self.running -= 1
+		self.cores -= cores
+		self.memory_mb -= memory_mb
+
+def cancel_step(step_id):
+	'''
+	Kill a running step, locally or on its corec_worker
+	'''
+	cancel_process(step_id)
+	if defaults['coordinator'] is not None:
+		defaults['coordinator'].cancel(step_id)
+
+def execute_plan_parallel(pipeline, plan):
+	'''
+	Run the steps of the plan in up to defaults['jobs'] threads.
+	A step starts as soon as all the steps that set its needed parameters have finished.
+	'''
+	jobs = defaults['jobs']
+	plan_index = dict((step_id, index) for index, step_id in enumerate(plan.ids()))
+	nodes = dict((get_id(node), node) for node in plan)
+
+	import heapq
+
+	waiting_for = {} # step id --> set of steps that have not finished yet
+	dependents = {} # step id --> steps that wait for it
+	# (cores, memory_mb) --> heap of (plan index, step id) of the steps that can start.
+	# Keeps the order of the serial execution when there is a choice
+	ready = {}
+	def make_ready(step_id):
+		heapq.heappush(ready.setdefault(get_step_resources(nodes[step_id]), []), (plan_index[step_id], step_id))
+
+	for step_id in plan.ids():
+		waiting_for[step_id] = set(plan.dependencies[step_id])
+		for dependent_step_id in plan.dependencies[step_id]:
+			dependents.setdefault(dependent_step_id, []).append(step_id)
+		if not waiting_for[step_id]:
+			make_ready(step_id)
+
+	try:
+		import queue
+	except ImportError:
+		import Queue as queue # Python 2
+
+	results = queue.Queue()
+
+	def run_step(node):
+		progress_local.progress = ''
+		try:
+			execute_plan_step(pipeline, node=node)
+			results.put((get_id(node), None))
+		except BaseException:
+			results.put((get_id(node), sys.exc_info()[1]))
+
+	budget = ResourceBudget(defaults['max_cores'], defaults['max_memory_mb'])
+
+	def admit():
+		'''
+		Remove and return the first ready step that fits in the budget. None if none fits.
+		Only the first step of every group of steps with the same resources is checked
+		'''
+		first = None
+		for resources, steps in corec_iteritems(ready):
+			if (first is None or steps[0] < ready[first][0]) and budget.fits(nodes[steps[0][1]]):
+				first = resources
+		if first is None:
+			return None
+
+		_, step_id = heapq.heappop(ready[first])
+		if not ready[first]:
+			del ready[first]
+		return step_id
+
+	logging.info('Executing {} steps with {} parallel jobs'.format(len(plan), jobs))
+	plan_start = time.time()
+	running = set()
+	failed = set()
+	failure = None
+	while ready or running:
+		while ready and len(running) < jobs and failure is None:
+			step_id = admit()
+			if step_id is None:
+				break # Wait until running steps free some resources
+			budget.acquire(nodes[step_id])
+			thread = threading.Thread(target=run_step, args=(nodes[step_id],))
+			thread.daemon = True
+			thread.start()
+			running.add(step_id)
+
+		if not running:
+			break
+
+		step_id, error = results.get()
+		running.discard(step_id)
+		budget.release(nodes[step_id])
+
+		if isinstance(error, StepCancelled):
+			logging.info('Step {} was cancelled'.format(step_id))
+			continue
+
+		if error is not None:
+			failed.add(step_id)
+			if failure is None:
+				failure = error
+			if defaults['fail_fast']:
+				cancel = running - plan.contributing(failed)
+				if cancel:
+					logging.warning('Step {} failed. Cancelling steps that can no longer contribute: {}'.format(step_id, ', '.join(sorted(cancel))))
+				for cancel_step_id in cancel:
+					cancel_step(cancel_step_id)
+			logging.warning('Step {} failed. Waiting for {} running steps to finish'.format(step_id, len(running)))
+			continue
+
+		for dependent_step_id in dependents.get(step_id, []):
+			waiting_for[dependent_step_id].discard(step_id)
+			if not waiting_for[dependent_step_id]:
+				make_ready(dependent_step_id)
+
+	reset_cancelled_processes(plan.ids())
+
+	resources_log = 'Peak declared resources of parallel steps: {} cores, {} MB memory'.format(budget.peak_cores, budget.peak_memory_mb)
+	logging.info(resources_log)
+	report_add(resources_log)
+
+	if not defaults['mock']:
+		with run_metrics_lock:
+			records = [record for record in run_metrics['records'] if record['id'] in plan_index and record['start'] >= plan_start]
+		peak_cores, peak_memory_mb = measured_peak(records)
+		usage_log = 'Peak measured usage of parallel steps: {:.1f} cores, {:.0f} MB memory (sum of the max RSS of overlapping steps)'.format(peak_cores, peak_memory_mb)
+		logging.info(usage_log)
+		report_add(usage_log)
+
+	if failure is not None:
+		raise failure
+
+def execute_plan(pipeline, plan):
+	metrics_add_plan(plan)
+
+	if defaults['completed_steps']:
+		completed_steps = set(plan.ids()) & defaults['completed_steps']
+		if completed_steps:
+			logging.info('Skipping {} steps that have been completed in the resumed run: {}'.format(len(completed_steps), ', '.join(sorted(completed_steps))))
+			plan = plan.without(completed_steps)
+
+	if not defaults['mock'] and len(plan):
+		defaults['plan_eta'] = PlanETA(plan, expected_durations(plan), defaults['jobs'])
+
+	try:
+		if defaults['jobs'] > 1 and len(plan) > 1:
+			execute_plan_parallel(pipeline, plan)
+		else:
+			for node in plan:
+				execute_plan_step(pipeline, node=node)
+	finally:
+		defaults['plan_eta'] = None
+
+	if defaults['cache']:
+		evict_step_cache()
+
+def execute_step(pipeline, **kwargs):
+	'''
+	Execute a step after all the steps that it depends on
+	'''
+	execute_plan(pipeline, compile_plan(pipeline, [kwargs['node']]))
 
 @has_progress('STEP : ')
 def execute_step_explicitly(step_name, **kwargs):
@@ -587,82 +3807,208 @@ def execute_step_explicitly(step_name, **kwargs):
 
 	# Are all input variables available?
 	#Perhaps this step has input parameters that are not available
-	for outgoing_edge in get_outgoing_edges(pipeline, node):
-		# These are all edges leaving this step
-		if get_kind(outgoing_edge) == 'Needs_Parameter':
-			# This edge connects this step with a needed parameter
-			parameter_node_id = get_target(outgoing_edge)
-			parameter_node = get_node(pipeline, parameter_node_id)
+	for outgoing_edge in get_outgoing_edges(pipeline, node, 'Needs_Parameter'):
+		# This edge connects this step with a needed parameter
+		parameter_node_id = get_target(outgoing_edge)
+
+		if not parameter_node_id in defaults['parameters']:
+			# This parameter has not been set
+			message = 'Step: {} requires the yet unset parameter: {}'.format(step_name, parameter_node_id)
+			logging.info(message)
+			message = ' #### ATENTION #### Insert the value of parameter: {} : '.format(parameter_node_id) # Since the stdout is captured we show this in log
+			logging.info(message)
+			p_value = corec_raw_input()()
+			defaults['parameters'][parameter_node_id] = p_value
+
+
+	execute_step_non_recursive(node, get_step_inputs(pipeline, node))
+
+def tool_fingerprint(node):
+	'''
+	The installation commands of a tool and the platform that they run on.
+	A tool is installed again only when its fingerprint changes.
+	'''
+	import hashlib
+	import platform
+
+	fingerprint = {
+		'installation': node["data"]["installation"],
+		'platform': list(platform.uname()),
+	}
+	return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()
+
+def tool_marker_filename(id_):
+	'''
+	The file that records the fingerprint of an installed tool. Its .lock is the lock of the installation.
+	'''
+	return os.path.join(defaults['tools_dir'], '{}.json'.format(id_.replace('|', '_').replace(os.sep, '_')))
 
-			if not parameter_node_id in defaults['parameters']:
-				# This parameter has not been set
-				message = 'Step: {} requires the yet unset parameter: {}'.format(step_name, parameter_node_id)
-				logging.info(message)
-				message = ' #### ATENTION #### Insert the value of parameter: {} : '.format(parameter_node_id) # Since the stdout is captured we show this in log
-				logging.info(message)
-				p_value = corec_raw_input()()
-				defaults['parameters'][parameter_node_id] = p_value
+def tool_installed(id_, fingerprint):
+	marker_filename = tool_marker_filename(id_)
+	if not os.path.isfile(marker_filename):
+		return False
 
+	try:
+		with open(marker_filename) as f:
+			marker = json.load(f)
+	except ValueError:
+		return False
 
-	execute_step_non_recursive(node)
+	return marker.get('fingerprint') == fingerprint
 
 @has_progress('INSTALL : ')
 def install_tool(pipeline, **kwargs):
 	node = kwargs['node']
 	id_ = get_id(node)
 
-	logging.info('Installing tool: {}'.format(id_))
+	fingerprint = tool_fingerprint(node)
+	if defaults['tool_fingerprints'] and tool_installed(id_, fingerprint):
+		logging.info('Tool {} is already installed'.format(id_))
+		return
+
+	mkdir_p(defaults['tools_dir'])
+	marker_filename = tool_marker_filename(id_)
+
+	# Pipelines that require the same tool wait here until the first one installs it
+	with file_lock(marker_filename):
+		if defaults['tool_fingerprints'] and tool_installed(id_, fingerprint):
+			logging.info('Tool {} was installed while waiting for its lock'.format(id_))
+			return
+
+		logging.info('Installing tool: {}'.format(id_))
+
+		installation = node["data"]["installation"]
+		journal_write('start', 'tool', id_)
+		start = time.time()
+		tool_start = datetime.datetime.now()
+		try:
+			result = execute_commands('tool', node, installation)
+		except CommandsFailed as e:
+			journal_write('finish', 'tool', id_, return_code=e.result['return_code'])
+			metrics_record('tool', id_, start, time.time(), e.result, return_code=e.result['return_code'])
+			raise
+		return_code = get_return_code(result)
+		tool_finish = datetime.datetime.now()
+		journal_write('finish', 'tool', id_, return_code=return_code)
+		metrics_record('tool', id_, start, time.time(), result, return_code=return_code)
+
+		if not return_code and not defaults['mock']:
+			write_file_atomic(marker_filename, json.dumps({
+				'id': id_,
+				'fingerprint': fingerprint,
+				'installed': time.time(),
+				'duration': time.time() - start,
+			}, indent=4))
 
-	installation = node["data"]["installation"]
-	tool_start = datetime.datetime.now()
-	execute_commands('tool', node, installation)
-	tool_finish = datetime.datetime.now()
 	tool_log = 'Tool {} installed. Time taken: {}'.format(id_, time_difference(tool_start, tool_finish))
 	logging.info(tool_log)
 	report_add(tool_log)
 
+def install_tools(pipeline, tool_nodes):
+	'''
+	Install many tools at once. Every tool has its own lock, so independent tools install in parallel.
+	'''
+	if len(tool_nodes) == 1:
+		return install_tool(pipeline, node=tool_nodes[0])
 
-def satisfy_output(pipeline, output_node):
+	errors = []
+	def install(node):
+		try:
+			install_tool(pipeline, node=node)
+		except BaseException as e: # CommandsFailed (a SystemExit) of failed installations
+			errors.append((get_id(node), e))
+
+	threads = [threading.Thread(target=install, args=(node,), name='tool-{}'.format(get_id(node))) for node in tool_nodes]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	if errors:
+		for id_, e in errors:
+			logging.error('Installation of tool {} failed: {}'.format(id_, repr(e)))
+		raise errors[0][1]
+
+
+def get_output_steps(pipeline, output_node):
 	# Get all steps that have this output_node
+	ret = []
+	for edge in get_ingoing_edges(pipeline, output_node, 'Sets_Outputs'):
+		step_node = get_node(pipeline, get_source(edge))
+		if get_kind(step_node) == 'Step':
+			# this edge is a Step and has an unsatisfied output
+			#We have to execute this step
+			ret.append(step_node)
 
-	for edge in pipeline["elements"]["edges"]:
-		if get_kind(edge) != 'Sets_Outputs':
-			continue
+	return ret
 
-		edge_target = get_target(edge)
-		if edge_target == get_id(output_node):
-			step_node = get_node(pipeline, get_source(edge))
-			if get_kind(step_node) == 'Step':
-				# this edge is a Step and has an unsatisfied output
-				#We have to execute this step
-				execute_step(pipeline, node=step_node)
+def satisfy_output(pipeline, output_node):
+	execute_plan(pipeline, compile_plan(pipeline, get_output_steps(pipeline, output_node)))
 
 
-def satisfy_outputs(pipeline, output_nodes):
+def satisfy_outputs(pipeline, output_nodes, minimal=False):
+	'''
+	minimal: run only the steps that are needed for output_nodes and ask only their input parameters (corec_init --target)
+	'''
 
 	total = len(output_nodes)
 	logging.info('Total unsatisfied output nodes: {}'.format(total))
+	load_parameters()
+	unsatisfied_output_ids = []
+	step_nodes = []
 	for output_node_index, output_node in enumerate(output_nodes):
-		load_parameters()
 		if not get_id(output_node) in defaults['parameters']:
-			
-			while True: # Repeatidly try to satisfy this step until there is no lock
-				logging.info('Satisfying output node {}/{}: {}'.format(output_node_index+1, total, get_id(output_node)))
-				satisfy_output_start = datetime.datetime.now()
-				satisfy_output(pipeline, output_node)
-				satisfy_output_finish = datetime.datetime.now()
-				satisfy_report_time = time_difference(satisfy_output_start, satisfy_output_finish)
-				satisfy_log = 'Output: {} satisfied. Time taken: {}'.format(get_id(output_node), satisfy_report_time)
-				logging.info(satisfy_log)
-				report_add(satisfy_log)
-				locks = get_all_locks()
-				if locks:
-					logging.info('Found these locks: {}. Trying to satisfy the output again'.format(str(locks)))
-				else:
-					break
+			logging.info('Satisfying output node {}/{}: {}'.format(output_node_index+1, total, get_id(output_node)))
+			unsatisfied_output_ids.append(get_id(output_node))
+			step_nodes.extend(get_output_steps(pipeline, output_node))
 		else:
 			logging.info('Output node {}/{}: {} has already been satisfied'.format(output_node_index+1, total, get_id(output_node)))
 
+	if not unsatisfied_output_ids:
+		return
+
+	if minimal:
+		plan = compile_minimal_plan(pipeline, step_nodes)
+		input_parameters(get_plan_inputs(pipeline, plan))
+	else:
+		plan = compile_plan(pipeline, step_nodes)
+	log_plan(plan)
+
+	while True:
+		satisfy_output_start = datetime.datetime.now()
+		execute_plan(pipeline, plan)
+		satisfy_output_finish = datetime.datetime.now()
+		satisfy_report_time = time_difference(satisfy_output_start, satisfy_output_finish)
+		satisfy_log = 'Outputs: {} satisfied. Time taken: {}'.format(', '.join(unsatisfied_output_ids), satisfy_report_time)
+		logging.info(satisfy_log)
+		report_add(satisfy_log)
+
+		locks = get_all_locks()
+		if not locks:
+			break
+
+		# Sleep until the locks are released. Do not repeat the work that is done
+		logging.info('Found these locks: {}. Waiting for their release'.format(str(locks)))
+		timeout = defaults['lock_timeout']
+		if timeout is not None:
+			timeout = float(timeout)
+		if defaults['deadline'] is not None:
+			remaining = max(defaults['deadline'] - time.time(), 0)
+			if timeout is None or remaining < timeout:
+				timeout = remaining
+
+		locks = wait_for_locks(timeout=timeout)
+		if locks:
+			if defaults['deadline'] is not None and time.time() >= defaults['deadline']:
+				raise CORECException('The run has exceeded its timeout of {}. Still held locks: {}'.format(format_seconds(defaults['timeout']), str(locks)))
+			raise CORECException('Timeout while waiting for the release of locks: {}'.format(str(locks)))
+
+		load_parameters()
+		plan = plan.without(set(get_id(step) for step in plan if not has_unset_outputs(pipeline, step)))
+		if not len(plan):
+			break
+		logging.info('Locks were released. Executing again the steps that have unset outputs: {}'.format(', '.join(plan.ids())))
+
 
 def show_results(output_nodes):
 
@@ -680,26 +4026,30 @@ def show_results(output_nodes):
 			local_log('     {} = {}'.format(output_node_id, '<MOCKING MODE>'))
 		else:
 			if output_node_id in defaults['parameters']:
-				local_log('     {} = {}'.format(output_node_id, defaults['parameters'][output_node_id]))
+				local_log('     {} = {}'.format(output_node_id, blob_load(defaults['parameters'][output_node_id])))
 			else:
 				local_log('     {} = {}'.format(output_node_id, '<NOT SET>'))
 	logging.info('FINISH')
 
+def get_root_pipeline(pipeline):
+	'''
+	The Pipeline node without a parent. None if there is none
+	'''
+	for node in pipeline_graph(pipeline).get_nodes('Pipeline'):
+		if not 'parent' in node["data"]:
+			return node
+	return None
+
 def execute_cy_pipeline(pipeline):
 	
-	elements = pipeline['elements']
-	nodes = elements['nodes']
+	pipeline = pipeline_graph(pipeline)
 
 	# Log the name of the root pipeline
-	for node in nodes:
-		if "kind" in node["data"]:
-			if node["data"]["kind"] == 'Pipeline':
-				if not 'parent' in node["data"]:
-					# This is a pipeline without any parent. It should be the root. Report it
-					log_message = 'Executing root pipeline node: {}'.format(node["data"]["label"])
-					logging.info(log_message)
-					report_add(log_message)
-					break
+	root = get_root_pipeline(pipeline)
+	if root:
+		log_message = 'Executing root pipeline node: {}'.format(root["data"]["label"])
+		logging.info(log_message)
+		report_add(log_message)
 
 	notset_parameters = get_notset_parameters(pipeline)
 	input_parameters(notset_parameters)
@@ -709,6 +4059,83 @@ def execute_cy_pipeline(pipeline):
 	show_results(output_nodes)
 
 
+def get_pipeline_nodes(pipeline, pipeline_id):
+	'''
+	The nodes inside a Pipeline node. Directly, or inside its sub-pipelines (the "parent" of Cytoscape compound nodes)
+	'''
+	children = {}
+	for node in pipeline_graph(pipeline).nodes:
+		if 'parent' in node["data"]:
+			children.setdefault(node["data"]['parent'], []).append(node)
+
+	ret = []
+	stack = [pipeline_id]
+	while stack:
+		for node in children.get(stack.pop(), []):
+			ret.append(node)
+			stack.append(get_id(node))
+	return ret
+
+def get_pipeline_node(pipeline, name):
+	'''
+	A Pipeline node by id or by label
+	'''
+	node = get_node(pipeline, name)
+	if node and get_kind(node) == 'Pipeline':
+		return node
+
+	for node in pipeline_graph(pipeline).get_nodes('Pipeline'):
+		if node["data"].get('label') == name:
+			return node
+
+	raise CORECException('Pipeline does not contain pipeline node: {}'.format(name))
+
+def get_target_outputs(pipeline, targets, sub_pipelines):
+	'''
+	targets: ids of parameters. sub_pipelines: Pipeline nodes. All the parameters that their steps set are targets
+	'''
+	ret = []
+	for target in targets:
+		node = get_node(pipeline, target)
+		if not node or get_kind(node) == 'Step' or get_kind(node) == 'Pipeline':
+			raise CORECException('Pipeline does not contain parameter or output: {}'.format(target))
+		ret.append(node)
+
+	for sub_pipeline in sub_pipelines:
+		pipeline_node = get_pipeline_node(pipeline, sub_pipeline)
+		steps = [node for node in get_pipeline_nodes(pipeline, get_id(pipeline_node)) if get_kind(node) == 'Step']
+		logging.info('Pipeline node {} contains {} steps'.format(get_id(pipeline_node), len(steps)))
+		for step in steps:
+			ret.extend(get_node(pipeline, parameter_id) for parameter_id in get_step_outputs(pipeline, step))
+
+	load_parameters()
+	output_nodes = []
+	output_ids = set()
+	for node in ret:
+		if get_id(node) in output_ids:
+			continue
+		if not get_output_steps(pipeline, node) and not get_id(node) in defaults['parameters']:
+			raise CORECException('No step sets the target: {}'.format(get_id(node)))
+		output_ids.add(get_id(node))
+		output_nodes.append(node)
+
+	return output_nodes
+
+def execute_targets(pipeline, targets, sub_pipelines):
+	'''
+	corec_init --target / --pipeline. Run only the steps that these outputs need
+	'''
+	pipeline = pipeline_graph(pipeline)
+
+	output_nodes = get_target_outputs(pipeline, targets, sub_pipelines)
+	log_message = 'Executing targets: {}'.format(', '.join(get_id(node) for node in output_nodes))
+	logging.info(log_message)
+	report_add(log_message)
+
+	satisfy_outputs(pipeline, output_nodes, minimal=True)
+
+	show_results(output_nodes)
+
 def execute_pipeline(pipeline):
 
 	execute_cy_pipeline(pipeline)
@@ -716,16 +4143,23 @@ def execute_pipeline(pipeline):
 # ========================== COREC COMMANDS ==================
 
 @command_line 
-def corec_requires(step, **kwargs):
-	logging.info('Satisfying requirement: {}'.format(step))
+def corec_requires(*steps, **kwargs):
+	logging.info('Satisfying requirements: {}'.format(', '.join(steps)))
 	
 	pipeline = kwargs['pipeline']
-	tool_node = get_node(pipeline, step)
+	tool_nodes = []
+	for step in steps:
+		tool_node = get_node(pipeline, step)
+		if not tool_node:
+			raise CORECException('Could not find tool: {}'.format(step))
+		tool_nodes.append(tool_node)
 
-	install_tool(pipeline, node=tool_node)
+	install_tools(pipeline, tool_nodes)
 
 @command_line
 def corec_init(**kwargs):
+	handle_exit_signals()
+
 	#Delete progress file
 	if 'mock' in kwargs:
 		defaults['mock'] = kwargs['mock']
@@ -737,30 +4171,146 @@ def corec_init(**kwargs):
 			logging.info('Ignoring non-positive return codes')
 			defaults['exit_on_non_zero_return_code'] = False
 
-	reset_locks()
-	delete_progress()
-	report_init()
-	uname = ' '.join(platform.uname())
-	uname_log = 'Platform details: {}'.format(uname)
-	logging.info(uname_log)
-	report_add(uname_log)
-	init_start = datetime.datetime.now()
-
-	if 'step' in kwargs and kwargs['step']:
-		step_name = kwargs['step']
-		step_node = get_node(kwargs['pipeline'], step_name)
-		if not step_node:
-			raise CORECException("Pipeline does not contain step with name: {}".format(step_name))
-
-		kwargs['node'] = step_node
-		execute_step_explicitly(step_name, **kwargs)
-	else:	
-		execute_pipeline(kwargs['pipeline'])
-	init_finish = datetime.datetime.now()
-	init_log = 'Overall time taken: {}'.format(time_difference(init_start, init_finish))
-	logging.info(init_log)
-	report_add(init_log)
-	report_finalize()
+	if 'max_cores' in kwargs and kwargs['max_cores']:
+		defaults['max_cores'] = kwargs['max_cores']
+		logging.info('Steps can use up to {} cores'.format(defaults['max_cores']))
+
+	if 'max_memory' in kwargs and kwargs['max_memory']:
+		defaults['max_memory_mb'] = kwargs['max_memory']
+		logging.info('Steps can use up to {} MB of memory'.format(defaults['max_memory_mb']))
+		if not defaults['max_cores']:
+			# Steps that declare no memory should not all start at once
+			import multiprocessing
+			defaults['max_cores'] = multiprocessing.cpu_count()
+			logging.info('Steps can use up to {} cores (all cores of this machine)'.format(defaults['max_cores']))
+
+	if 'jobs' in kwargs and kwargs['jobs']:
+		if kwargs['jobs'] < 1:
+			raise CORECException('--jobs should be a positive number')
+		defaults['jobs'] = kwargs['jobs']
+	elif defaults['max_cores'] or defaults['max_memory_mb']:
+		# Only the resource budget limits the parallel steps
+		defaults['jobs'] = defaults['max_cores'] or len(pipeline_graph(kwargs['pipeline']).get_nodes('Step')) or 1
+	elif 'coordinator' in kwargs and kwargs['coordinator']:
+		# The workers limit how many steps run at the same time
+		defaults['jobs'] = len(pipeline_graph(kwargs['pipeline']).get_nodes('Step')) or 1
+
+	if defaults['jobs'] > 1:
+		logging.info('Running up to {} steps in parallel'.format(defaults['jobs']))
+
+	if 'no_cache' in kwargs and kwargs['no_cache']:
+		logging.info('Step cache is disabled')
+		defaults['cache'] = False
+
+	if 'cache_files' in kwargs and kwargs['cache_files']:
+		defaults['cache_hash_files'] = True
+
+	if 'parameter_store' in kwargs and kwargs['parameter_store']:
+		use_parameter_store(kwargs['parameter_store'])
+
+	if 'lock_timeout' in kwargs and kwargs['lock_timeout'] is not None:
+		defaults['lock_timeout'] = kwargs['lock_timeout']
+
+	if 'report_codec' in kwargs and kwargs['report_codec']:
+		defaults['report_codec'] = kwargs['report_codec']
+
+	if 'worker_timeout' in kwargs and kwargs['worker_timeout']:
+		defaults['worker_timeout'] = kwargs['worker_timeout']
+
+	if 'timeout' in kwargs and kwargs['timeout']:
+		defaults['timeout'] = kwargs['timeout']
+	else:
+		root = get_root_pipeline(kwargs['pipeline'])
+		if root and root["data"].get('timeout'):
+			defaults['timeout'] = float(root["data"]['timeout'])
+
+	if defaults['timeout']:
+		logging.info('The run times out after {}'.format(format_seconds(defaults['timeout'])))
+		defaults['deadline'] = time.time() + defaults['timeout']
+
+	if 'step_timeout' in kwargs and kwargs['step_timeout']:
+		defaults['step_timeout'] = kwargs['step_timeout']
+
+	if 'step' in kwargs and kwargs['step'] and (kwargs.get('target') or kwargs.get('sub_pipeline')):
+		raise CORECException('--step cannot be used with --target or --pipeline')
+
+	if 'fail_fast' in kwargs and kwargs['fail_fast']:
+		logging.info('Cancelling the steps that can no longer contribute to the outputs when a step fails')
+		defaults['fail_fast'] = True
+
+	if 'shell_workers' in kwargs and kwargs['shell_workers']:
+		logging.info('Steps run in shell workers')
+		defaults['shell_workers'] = True
+
+	if 'keep_scripts' in kwargs and kwargs['keep_scripts']:
+		defaults['keep_scripts'] = True
+
+	if 'daemon' in kwargs and kwargs['daemon']:
+		start_daemon()
+
+	if 'token' in kwargs and kwargs['token']:
+		defaults['coordinator_token'] = kwargs['token']
+
+	if 'coordinator' in kwargs and kwargs['coordinator']:
+		start_coordinator(kwargs['coordinator'])
+
+	try:
+		if 'resume' in kwargs and kwargs['resume']:
+			if not os.path.isfile(defaults['journal_filename']):
+				raise CORECException('Cannot resume. Journal file: {} does not exist'.format(defaults['journal_filename']))
+			if not report_dir():
+				raise CORECException('Cannot resume. The report directory of the previous run is not known')
+
+			completed = journal_replay()
+			defaults['completed_steps'] = completed['step']
+			logging.info('Resuming run. Steps already completed: {}'.format(len(defaults['completed_steps'])))
+			journal_write('resume', 'run')
+		else:
+			reset_locks()
+			delete_progress()
+			report_init()
+			journal_reset()
+			metrics_reset()
+			journal_write('start', 'run')
+
+		import platform
+		uname = ' '.join(platform.uname())
+		uname_log = 'Platform details: {}'.format(uname)
+		logging.info(uname_log)
+		report_add(uname_log)
+		init_start = datetime.datetime.now()
+
+		if 'step' in kwargs and kwargs['step']:
+			step_name = kwargs['step']
+			step_node = get_node(kwargs['pipeline'], step_name)
+			if not step_node:
+				raise CORECException("Pipeline does not contain step with name: {}".format(step_name))
+
+			kwargs['node'] = step_node
+			execute_step_explicitly(step_name, **kwargs)
+		elif kwargs.get('target') or kwargs.get('sub_pipeline'):
+			execute_targets(kwargs['pipeline'], kwargs.get('target') or [], kwargs.get('sub_pipeline') or [])
+		else:	
+			execute_pipeline(kwargs['pipeline'])
+		init_finish = datetime.datetime.now()
+		init_log = 'Overall time taken: {}'.format(time_difference(init_start, init_finish))
+		logging.info(init_log)
+		report_add(init_log)
+		journal_write('finish', 'run')
+		collect_blobs(keep=step_cache_values())
+		report_finalize()
+	finally:
+		# Also when a step fails
+		kill_running_processes()
+		finish_killing_process_groups()
+		if get_parameter_store().name != 'json':
+			# Keep corec_parameters.json for tools that read it directly
+			export_parameters()
+		metrics_write()
+		stop_coordinator()
+		stop_shell_workers()
+		clean_scratch_dir()
+		stop_daemon()
 
 @command_line
 def corec_run(step_name, **kwargs):
@@ -769,29 +4319,91 @@ def corec_run(step_name, **kwargs):
 		raise CORECException("Pipeline does not contain step with name: {}".format(step_name))
 	execute_step_explicitly(step_name, **kwargs)
 
-@command_line
-def corec_set(parameter, value, merge, **kwargs):
+@light_command_line
+def corec_set(parameter, value, merge, as_json=False, **kwargs):
+	if as_json and not merge:
+		value = json.loads(value)
 	save_parameter(parameter, value, merge)
 
-@command_line
-def corec_get(parameter, **kwargs):
-	load_parameters()
-	if parameter in defaults['parameters']:
-		print (defaults['parameters'][parameter])
+@light_command_line
+def corec_set_many(values, as_json=False, **kwargs):
+	'''
+	values is a dictionary. All parameters are set with a single update of the store
+	'''
+	if as_json:
+		values = dict((parameter, json.loads(value)) for parameter, value in corec_iteritems(values))
+	get_parameter_store().set_many(blob_store(values))
+
+@light_command_line
+def corec_get(parameter, as_json=False, **kwargs):
+	value = get_parameter(parameter, None)
+	if as_json:
+		print (json.dumps(value))
+	elif value is not None:
+		print (format_value(value))
 	else:
 		print ('COREC_UNSET')
 
-@command_line
+def format_value(value):
+	'''
+	Strings as they are, other values json encoded
+	'''
+	if type(value).__name__ in ['unicode', 'str']:
+		return value
+	return json.dumps(value)
+
+def shell_quote(value):
+	try:
+		from shlex import quote
+	except ImportError:
+		from pipes import quote # Python 2
+	return quote(value)
+
+def shell_variable(parameter):
+	'''
+	A valid name of a shell variable for this parameter
+	'''
+	import re
+	name = re.sub(r'[^A-Za-z0-9_]', '_', parameter)
+	if name[0].isdigit():
+		name = '_' + name
+	return name
+
+@light_command_line
+def corec_get_many(parameters, as_json=False, as_shell=False, **kwargs):
+	'''
+	as_json: one json object. Unset parameters are null
+	as_shell: lines of NAME='value' for eval. Unset parameters are COREC_UNSET
+	otherwise: one value per line
+	'''
+	values = get_parameters(parameters)
+
+	if as_json:
+		print (json.dumps(dict((parameter, values.get(parameter)) for parameter in parameters)))
+		return
+
+	for parameter in parameters:
+		value = format_value(values.get(parameter, 'COREC_UNSET'))
+
+		if as_shell:
+			print ('{}={}'.format(shell_variable(parameter), shell_quote(value)))
+		else:
+			print (value)
+
+@light_command_line
 def corec_lock(lock_name, **kwargs):
 	return set_lock(lock_name)
 
-@command_line
+@light_command_line
 def corec_unlock(lock_name, **kwargs):
 	return unset_lock(lock_name)
 
-@command_line
-def corec_get_lock(lock_name, **kwargs):
-	lock_value = get_lock_value(lock_name)
+@light_command_line
+def corec_get_lock(lock_name, wait=False, timeout=None, **kwargs):
+	if wait:
+		lock_value = bool(wait_for_locks([lock_name], timeout))
+	else:
+		lock_value = get_lock_value(lock_name)
 
 	if lock_value:
 		print (1)
@@ -799,10 +4411,29 @@ def corec_get_lock(lock_name, **kwargs):
 		print (0)
 
 
-@command_line
+@light_command_line
 def corec_report(content, **kwargs):
 	report_add(content)
 
+@light_command_line
+def corec_worker(coordinator, jobs=1, name=None, workdir=None, token=None, **kwargs):
+	'''
+	Run steps of the corec_init --coordinator that listens on coordinator (HOST:PORT)
+	'''
+	if workdir:
+		os.chdir(workdir)
+	set_up_environment()
+	handle_exit_signals()
+
+	if token:
+		defaults['coordinator_token'] = token
+
+	if not name:
+		import platform
+		name = platform.node()
+
+	CORECWorker(parse_address(coordinator), jobs, name, get_coordinator_token()).run()
+
 
 # ========================== COREC COMMANDS ==================
 
@@ -0,0 +1,16 @@
+import pytest
+
+import corec_testing # Puts the repository on sys.path
+
+import corec_tools
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+	'''
+	Run corec_tools in tmp_path with the default json parameter store
+	'''
+	monkeypatch.chdir(tmp_path)
+	monkeypatch.setitem(corec_tools.defaults, 'parameter_store', None)
+	monkeypatch.setitem(corec_tools.defaults, 'parameters', {})
+	monkeypatch.setattr(corec_tools, '_parameter_stores', {})
+	return tmp_path
@@ -0,0 +1,111 @@
+'''
+Helpers of the tests: small pipelines, and corec_init in a temporary directory
+'''
+
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+TOKEN = 'test-token'
+
+def node(id_, kind, **data):
+	data.update({'id': id_, 'kind': kind})
+	return {'data': data}
+
+def edge(source, target, kind):
+	return {'data': {'id': '{}->{}'.format(source, target), 'source': source, 'target': target, 'kind': kind}}
+
+def diamond_pipeline():
+	'''
+	A sets X. B and C read X and run at the same time. D reads both
+	'''
+	nodes = [
+		node('root', 'Pipeline', label='root'),
+		node('P_in', 'Parameter', parent='root'),
+		node('X', 'Parameter'), node('Y', 'Parameter'), node('Z', 'Parameter'), node('OUT', 'Output'),
+		node('A', 'Step', bash_commands='corec_set X "$(corec_get P_in)-x"\n', parent='root'),
+		node('B', 'Step', bash_commands='sleep 0.3\ncorec_set Y "$(corec_get X)-y"\n'),
+		node('C', 'Step', bash_commands='sleep 0.3\ncorec_set Z "$(corec_get X)-z"\n'),
+		node('D', 'Step', bash_commands='corec_set OUT "$(corec_get Y)+$(corec_get Z)"\n'),
+	]
+	edges = [
+		edge('A', 'P_in', 'Needs_Parameter'), edge('A', 'X', 'Sets_Outputs'),
+		edge('B', 'X', 'Needs_Parameter'), edge('B', 'Y', 'Sets_Outputs'),
+		edge('C', 'X', 'Needs_Parameter'), edge('C', 'Z', 'Sets_Outputs'),
+		edge('D', 'Y', 'Needs_Parameter'), edge('D', 'Z', 'Needs_Parameter'), edge('D', 'OUT', 'Sets_Outputs'),
+	]
+	return {'elements': {'nodes': nodes, 'edges': edges}}
+
+def single_step_pipeline(commands):
+	nodes = [node('S', 'Step', bash_commands=commands), node('O', 'Output')]
+	edges = [edge('S', 'O', 'Sets_Outputs')]
+	return {'elements': {'nodes': nodes, 'edges': edges}}
+
+def environment():
+	env = dict(os.environ)
+	env['PATH'] = REPO_DIR + os.pathsep + env.get('PATH', '')
+	env['COREC_TOKEN'] = TOKEN
+	return env
+
+def write_pipeline(directory, pipeline, parameters=None):
+	with open(os.path.join(str(directory), 'pipeline.json'), 'w') as f:
+		json.dump(pipeline, f)
+	with open(os.path.join(str(directory), 'corec_parameters.json'), 'w') as f:
+		json.dump(parameters or {}, f)
+
+def read_parameters(directory):
+	with open(os.path.join(str(directory), 'corec_parameters.json')) as f:
+		return json.load(f)
+
+def run_command(directory, name, *args, **kwargs):
+	'''
+	Run one of the corec commands in directory. Returns the finished process with its output in .output
+	'''
+	command = [sys.executable, os.path.join(REPO_DIR, name)] + list(args)
+	process = subprocess.Popen(command, cwd=str(directory), env=environment(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	process.output = process.communicate(timeout=kwargs.get('timeout', 120))[0].decode('utf-8', 'replace')
+	return process
+
+def corec_init(directory, *args, **kwargs):
+	'''
+	corec_init without the step cache, unless cache=True
+	'''
+	if not kwargs.get('cache'):
+		args = ('--no-cache',) + args
+	return run_command(directory, 'corec_init', *args, **kwargs)
+
+def free_port():
+	s = socket.socket()
+	s.bind(('127.0.0.1', 0))
+	port = s.getsockname()[1]
+	s.close()
+	return port
+
+def processes_with(marker):
+	'''
+	pids of the processes whose command line contains marker. Zombies have no command line
+	'''
+	pids = []
+	for pid in os.listdir('/proc'):
+		if not pid.isdigit():
+			continue
+		try:
+			with open(os.path.join('/proc', pid, 'cmdline'), 'rb') as f:
+				cmdline = f.read().decode('utf-8', 'replace')
+		except (IOError, OSError):
+			continue
+		if marker in cmdline:
+			pids.append(int(pid))
+	return pids
+
+def wait_until_gone(marker, seconds):
+	deadline = time.time() + seconds
+	while processes_with(marker) and time.time() < deadline:
+		time.sleep(0.1)
+	return processes_with(marker)
@@ -0,0 +1,52 @@
+'''
+Large parameter values are stored as blobs out of the parameter store
+'''
+
+import os
+
+from corec_testing import read_parameters, run_command
+
+import corec_tools
+
+def blob_files():
+	ret = []
+	for directory, _, filenames in os.walk(corec_tools.defaults['blob_dir']):
+		ret.extend(filenames)
+	return sorted(ret)
+
+def test_round_trip(workdir):
+	large = {'values': ['x' * 100] * 1000}
+	stored = corec_tools.blob_store({'small': 'value', 'large': large, 'number': 3})
+	assert stored['small'] == 'value' and stored['number'] == 3
+	assert corec_tools.is_blob_reference(stored['large'])
+	assert stored['large']['__corec_blob__'] == 1
+	assert corec_tools.blob_load(stored['large']) == large
+	assert corec_tools.blob_load('value') == 'value'
+
+	assert corec_tools.blob_store({'again': large})['again'] == stored['large'] # Same content, same blob
+	assert len(blob_files()) == 1
+
+def test_corec_get_resolves_blobs(workdir):
+	large = 'y' * (corec_tools.defaults['blob_threshold_bytes'] + 1)
+	corec_tools.save_parameter('large', large, False)
+	assert corec_tools.is_blob_reference(read_parameters(workdir)['large'])
+	assert corec_tools.get_parameter('large') == large
+
+	process = run_command(workdir, 'corec_get', 'large')
+	assert process.returncode == 0, process.output
+	assert process.output.strip() == large
+
+def test_collect_removes_unreferenced_blobs(workdir):
+	corec_tools.save_parameter('kept', 'k' * 100000, False)
+	corec_tools.save_parameter('replaced', 'r' * 100000, False)
+	cached = corec_tools.blob_store({'cached': 'c' * 100000})['cached']
+	assert len(blob_files()) == 3
+
+	corec_tools.save_parameter('replaced', 'small', False)
+	corec_tools.collect_blobs(keep=[cached])
+	assert blob_files() == sorted([corec_tools.get_parameter_store().get('kept')['corec_blob'] + '.json', cached['corec_blob'] + '.json'])
+	assert corec_tools.get_parameter('kept') == 'k' * 100000
+	assert corec_tools.blob_load(cached) == 'c' * 100000
+
+	corec_tools.collect_blobs()
+	assert len(blob_files()) == 1
@@ -0,0 +1,81 @@
+'''
+The step cache: hits, misses and eviction
+'''
+
+import os
+import json
+
+from corec_testing import node, edge, write_pipeline, read_parameters, corec_init
+
+import corec_tools
+
+def counting_pipeline():
+	'''
+	S appends a line to runs.txt every time it runs
+	'''
+	nodes = [node('P_in', 'Parameter'), node('OUT', 'Output'),
+		node('S', 'Step', bash_commands='echo run >> runs.txt\ncorec_set OUT "$(corec_get P_in)-out"\n')]
+	edges = [edge('S', 'P_in', 'Needs_Parameter'), edge('S', 'OUT', 'Sets_Outputs')]
+	return {'elements': {'nodes': nodes, 'edges': edges}}
+
+def runs(directory):
+	filename = os.path.join(str(directory), 'runs.txt')
+	if not os.path.exists(filename):
+		return 0
+	with open(filename) as f:
+		return len(f.readlines())
+
+def run_again(directory, p_in, *args, **kwargs):
+	'''
+	corec_init with the output unset
+	'''
+	write_pipeline(directory, counting_pipeline(), {'P_in': p_in})
+	process = corec_init(directory, *args, **kwargs)
+	assert process.returncode == 0, process.output
+	assert read_parameters(directory)['OUT'] == p_in + '-out'
+
+def test_hit_and_miss(tmp_path):
+	run_again(tmp_path, 'in', cache=True)
+	assert runs(tmp_path) == 1
+
+	run_again(tmp_path, 'in', cache=True)
+	assert runs(tmp_path) == 1 # Restored
+
+	run_again(tmp_path, 'other', cache=True)
+	assert runs(tmp_path) == 2 # New input value
+
+	run_again(tmp_path, 'in')
+	assert runs(tmp_path) == 3 # --no-cache
+
+def test_key_includes_the_step(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	monkeypatch.setitem(corec_tools.defaults, 'parameters', {'P': 'p'})
+	nodes = [node(id_, 'Step', bash_commands='make') for id_ in ['S1', 'S2']]
+	pipeline = corec_tools.pipeline_graph({'elements': {'nodes': nodes + [node('P', 'Parameter')],
+		'edges': [edge('S1', 'P', 'Needs_Parameter'), edge('S2', 'P', 'Needs_Parameter')]}})
+
+	keys = [corec_tools.step_cache_key(pipeline, n) for n in nodes]
+	assert keys[0] != keys[1]
+	assert keys[0] == corec_tools.step_cache_key(pipeline, nodes[0])
+
+def test_steps_without_outputs_are_not_cached():
+	nodes = [node('S', 'Step', bash_commands='touch side_effect'), node('T', 'Step', bash_commands='true'), node('O', 'Output')]
+	pipeline = corec_tools.pipeline_graph({'elements': {'nodes': nodes, 'edges': [edge('T', 'O', 'Sets_Outputs')]}})
+
+	assert not corec_tools.step_is_cacheable(pipeline, pipeline.get_node('S'))
+	assert corec_tools.step_is_cacheable(pipeline, pipeline.get_node('T'))
+
+def test_eviction_removes_the_least_recently_used(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	cache_dir = corec_tools.defaults['cache_dir']
+	os.mkdir(cache_dir)
+	entry = json.dumps({'outputs': {}, 'files': [], 'padding': 'x' * 1000})
+	for age, name in enumerate(['new', 'middle', 'old']):
+		filename = os.path.join(cache_dir, name + '.json')
+		with open(filename, 'w') as f:
+			f.write(entry)
+		os.utime(filename, (1000000 - age, 1000000 - age))
+
+	monkeypatch.setitem(corec_tools.defaults, 'cache_max_bytes', 2 * len(entry))
+	corec_tools.evict_step_cache()
+	assert sorted(os.listdir(cache_dir)) == ['middle.json', 'new.json']
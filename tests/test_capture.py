@@ -0,0 +1,52 @@
+'''
+StreamCapture: the output of steps goes to log files, the last lines are kept
+'''
+
+import os
+import time
+
+import corec_testing # Puts the repository on sys.path
+
+import corec_tools
+
+def capture(tmp_path, chunks):
+	'''
+	Write chunks to a pipe that a StreamCapture reads. Returns the capture, its tail and the log filename
+	'''
+	read_fd, write_fd = os.pipe()
+	log = str(tmp_path / 'stdout.log')
+	console = corec_tools.ConsoleTail('', 'test')
+	stream_capture = corec_tools.StreamCapture('stdout', os.fdopen(read_fd, 'rb'), log, console)
+
+	with os.fdopen(write_fd, 'wb') as f:
+		for chunk in chunks:
+			f.write(chunk)
+
+	return stream_capture, stream_capture.join(), log
+
+def test_long_line(tmp_path):
+	'''
+	A line of many megabytes without newlines is logged whole and kept up to log_max_line_bytes in the tail
+	'''
+	long_line = b'x' * (20 * 1024 * 1024)
+	chunks = [b'first\n'] + [long_line[start:start + 1000 * 1000] for start in range(0, len(long_line), 1000 * 1000)] + [b'\nlast']
+
+	start = time.time()
+	stream_capture, tail, log = capture(tmp_path, chunks)
+	assert time.time() - start < 30
+
+	max_line = corec_tools.defaults['log_max_line_bytes']
+	assert stream_capture.bytes == len(long_line) + len(b'first\n\nlast')
+	assert os.path.getsize(log) == stream_capture.bytes
+	assert tail == ['first', 'x' * max_line, 'last']
+
+def test_tail_keeps_the_last_lines(tmp_path):
+	lines = [('line {}'.format(i)).encode('utf-8') for i in range(1000)]
+	output = b'\n'.join(lines) + b'\n'
+	# Lines are split between chunks
+	stream_capture, tail, log = capture(tmp_path, [output[start:start + 777] for start in range(0, len(output), 777)])
+
+	tail_lines = corec_tools.defaults['log_tail_lines']
+	assert tail == [line.decode('utf-8') for line in lines[-tail_lines:]]
+	with open(log, 'rb') as f:
+		assert f.read() == output
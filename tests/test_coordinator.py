@@ -0,0 +1,50 @@
+'''
+corec_init --coordinator and the corec_worker processes that run its steps
+'''
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+from corec_testing import REPO_DIR, TOKEN, diamond_pipeline, single_step_pipeline, environment, write_pipeline, read_parameters, \
+	corec_init, free_port
+
+import corec_tools
+
+def run_with_worker(directory, *args):
+	'''
+	corec_init --coordinator with one corec_worker. Returns the corec_init process
+	'''
+	address = '127.0.0.1:{}'.format(free_port())
+	worker = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'corec_worker'), address, '--jobs', '2'],
+		cwd=str(directory), env=environment(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	try:
+		process = corec_init(directory, '--coordinator', address, *args)
+		worker.communicate(timeout=30) # Workers exit when the coordinator finishes
+	finally:
+		if worker.poll() is None:
+			worker.kill()
+			worker.wait()
+	return process
+
+def test_diamond(tmp_path):
+	write_pipeline(tmp_path, diamond_pipeline(), {'P_in': 'in'})
+	process = run_with_worker(tmp_path, '--jobs', '2')
+	assert process.returncode == 0, process.output
+	assert read_parameters(tmp_path)['OUT'] == 'in-x-y+in-x-z'
+
+def test_locks_are_refused_on_workers(tmp_path):
+	write_pipeline(tmp_path, single_step_pipeline('corec_lock L\ncorec_set O x\n'))
+	process = run_with_worker(tmp_path)
+	assert process.returncode != 0
+	assert 'Locks are not supported in steps that run on a corec_worker' in process.output
+	assert not 'O' in read_parameters(tmp_path)
+
+def test_rejects_wrong_token(tmp_path):
+	coordinator = corec_tools.CORECCoordinator(('127.0.0.1', 0), TOKEN)
+	assert coordinator.handle({'op': 'ping', 'token': TOKEN})
+	for request in [{'op': 'ping'}, {'op': 'ping', 'token': 'wrong'}, {'op': 'register', 'args': ['w', 1], 'token': None}]:
+		with pytest.raises(corec_tools.CORECException):
+			coordinator.handle(request)
@@ -0,0 +1,37 @@
+'''
+corec_init --daemon and the daemon socket protocol
+'''
+
+import pytest
+
+from corec_testing import diamond_pipeline, write_pipeline, read_parameters, corec_init
+
+import corec_tools
+
+def test_diamond(tmp_path):
+	write_pipeline(tmp_path, diamond_pipeline(), {'P_in': 'in'})
+	process = corec_init(tmp_path, '--daemon', '--jobs', '2')
+	assert process.returncode == 0, process.output
+	assert read_parameters(tmp_path)['OUT'] == 'in-x-y+in-x-z'
+
+def test_client(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	store = corec_tools.JSONParameterStore('parameters.json')
+	store.set('a', 'A')
+	daemon = corec_tools.CORECDaemon('daemon.sock', store)
+	daemon.start()
+	try:
+		client = corec_tools.DaemonClient('daemon.sock')
+		assert client.is_alive()
+		client.set_many({'b': 'B'})
+		client.merge('a', 'c')
+		assert client.get_all() == {'a': 'A', 'b': 'B', 'c': 'A'}
+		with pytest.raises(corec_tools.CORECException):
+			client.request('export_json', '/tmp/anywhere.json') # Not an operation
+
+		client.export_json('exported.json') # Written by the client
+		assert corec_tools.JSONParameterStore('exported.json').get_all() == {'a': 'A', 'b': 'B', 'c': 'A'}
+	finally:
+		daemon.stop()
+
+	assert store.get_all() == {'a': 'A', 'b': 'B', 'c': 'A'} # Flushed when it stops
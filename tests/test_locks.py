@@ -0,0 +1,82 @@
+'''
+Locks are held by processes. They are released by corec_unlock or when the process group that took them is gone
+'''
+
+import os
+import json
+import time
+import subprocess
+
+from corec_testing import node, edge, single_step_pipeline, environment, write_pipeline, read_parameters, corec_init, run_command
+
+def lock_value(directory, lock_name):
+	return run_command(directory, 'corec_get_lock', lock_name).output.strip()
+
+def test_lock_and_unlock(tmp_path):
+	assert run_command(tmp_path, 'corec_lock', 'L').output.strip() == '1'
+	assert lock_value(tmp_path, 'L') == '1'
+	assert run_command(tmp_path, 'corec_lock', 'other lock').output.strip() == '2'
+
+	run_command(tmp_path, 'corec_unlock', 'L')
+	assert lock_value(tmp_path, 'L') == '0'
+	assert lock_value(tmp_path, 'other lock') == '1'
+	run_command(tmp_path, 'corec_unlock', 'other lock')
+	assert lock_value(tmp_path, 'other lock') == '0'
+
+def test_released_when_the_owner_is_gone(tmp_path):
+	'''
+	The lock of a shell that has exited, and the lock of a holder that was killed.
+	The shells have their own process groups, like steps
+	'''
+	subprocess.check_call(['bash', '-c', 'corec_lock L1 > /dev/null'], cwd=str(tmp_path), env=environment(), start_new_session=True)
+	owner = subprocess.Popen(['bash', '-c', 'corec_lock L2 > /dev/null; exec sleep 60'], cwd=str(tmp_path), env=environment(), start_new_session=True)
+	try:
+		deadline = time.time() + 10
+		while lock_value(tmp_path, 'L2') != '1' and time.time() < deadline:
+			time.sleep(0.1)
+
+		with open(str(tmp_path / 'corec_locks.json')) as f:
+			os.kill(json.load(f)['L2']['holder'], 9)
+
+		start = time.time()
+		process = run_command(tmp_path, 'corec_get_lock', '--wait', '--timeout', '10', 'L1')
+		assert process.output.strip() == '0'
+		assert time.time() - start < 5
+		assert lock_value(tmp_path, 'L2') == '0'
+	finally:
+		owner.kill()
+		owner.wait()
+
+def test_wait_with_timeout(tmp_path):
+	owner = subprocess.Popen(['bash', '-c', 'corec_lock L > /dev/null; exec sleep 60'], cwd=str(tmp_path), env=environment(), start_new_session=True)
+	try:
+		deadline = time.time() + 10
+		while lock_value(tmp_path, 'L') != '1' and time.time() < deadline:
+			time.sleep(0.1)
+		process = run_command(tmp_path, 'corec_get_lock', '--wait', '--timeout', '0.5', 'L')
+		assert process.output.strip() == '1'
+	finally:
+		owner.kill()
+		owner.wait()
+
+def test_pipeline_waits_for_the_release(tmp_path):
+	'''
+	The step returns at once. Its background job sets the output and releases the lock
+	'''
+	commands = 'echo run >> runs.txt\ncorec_lock L\n(sleep 1; corec_set O done; corec_unlock L) > /dev/null 2>&1 &\n'
+	write_pipeline(tmp_path, single_step_pipeline(commands))
+	process = corec_init(tmp_path)
+	assert process.returncode == 0, process.output
+	assert read_parameters(tmp_path)['O'] == 'done'
+	with open(str(tmp_path / 'runs.txt')) as f:
+		assert len(f.readlines()) == 1
+
+def test_pipeline_reruns_after_a_crashed_holder(tmp_path):
+	'''
+	The first time, the background job dies without corec_unlock. The lock is released and the step runs again
+	'''
+	commands = 'if [ -e first ]; then corec_set O second; else\ntouch first\ncorec_lock L\n(sleep 1; exit 1) > /dev/null 2>&1 &\nfi\n'
+	write_pipeline(tmp_path, single_step_pipeline(commands))
+	process = corec_init(tmp_path, timeout=60)
+	assert process.returncode == 0, process.output
+	assert read_parameters(tmp_path)['O'] == 'second'
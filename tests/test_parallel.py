@@ -0,0 +1,42 @@
+'''
+corec_init --jobs and the resource budget
+'''
+
+import os
+
+import pytest
+
+from corec_testing import node, edge, diamond_pipeline, write_pipeline, read_parameters, corec_init
+
+def overlap_pipeline():
+	'''
+	B and C write when they start and finish
+	'''
+	nodes = [node('X', 'Parameter'), node('Y', 'Output'), node('Z', 'Output'),
+		node('A', 'Step', bash_commands='corec_set X x\n')]
+	edges = [edge('A', 'X', 'Sets_Outputs')]
+	for id_, output in [('B', 'Y'), ('C', 'Z')]:
+		commands = 'date +%s.%N > {0}.start\nsleep 1\ndate +%s.%N > {0}.end\ncorec_set {1} "$(corec_get X)"\n'.format(id_, output)
+		nodes.append(node(id_, 'Step', bash_commands=commands))
+		edges += [edge(id_, 'X', 'Needs_Parameter'), edge(id_, output, 'Sets_Outputs')]
+	return {'elements': {'nodes': nodes, 'edges': edges}}
+
+def read_time(directory, filename):
+	with open(os.path.join(str(directory), filename)) as f:
+		return float(f.read())
+
+@pytest.mark.parametrize('args', [[], ['--jobs', '2'], ['--max-cores', '2']], ids=['serial', 'jobs', 'max-cores'])
+def test_diamond(tmp_path, args):
+	write_pipeline(tmp_path, diamond_pipeline(), {'P_in': 'in'})
+	process = corec_init(tmp_path, *args)
+	assert process.returncode == 0, process.output
+	assert read_parameters(tmp_path)['OUT'] == 'in-x-y+in-x-z'
+
+@pytest.mark.parametrize('args, parallel', [([], False), (['--jobs', '2'], True)], ids=['serial', 'jobs'])
+def test_independent_steps_overlap(tmp_path, args, parallel):
+	write_pipeline(tmp_path, overlap_pipeline())
+	process = corec_init(tmp_path, *args)
+	assert process.returncode == 0, process.output
+
+	overlap = min(read_time(tmp_path, 'B.end'), read_time(tmp_path, 'C.end')) > max(read_time(tmp_path, 'B.start'), read_time(tmp_path, 'C.start'))
+	assert overlap == parallel
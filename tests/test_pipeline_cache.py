@@ -0,0 +1,67 @@
+'''
+The pickled pipeline cache is used only while pipeline.json is unchanged
+'''
+
+import os
+import pickle
+
+from corec_testing import single_step_pipeline, write_pipeline
+
+import corec_tools
+
+def count_compiles(monkeypatch):
+	compiles = []
+	compile_pipeline = corec_tools.compile_pipeline
+	def counting(pipeline):
+		compiles.append(1)
+		return compile_pipeline(pipeline)
+	monkeypatch.setattr(corec_tools, 'compile_pipeline', counting)
+	return compiles
+
+def step_ids(pipeline):
+	return [corec_tools.get_id(n) for n in pipeline.get_nodes('Step')]
+
+def test_cache_hit_and_invalidation(workdir, monkeypatch):
+	compiles = count_compiles(monkeypatch)
+	write_pipeline(workdir, single_step_pipeline('true'))
+	assert step_ids(corec_tools.load_pipeline()) == ['S']
+	assert os.path.isfile(corec_tools.defaults['pipeline_cache_filename'])
+
+	assert step_ids(corec_tools.load_pipeline()) == ['S']
+	assert len(compiles) == 1
+
+	stat = os.stat('pipeline.json')
+	with open('pipeline.json') as f:
+		content = f.read()
+	with open('pipeline.json', 'w') as f:
+		f.write(content.replace('"S"', '"T"')) # Same size
+	os.utime('pipeline.json', (stat.st_atime, stat.st_mtime + 5))
+	assert step_ids(corec_tools.load_pipeline()) == ['T']
+	assert len(compiles) == 2
+
+	os.utime('pipeline.json', (stat.st_atime, stat.st_mtime + 10)) # Touched: the digest still matches
+	assert step_ids(corec_tools.load_pipeline()) == ['T']
+	assert len(compiles) == 2
+
+def test_unusable_cache_is_recompiled(workdir, monkeypatch):
+	compiles = count_compiles(monkeypatch)
+	write_pipeline(workdir, single_step_pipeline('true'))
+	corec_tools.load_pipeline()
+	cache_filename = corec_tools.defaults['pipeline_cache_filename']
+
+	with open(cache_filename, 'rb') as f:
+		entry = pickle.load(f)
+	entry['version'] = (corec_tools.PIPELINE_CACHE_VERSION - 1, entry['version'][1])
+	with open(cache_filename, 'wb') as f:
+		pickle.dump(entry, f)
+	assert step_ids(corec_tools.load_pipeline()) == ['S']
+	assert len(compiles) == 2
+
+	with open(cache_filename, 'wb') as f:
+		f.write(b'truncated')
+	assert step_ids(corec_tools.load_pipeline()) == ['S']
+	assert len(compiles) == 3
+
+	monkeypatch.setitem(corec_tools.defaults, 'pipeline_cache', False)
+	corec_tools.load_pipeline()
+	assert len(compiles) == 4
@@ -0,0 +1,141 @@
+'''
+The report: the journal of fragments, the archive and the files in it
+'''
+
+import os
+import threading
+
+import pytest
+
+import corec_tools
+
+def read_html():
+	with open(corec_tools.report_html_fn()) as f:
+		return f.read()
+
+def test_fragments_in_order(workdir):
+	corec_tools.report_init()
+	corec_tools.report_add('first {content} {0}')
+	corec_tools.report_add('second }{')
+	corec_tools.report_write_html(corec_tools.report_fragments())
+
+	html = read_html()
+	assert html.index('<p>first {content} {0}</p>') < html.index('<p>second }{</p>')
+
+def test_parallel_writers(workdir):
+	corec_tools.report_init()
+
+	def write(thread):
+		for i in range(50):
+			corec_tools.report_add('thread {} entry {}'.format(thread, i))
+
+	threads = [threading.Thread(target=write, args=(thread,)) for thread in range(8)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	fragments = list(corec_tools.report_fragments())
+	assert len(fragments) == 8 * 50
+	for thread in range(8):
+		entries = [fragment for fragment in fragments if fragment.startswith('<p>thread {} '.format(thread))]
+		assert entries == ['<p>thread {} entry {}</p>'.format(thread, i) for i in range(50)]
+
+# Archives and artifacts
+
+def archive_members(archive):
+	import tarfile
+
+	if archive.endswith('.tar.zst'):
+		import io
+		import zstandard
+		with open(archive, 'rb') as f:
+			data = zstandard.ZstdDecompressor().stream_reader(f).read()
+		tar = tarfile.open(fileobj=io.BytesIO(data))
+	else:
+		tar = tarfile.open(archive) # gz, xz and none
+	with tar:
+		return dict((member.name, tar.extractfile(member).read()) for member in tar.getmembers() if member.isfile())
+
+@pytest.mark.parametrize('codec, extension', [('gz', '.tar.gz'), ('xz', '.tar.xz'), ('none', '.tar'), ('zst', '.tar.zst')])
+def test_archive_codecs(workdir, monkeypatch, codec, extension):
+	if codec == 'zst':
+		pytest.importorskip('zstandard')
+	monkeypatch.setitem(corec_tools.defaults, 'report_compression_block_size', 64 * 1024) # Many blocks
+
+	os.mkdir('report')
+	content = os.urandom(100 * 1024) + b'text\n' * 100000
+	with open(os.path.join('report', 'data.bin'), 'wb') as f:
+		f.write(content)
+
+	archive = corec_tools.make_tarfile('archive', 'report', codec, threads=4)
+	assert archive == 'archive' + extension
+	assert archive_members(archive) == {'report/data.bin': content}
+
+def write_file(filename, content):
+	with open(filename, 'w') as f:
+		f.write(content)
+
+def test_artifacts_are_deduplicated_by_content(workdir, monkeypatch):
+	monkeypatch.setattr(corec_tools, 'reflink', lambda source, dest: False) # Hard links on every filesystem
+	corec_tools.report_init()
+	os.mkdir('a')
+	os.mkdir('b')
+	write_file('plot.txt', 'same')
+	write_file(os.path.join('a', 'copy.txt'), 'same')
+	write_file(os.path.join('b', 'plot.txt'), 'different')
+
+	assert corec_tools.report_artifact('plot.txt') == 'plot.txt'
+	assert corec_tools.report_artifact(os.path.join('a', 'copy.txt')) == 'plot.txt' # Same content, other name
+	assert corec_tools.report_artifact('plot.txt') == 'plot.txt'
+
+	name = corec_tools.report_artifact(os.path.join('b', 'plot.txt')) # Same name, other content
+	assert name.startswith('plot_') and name.endswith('.txt')
+	assert corec_tools.report_artifact(os.path.join('b', 'plot.txt')) == name
+
+	assert sorted(os.listdir(corec_tools.report_dir())) == sorted(['index.html', 'plot.txt', name])
+	assert os.stat('plot.txt').st_ino == os.stat(os.path.join(corec_tools.report_dir(), 'plot.txt')).st_ino # Linked, not copied
+
+def test_link_or_copy(workdir, monkeypatch):
+	monkeypatch.setattr(corec_tools, 'reflink', lambda source, dest: False)
+	write_file('source.txt', 'content')
+
+	assert corec_tools.link_or_copy('source.txt', 'linked.txt') == 'hard link'
+	assert os.path.samefile('source.txt', 'linked.txt')
+
+	monkeypatch.setitem(corec_tools.defaults, 'report_hard_links', False)
+	assert corec_tools.link_or_copy('source.txt', 'copied.txt') == 'copy'
+	assert not os.path.samefile('source.txt', 'copied.txt')
+	with open('copied.txt') as f:
+		assert f.read() == 'content'
+
+# Previews of large text files
+
+def test_small_text_is_embedded_whole(workdir):
+	write_file('small.log', 'line 1\nline 2\n')
+	assert corec_tools.text_preview('small.log') == 'line 1\nline 2\n'
+
+def test_large_text_preview(workdir, monkeypatch):
+	monkeypatch.setitem(corec_tools.defaults, 'report_max_embed_bytes', 10000)
+	monkeypatch.setitem(corec_tools.defaults, 'report_head_lines', 3)
+	monkeypatch.setitem(corec_tools.defaults, 'report_tail_lines', 2)
+	lines = ['line {}'.format(i) for i in range(100000)]
+	write_file('large.vcf', '\n'.join(lines) + '\n')
+
+	head = 'line 0\nline 1\nline 2\n'
+	tail = 'line 99998\nline 99999\n'
+	omitted = os.path.getsize('large.vcf') - len(head) - len(tail)
+	assert corec_tools.text_preview('large.vcf') == '{}\n... {} bytes omitted, see the full file ...\n\n{}'.format(
+		head.rstrip('\n'), omitted, tail)
+
+def test_report_links_large_text(workdir, monkeypatch):
+	monkeypatch.setitem(corec_tools.defaults, 'report_max_embed_bytes', 10000)
+	corec_tools.report_init()
+	write_file('large.out', 'x <tag>\n' * 100000)
+
+	corec_tools.report_add('large.out')
+	fragment = list(corec_tools.report_fragments())[-1]
+	assert '<a href="large.out">large.out</a>' in fragment
+	assert 'bytes omitted' in fragment
+	assert '&lt;tag&gt;' in fragment and not '<tag>' in fragment
+	assert len(fragment) < 20000
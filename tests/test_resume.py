@@ -0,0 +1,53 @@
+'''
+corec_init --resume after a failed step
+'''
+
+import os
+import json
+
+from corec_testing import node, edge, write_pipeline, read_parameters, corec_init
+
+def chain_pipeline():
+	'''
+	A --> X --> B --> OUT. B fails while the file "fail" exists
+	'''
+	nodes = [node('X', 'Parameter'), node('OUT', 'Output'),
+		node('A', 'Step', bash_commands='echo A >> runs.txt\ncorec_set X x\n'),
+		node('B', 'Step', bash_commands='echo B >> runs.txt\ntest ! -e fail\ncorec_set OUT "$(corec_get X)-out"\n')]
+	edges = [edge('A', 'X', 'Sets_Outputs'), edge('B', 'X', 'Needs_Parameter'), edge('B', 'OUT', 'Sets_Outputs')]
+	return {'elements': {'nodes': nodes, 'edges': edges}}
+
+def read_lines(directory, filename):
+	with open(os.path.join(str(directory), filename)) as f:
+		return [line.strip() for line in f]
+
+def test_resume_after_failed_step(tmp_path):
+	write_pipeline(tmp_path, chain_pipeline())
+	open(str(tmp_path / 'fail'), 'w').close()
+
+	process = corec_init(tmp_path)
+	assert process.returncode != 0
+	assert read_lines(tmp_path, 'runs.txt') == ['A', 'B']
+	report_dir = read_parameters(tmp_path)['corec_report_dir']
+
+	os.remove(str(tmp_path / 'fail'))
+	process = corec_init(tmp_path, '--resume')
+	assert process.returncode == 0, process.output
+	assert read_lines(tmp_path, 'runs.txt') == ['A', 'B', 'B']
+
+	parameters = read_parameters(tmp_path)
+	assert parameters['OUT'] == 'x-out'
+	assert parameters['corec_report_dir'] == report_dir # The report of the first run goes on
+
+	journal = [json.loads(line) for line in read_lines(tmp_path, 'corec_journal.log')]
+	events = [(entry['event'], entry['kind'], entry['id']) for entry in journal]
+	assert events[0] == ('start', 'run', None)
+	assert ('finish', 'step', 'A') in events
+	assert events.index(('resume', 'run', None)) > events.index(('start', 'step', 'B'))
+	assert events[-2:] == [('finish', 'step', 'B'), ('finish', 'run', None)]
+
+def test_resume_needs_a_journal(tmp_path):
+	write_pipeline(tmp_path, chain_pipeline())
+	process = corec_init(tmp_path, '--resume')
+	assert process.returncode != 0
+	assert 'Cannot resume' in process.output
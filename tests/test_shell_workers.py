@@ -0,0 +1,53 @@
+'''
+corec_init --shell-workers: steps run in long lived bash processes
+'''
+
+import pytest
+
+from corec_testing import diamond_pipeline, single_step_pipeline, write_pipeline, read_parameters, corec_init, wait_until_gone
+
+import corec_tools
+
+def test_diamond(tmp_path):
+	write_pipeline(tmp_path, diamond_pipeline(), {'P_in': 'in'})
+	process = corec_init(tmp_path, '--shell-workers', '--jobs', '2')
+	assert process.returncode == 0, process.output
+	assert read_parameters(tmp_path)['OUT'] == 'in-x-y+in-x-z'
+
+@pytest.fixture
+def pool(workdir, monkeypatch):
+	monkeypatch.setitem(corec_tools.defaults, 'kill_grace_seconds', 0.5)
+	pool = corec_tools.ShellWorkerPool()
+	yield pool
+	pool.stop()
+
+def test_worker_is_reused(pool):
+	assert pool.run('echo $$ > pid\nexit 0\n', 'first')['return_code'] == 0
+	assert pool.run('echo $$ > pid2\n', 'second')['return_code'] == 0
+	assert len(pool.workers) == 1
+	with open('pid') as f1, open('pid2') as f2:
+		assert f1.read() == f2.read()
+
+def test_failed_step_is_killed_with_its_worker(pool):
+	'''
+	The background job of a failed step dies with the process group of the worker. A fresh worker takes its place
+	'''
+	marker = '3174.5'
+	pool.run('true', 'first')
+	worker = pool.workers[0]
+
+	result = pool.run('sleep {} &\nexit 3\n'.format(marker), 'failed')
+	assert result['return_code'] == 3
+	assert wait_until_gone(marker, 5) == []
+	assert worker.process.poll() is not None
+
+	assert [w.process.poll() for w in pool.workers] == [None]
+	assert pool.workers[0] is not worker
+	assert pool.run('echo ok\n', 'next')['stdout_tail'] == ['ok']
+
+def test_failed_step_in_a_run(tmp_path):
+	marker = '3174.6'
+	write_pipeline(tmp_path, single_step_pipeline("(trap '' TERM; sleep {}) &\nexit 3\n".format(marker)))
+	process = corec_init(tmp_path, '--shell-workers', timeout=60)
+	assert process.returncode != 0
+	assert wait_until_gone(marker, 5) == []
@@ -0,0 +1,85 @@
+'''
+The json and sqlite parameter stores
+'''
+
+import os
+import json
+
+import pytest
+
+from corec_testing import node, edge, diamond_pipeline, write_pipeline, read_parameters, corec_init, run_command
+
+import corec_tools
+
+@pytest.mark.parametrize('store_class, filename', [
+	(corec_tools.JSONParameterStore, 'parameters.json'),
+	(corec_tools.SQLiteParameterStore, 'parameters.sqlite'),
+])
+def test_operations(workdir, store_class, filename):
+	store = store_class(filename)
+	store.set('a', 'A')
+	store.set_many({'b': [1, 2], 'c': {'x': None}})
+	store.merge('a', 'd')
+	with pytest.raises(corec_tools.CORECException):
+		store.merge('missing', 'e')
+
+	assert store.get('a') == 'A'
+	assert store.get('missing', 'default') == 'default'
+	assert store.get_many(['b', 'd', 'missing']) == {'b': [1, 2], 'd': 'A'}
+	assert store.get_all() == {'a': 'A', 'b': [1, 2], 'c': {'x': None}, 'd': 'A'}
+
+	store.export_json('exported.json')
+	with open('exported.json') as f:
+		assert json.load(f) == store.get_all()
+
+def test_selection_and_moves(workdir):
+	assert corec_tools.get_parameter_store().name == 'json'
+	corec_tools.update_parameters({'a': 'A'})
+
+	corec_tools.use_parameter_store('sqlite')
+	assert os.path.isfile(corec_tools.defaults['parameters_sqlite_filename'])
+	assert corec_tools.get_parameter_store().name == 'sqlite' # Selected by the existing file
+	corec_tools.update_parameters({'b': 'B'})
+	assert corec_tools.get_parameter_store().get_all() == {'a': 'A', 'b': 'B'}
+
+	corec_tools.use_parameter_store('json')
+	assert not os.path.exists(corec_tools.defaults['parameters_sqlite_filename'])
+	assert corec_tools.get_parameter_store().name == 'json'
+	assert read_parameters(workdir) == {'a': 'A', 'b': 'B'}
+
+def test_sqlite_run_exports_json(tmp_path):
+	write_pipeline(tmp_path, diamond_pipeline(), {'P_in': 'in'})
+	process = corec_init(tmp_path, '--parameter-store', 'sqlite')
+	assert process.returncode == 0, process.output
+	assert os.path.isfile(str(tmp_path / 'corec_parameters.sqlite'))
+	assert read_parameters(tmp_path)['OUT'] == 'in-x-y+in-x-z'
+
+	process = run_command(tmp_path, 'corec_get', 'OUT')
+	assert process.output.strip() == 'in-x-y+in-x-z'
+
+def test_sqlite_json_after_failed_run_and_edits(tmp_path):
+	'''
+	The json file is exported after a failed run too. Editing it is an error, not silently ignored
+	'''
+	nodes = [node('X', 'Parameter'), node('OUT', 'Output'),
+		node('A', 'Step', bash_commands='corec_set X x\n'), node('B', 'Step', bash_commands='exit 1\n')]
+	edges = [edge('A', 'X', 'Sets_Outputs'), edge('B', 'X', 'Needs_Parameter'), edge('B', 'OUT', 'Sets_Outputs')]
+	write_pipeline(tmp_path, {'elements': {'nodes': nodes, 'edges': edges}})
+
+	process = corec_init(tmp_path, '--parameter-store', 'sqlite')
+	assert process.returncode != 0
+	assert read_parameters(tmp_path)['X'] == 'x'
+
+	parameters = read_parameters(tmp_path)
+	parameters['X'] = 'edited'
+	with open(str(tmp_path / 'corec_parameters.json'), 'w') as f:
+		json.dump(parameters, f)
+
+	process = run_command(tmp_path, 'corec_get', 'X')
+	assert process.returncode != 0
+	assert 'has changed after it was exported' in process.output
+
+	os.remove(str(tmp_path / 'corec_parameters.json'))
+	process = run_command(tmp_path, 'corec_get', 'X')
+	assert process.returncode == 0, process.output
+	assert process.output.strip() == 'x'
@@ -0,0 +1,59 @@
+'''
+corec_init --target and --pipeline run only the steps that their outputs need
+'''
+
+import json
+
+from corec_testing import node, diamond_pipeline, write_pipeline, read_parameters, corec_init
+
+def nested_pipeline():
+	'''
+	The diamond, with B in the Pipeline node "sub" (label "Left branch") inside "root"
+	'''
+	pipeline = diamond_pipeline()
+	nodes = pipeline['elements']['nodes']
+	for n in nodes:
+		if n['data']['id'] == 'B':
+			n['data']['parent'] = 'sub'
+	nodes.append(node('sub', 'Pipeline', label='Left branch', parent='root'))
+	return pipeline
+
+def set_parameters(directory):
+	return set(parameter for parameter in read_parameters(directory) if not parameter.startswith('corec_'))
+
+def test_target_runs_its_upstream_closure(tmp_path):
+	write_pipeline(tmp_path, diamond_pipeline(), {'P_in': 'in'})
+	process = corec_init(tmp_path, '--target', 'Y')
+	assert process.returncode == 0, process.output
+	assert set_parameters(tmp_path) == set(['P_in', 'X', 'Y'])
+	assert read_parameters(tmp_path)['Y'] == 'in-x-y'
+
+	# A and B are not run again: their outputs are set
+	parameters = read_parameters(tmp_path)
+	parameters['P_in'] = 'other'
+	with open(str(tmp_path / 'corec_parameters.json'), 'w') as f:
+		json.dump(parameters, f)
+	process = corec_init(tmp_path, '--target', 'OUT')
+	assert process.returncode == 0, process.output
+	assert read_parameters(tmp_path)['OUT'] == 'in-x-y+in-x-z'
+
+def test_pipeline_by_label_and_by_id(tmp_path):
+	write_pipeline(tmp_path, nested_pipeline(), {'P_in': 'in'})
+	process = corec_init(tmp_path, '--pipeline', 'Left branch')
+	assert process.returncode == 0, process.output
+	assert set_parameters(tmp_path) == set(['P_in', 'X', 'Y'])
+
+	write_pipeline(tmp_path, nested_pipeline(), {'P_in': 'in'})
+	process = corec_init(tmp_path, '--pipeline', 'root')
+	assert process.returncode == 0, process.output
+	assert set_parameters(tmp_path) == set(['P_in', 'X', 'Y']) # A, and B in the nested "sub"
+
+def test_unknown_targets(tmp_path):
+	write_pipeline(tmp_path, diamond_pipeline(), {'P_in': 'in'})
+	for args, message in [(['--target', 'missing'], 'does not contain parameter or output: missing'),
+			(['--target', 'B'], 'does not contain parameter or output: B'),
+			(['--pipeline', 'missing'], 'does not contain pipeline node: missing')]:
+		process = corec_init(tmp_path, *args)
+		assert process.returncode != 0
+		assert message in process.output
+	assert set_parameters(tmp_path) == set(['P_in'])
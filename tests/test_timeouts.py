@@ -0,0 +1,67 @@
+'''
+Timeouts of the run, failed steps and signals: no step or child of a step outlives corec_init
+'''
+
+import os
+import sys
+import time
+import subprocess
+
+from corec_testing import REPO_DIR, single_step_pipeline, environment, write_pipeline, corec_init, processes_with, wait_until_gone
+
+def test_timeout_kills_the_step_and_its_children(tmp_path):
+	marker = '3171.5'
+	write_pipeline(tmp_path, single_step_pipeline('sleep {0} &\nsleep {0}\ncorec_set O x\n'.format(marker)))
+
+	start = time.time()
+	process = corec_init(tmp_path, '--timeout', '2')
+	assert process.returncode != 0
+	assert time.time() - start < 30, process.output
+	assert 'timeout' in process.output
+	assert wait_until_gone(marker, 5) == []
+
+def test_timeout_while_waiting_for_locks(tmp_path):
+	'''
+	The background job of the step keeps its process group, and so the lock, alive
+	'''
+	marker = '3171.6'
+	write_pipeline(tmp_path, single_step_pipeline('corec_lock L\n(sleep {}) > /dev/null 2>&1 &\n'.format(marker)))
+	try:
+		start = time.time()
+		process = corec_init(tmp_path, '--timeout', '3')
+		assert process.returncode != 0
+		assert time.time() - start < 30, process.output
+		assert 'The run has exceeded its timeout' in process.output
+	finally:
+		for pid in processes_with(marker):
+			os.kill(pid, 9)
+
+def test_failed_step_does_not_leave_children(tmp_path):
+	'''
+	The background child ignores SIGTERM and holds the stdout of the step. It gets SIGKILL after the grace period
+	'''
+	marker = '3172.5'
+	write_pipeline(tmp_path, single_step_pipeline("trap '' TERM\n(trap '' TERM; sleep {}) &\nsleep 0.5\nexit 3\n".format(marker)))
+
+	start = time.time()
+	process = corec_init(tmp_path, timeout=60)
+	assert process.returncode != 0
+	assert time.time() - start < 30, process.output
+	assert wait_until_gone(marker, 5) == []
+
+def test_sigterm_kills_the_running_steps(tmp_path):
+	marker = '3173.5'
+	write_pipeline(tmp_path, single_step_pipeline('sleep {}\ncorec_set O x\n'.format(marker)))
+
+	command = [sys.executable, os.path.join(REPO_DIR, 'corec_init'), '--no-cache']
+	process = subprocess.Popen(command, cwd=str(tmp_path), env=environment(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	deadline = time.time() + 30
+	while not processes_with(marker) and time.time() < deadline:
+		time.sleep(0.1)
+	assert processes_with(marker)
+
+	process.terminate()
+	output = process.communicate(timeout=30)[0].decode('utf-8', 'replace')
+	assert process.returncode != 0
+	assert 'Received signal' in output
+	assert wait_until_gone(marker, 5) == []
@@ -0,0 +1,43 @@
+'''
+Tools are installed again only when their installation commands or the platform change
+'''
+
+import os
+
+from corec_testing import node, edge, write_pipeline, corec_init
+
+def tool_pipeline(installation, requires='corec_requires T'):
+	'''
+	The step S requires the tool T
+	'''
+	nodes = [node('T', 'Tool', installation=installation), node('O', 'Output'),
+		node('S', 'Step', bash_commands='{}\ncorec_set O x\n'.format(requires))]
+	return {'elements': {'nodes': nodes, 'edges': [edge('S', 'O', 'Sets_Outputs')]}}
+
+def install(directory, installation, **kwargs):
+	write_pipeline(directory, tool_pipeline(installation, **kwargs))
+	return corec_init(directory)
+
+def installations(directory):
+	with open(os.path.join(str(directory), 'installs.txt')) as f:
+		return f.read().split()
+
+def test_fingerprint_skips_and_reinstalls(tmp_path):
+	for _ in range(2):
+		process = install(tmp_path, 'echo first >> installs.txt\n')
+		assert process.returncode == 0, process.output
+	assert installations(tmp_path) == ['first']
+
+	process = install(tmp_path, 'echo second >> installs.txt\n')
+	assert process.returncode == 0, process.output
+	assert installations(tmp_path) == ['first', 'second']
+
+	process = install(tmp_path, 'echo second >> installs.txt\n', requires='corec_requires --force T')
+	assert process.returncode == 0, process.output
+	assert installations(tmp_path) == ['first', 'second', 'second']
+
+def test_failed_installation_is_not_recorded(tmp_path):
+	for _ in range(2):
+		process = install(tmp_path, 'echo run >> installs.txt\nexit 1\n')
+		assert process.returncode != 0
+	assert installations(tmp_path) == ['run', 'run']